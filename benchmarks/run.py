@@ -0,0 +1,310 @@
+# run.py
+#
+# Time and memory-profile every tsstk tool on synthetic inputs of growing size.
+#
+#   python -m benchmarks.run -o results.json
+#   python -m benchmarks.run -b combine,bedgraph --scales 1,4,16 --compare results.json
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import resource
+import importlib
+import subprocess
+import contextlib
+import collections
+import multiprocessing
+import concurrent.futures
+
+import click
+import numpy as np
+
+from benchmarks import synthetic
+
+# A benchmark case: the tool to call, how to build its input at a given size,
+# the input size at scale 1 and the unit that size is counted in. ``kind`` is
+# 'command' for click commands (called with CLI arguments) or 'function'.
+Case = collections.namedtuple('Case', ['module', 'attr', 'kind', 'prepare', 'base_size', 'unit'])
+
+
+def _assign(workdir, rng, size):
+    clusters = synthetic.cluster_table(os.path.join(workdir, 'clusters.txt'), rng, size)
+    genes = synthetic.gene_region_table(os.path.join(workdir, 'genes.txt'), rng, max(1, size // 4))
+    return ['-c', clusters, '-g', genes, '-o', os.path.join(workdir, 'assigned.txt')]
+
+
+def _combine(workdir, rng, size):
+    tables = synthetic.sample_tables(workdir, rng, 4, size)
+    return tables + ['-o', os.path.join(workdir, 'combined.txt')]
+
+
+def _bedgraph(workdir, rng, size):
+    table = synthetic.tss_table(os.path.join(workdir, 'tss.txt'), rng, size)
+    return ['-i', table, '--prefix', os.path.join(workdir, 'out')]
+
+
+def _cluster(workdir, rng, size):
+    table = synthetic.tss_table(os.path.join(workdir, 'tss.txt'), rng, size)
+    return ['--tsstable', table, '-o', os.path.join(workdir, 'clusters.txt'), '-p', '1']
+
+
+def _gettss(workdir, rng, size):
+    bam = synthetic.bam(os.path.join(workdir, 'reads.bam'), rng, size)
+    return ['--bam', bam, '-o', os.path.join(workdir, 'tss.txt'), '-p', '1']
+
+
+def _merge_gff3(workdir, rng, size):
+    first = synthetic.gff3(os.path.join(workdir, 'a.gff3'), rng, size // 2)
+    second = synthetic.gff3(os.path.join(workdir, 'b.gff3'), rng, size - size // 2)
+    return [first, second, '-o', os.path.join(workdir, 'merged.gff3')]
+
+
+def _parse_gtf(workdir, rng, size):
+    return [synthetic.gtf(os.path.join(workdir, 'genes.gtf'), rng, size)]
+
+
+def _regions(workdir, rng, size):
+    gff3 = synthetic.gff3(os.path.join(workdir, 'genes.gff3'), rng, size)
+    return ['-i', gff3, '-o', os.path.join(workdir, 'regions.txt')]
+
+
+def _dominant_bed(workdir, rng, size):
+    clusters = synthetic.cluster_table(os.path.join(workdir, 'clusters.txt'), rng, size, assigned=True)
+    return [clusters, 150, 10, os.path.join(workdir, 'dominant.bed')]
+
+
+def _shape(workdir, rng, size):
+    from tsstk import core
+    table = synthetic.tss_table(os.path.join(workdir, 'tss.txt'), rng, size, samples=('S1', 'S2', 'S3', 'S4'))
+    clusters = os.path.join(workdir, 'clusters.txt')
+    core.get_tss_from_table(table, clusters, processes=1)
+    return ['-c', clusters, '-t', table, '-o', os.path.join(workdir, 'shape.txt'), '-p', '2']
+
+
+def _consensus(workdir, rng, size):
+    import pandas as pd
+    paths = []
+    for i in range(4):
+        path = synthetic.cluster_table(os.path.join(workdir, f'clusters{i}.txt'), rng, size)
+        pd.read_csv(path, sep='\t').sort_values(['chr', 'strand', 'start']).to_csv(path, sep='\t', index=False)
+        paths.append(path)
+    return paths + ['-o', os.path.join(workdir, 'consensus.txt'), '--max-distance', '20']
+
+
+def _quantify(workdir, rng, size):
+    regions = os.path.join(workdir, 'regions.txt')
+    synthetic.gene_region_table(regions, rng, max(1, size // 50))
+    tables = synthetic.sample_tables(workdir, rng, 4, size)
+    return ['-r', regions] + tables + ['-o', os.path.join(workdir, 'genes.txt'), '-p', '2']
+
+
+def _pipeline(workdir, rng, size):
+    bams = [synthetic.bam(os.path.join(workdir, f's{i}.bam'), rng, size // 2) for i in (1, 2)]
+    gff3 = synthetic.gff3(os.path.join(workdir, 'genes.gff3'), rng, max(1, size // 100))
+    return ['-b', bams[0], '-b', bams[1], '-g', gff3, '-o', os.path.join(workdir, 'out'), '-p', '2',
+            '--no-checkpoints']
+
+
+def cli_startup(runs):
+    # `python -m tsstk --help` in a new interpreter, start-up included
+    for _ in range(runs):
+        subprocess.run([sys.executable, '-m', 'tsstk', '--help'], capture_output=True, check=True)
+
+
+def _startup(workdir, rng, size):
+    return [size]
+
+
+CASES = {
+    'assign': Case('tsstk.cluster_assigner', 'assign_clusters_to_genes', 'command', _assign, 20_000, 'clusters'),
+    'combine': Case('tsstk.combine_multi_TSS_table', 'process_files', 'command', _combine, 100_000, 'rows/sample'),
+    'bedgraph': Case('tsstk.tssTable2bedGraph', 'process_tss', 'command', _bedgraph, 200_000, 'rows'),
+    'cluster': Case('tsstk.commands', 'gettss', 'command', _cluster, 200_000, 'rows'),
+    'gettss': Case('tsstk.commands', 'gettss', 'command', _gettss, 50_000, 'reads'),
+    'merge-gff3': Case('tsstk.merge_gff3', 'main', 'command', _merge_gff3, 10_000, 'genes'),
+    'parse-gtf': Case('tsstk.intron_stats', 'parse_gtf', 'function', _parse_gtf, 10_000, 'genes'),
+    'regions': Case('tsstk.assign_region_extractor', 'extract_gene_regions', 'command', _regions, 10_000, 'genes'),
+    'dominant-bed': Case('tsstk.cluster2domainantBed', 'process_file', 'function', _dominant_bed, 50_000, 'clusters'),
+    'shape': Case('tsstk.cluster_shape', 'main', 'command', _shape, 200_000, 'rows'),
+    'consensus': Case('tsstk.consensus', 'main', 'command', _consensus, 50_000, 'clusters/sample'),
+    'quantify': Case('tsstk.quantify', 'main', 'command', _quantify, 200_000, 'rows/sample'),
+    'pipeline': Case('tsstk.pipeline', 'pipeline', 'command', _pipeline, 50_000, 'reads'),
+    'startup': Case('benchmarks.run', 'cli_startup', 'function', _startup, 10, 'runs'),
+}
+
+
+def _max_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss survives fork and exec on Linux, so a fresh interpreter would
+    # report the launcher's peak; VmHWM belongs to this process image alone.
+    if who == resource.RUSAGE_SELF and os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(who).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def measure(module, attr, kind, args, repeat):
+    """Run one case ``repeat`` times in this (fresh) process; return timings and memory."""
+    target = getattr(importlib.import_module(module), attr)
+    rss_before = _max_rss_mb(resource.RUSAGE_SELF)
+    timings = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            start = time.perf_counter()
+            if kind == 'command':
+                target.main([str(a) for a in args], standalone_mode=False)
+            else:
+                target(*args)
+            timings.append(time.perf_counter() - start)
+    return {
+        'seconds': min(timings),
+        'seconds_all': timings,
+        'peak_rss_mb': max(_max_rss_mb(resource.RUSAGE_SELF), _max_rss_mb(resource.RUSAGE_CHILDREN)),
+        'rss_increase_mb': _max_rss_mb(resource.RUSAGE_SELF) - rss_before,
+    }
+
+
+def run_case(name, case, size, repeat, seed, workdir):
+    case_dir = os.path.join(workdir, f"{name}.{size}")
+    os.makedirs(case_dir, exist_ok=True)
+    args = case.prepare(case_dir, np.random.default_rng(seed), size)
+    input_bytes = sum(os.path.getsize(a) for a in args if isinstance(a, str) and os.path.isfile(a))
+    # A fresh interpreter per measurement keeps peak RSS free of earlier cases
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        result = executor.submit(measure, case.module, case.attr, case.kind, args, repeat).result()
+    shutil.rmtree(case_dir)
+    result.update({'benchmark': name, 'size': size, 'unit': case.unit, 'input_bytes': input_bytes,
+                   'units_per_second': size / result['seconds'] if result['seconds'] else None})
+    return result
+
+
+def scaling_exponent(sizes, seconds):
+    """Slope of log(time) against log(size): ~1 is linear, ~2 quadratic.
+
+    Timings of a repeated size are averaged into one point, since small scales
+    can round to the same size. None when fewer than two distinct sizes remain.
+    """
+    points = {}
+    for size, s in zip(sizes, seconds):
+        if s and s > 0:
+            points.setdefault(size, []).append(np.log(s))
+    if len(points) < 2:
+        return None
+    try:
+        return float(np.polyfit(np.log(list(points)), [np.mean(v) for v in points.values()], 1)[0])
+    except (np.linalg.LinAlgError, ValueError):
+        return None
+
+
+def run_benchmarks(names, scales, repeat=3, seed=0, workdir=None, log=None):
+    log = log or (lambda message: None)
+    workdir = workdir or tempfile.mkdtemp(prefix='tsstk-bench.')
+    os.makedirs(workdir, exist_ok=True)
+    results, curves = [], {}
+    for name in names:
+        case = CASES[name]
+        rows = []
+        for scale in scales:
+            size = max(1, int(case.base_size * scale))
+            row = run_case(name, case, size, repeat, seed, workdir)
+            log(f"{name:<14} {size:>10} {case.unit:<12} {row['seconds']:>9.3f} s {row['peak_rss_mb']:>9.1f} MB")
+            rows.append(row)
+        results.extend(rows)
+        curves[name] = {
+            'unit': case.unit,
+            'sizes': [r['size'] for r in rows],
+            'seconds': [r['seconds'] for r in rows],
+            'peak_rss_mb': [r['peak_rss_mb'] for r in rows],
+            'scaling_exponent': scaling_exponent([r['size'] for r in rows], [r['seconds'] for r in rows]),
+        }
+    return {'meta': environment(repeat, seed), 'results': results, 'curves': curves}
+
+
+def environment(repeat, seed):
+    from tsstk import __version__
+    return {
+        'tsstk': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'repeat': repeat,
+        'seed': seed,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def compare(current, baseline, threshold=0.25, memory_threshold=0.25):
+    """Pair results by (benchmark, size) and flag time or memory growth beyond the thresholds."""
+    previous = {(r['benchmark'], r['size']): r for r in baseline['results']}
+    rows = []
+    for r in current['results']:
+        old = previous.get((r['benchmark'], r['size']))
+        if old is None:
+            continue
+        time_ratio = r['seconds'] / old['seconds'] if old['seconds'] else float('inf')
+        memory_ratio = r['peak_rss_mb'] / old['peak_rss_mb'] if old['peak_rss_mb'] else float('inf')
+        rows.append({
+            'benchmark': r['benchmark'],
+            'size': r['size'],
+            'time_ratio': time_ratio,
+            'memory_ratio': memory_ratio,
+            'regression': time_ratio > 1 + threshold or memory_ratio > 1 + memory_threshold,
+        })
+    return rows
+
+
+@click.command()
+@click.option('-b', '--benchmarks', 'names', default=','.join(CASES), show_default=True, help='Comma-separated benchmarks to run.')
+@click.option('--scales', default='1,2,4', show_default=True, help='Comma-separated multiples of every benchmark\'s base size.')
+@click.option('-r', '--repeat', type=int, default=3, show_default=True, help='Runs per size; the fastest is reported.')
+@click.option('--seed', type=int, default=0, show_default=True, help='Seed of the synthetic inputs.')
+@click.option('-o', '--output', default=None, help='Write the results and scaling curves as JSON.')
+@click.option('--compare', 'baseline_file', type=click.Path(exists=True, dir_okay=False), default=None, help='Baseline JSON to compare against; exits with 1 on a regression.')
+@click.option('--threshold', type=float, default=0.25, show_default=True, help='Tolerated relative slowdown.')
+@click.option('--memory-threshold', type=float, default=0.25, show_default=True, help='Tolerated relative growth of peak RSS.')
+@click.option('--workdir', type=click.Path(file_okay=False), default=None, help='Directory for the generated inputs [default: a temporary one].')
+def main(names, scales, repeat, seed, output, baseline_file, threshold, memory_threshold, workdir):
+    """Benchmark tsstk tools on synthetic data across input sizes."""
+    names = [n.strip() for n in names.split(',') if n.strip()]
+    unknown = [n for n in names if n not in CASES]
+    if unknown:
+        raise click.BadParameter(f"unknown benchmark(s): {', '.join(unknown)}", param_hint='--benchmarks')
+    scales = [float(s) for s in scales.split(',')]
+
+    cleanup = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix='tsstk-bench.')
+    try:
+        report = run_benchmarks(names, scales, repeat, seed, workdir, log=click.echo)
+    finally:
+        if cleanup:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=1)
+    for name, curve in report['curves'].items():
+        if curve['scaling_exponent'] is not None:
+            click.echo(f"{name}: time ~ size^{curve['scaling_exponent']:.2f}")
+
+    if baseline_file:
+        with open(baseline_file) as f:
+            rows = compare(report, json.load(f), threshold, memory_threshold)
+        for row in rows:
+            flag = 'REGRESSION' if row['regression'] else 'ok'
+            click.echo(f"{row['benchmark']:<14} {row['size']:>10} time x{row['time_ratio']:.2f} "
+                       f"memory x{row['memory_ratio']:.2f} {flag}")
+        if any(row['regression'] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
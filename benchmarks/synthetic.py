@@ -0,0 +1,201 @@
+# synthetic.py
+#
+# Generators of realistic synthetic inputs for the benchmarks. Every generator
+# takes a numpy Generator so that a seed reproduces the same files.
+
+import os
+
+import numpy as np
+import pandas as pd
+import pysam
+
+from tsstk.core import CLUSTER_COLUMNS
+
+# Roughly one promoter per this many bases, like a compact eukaryotic genome
+PROMOTER_SPACING = 2000
+GENE_SPACING = 3000
+
+
+def chromosomes(total_length, n_chroms=8):
+    """Split a genome of ``total_length`` bases into chromosomes of decreasing size."""
+    weights = np.linspace(2, 1, n_chroms)
+    lengths = np.maximum((weights / weights.sum() * total_length).astype(np.int64), 10_000)
+    return [(f"chr{i + 1}", int(length)) for i, length in enumerate(lengths)]
+
+
+def zipf_counts(rng, n, a=1.8, cap=100_000):
+    """Heavy-tailed read counts: most TSS see a read or two, a few see thousands."""
+    return np.minimum(rng.zipf(a, n), cap).astype(np.int64)
+
+
+def promoters(rng, genome, n_promoters):
+    chrom_names = np.array([name for name, _ in genome], dtype=object)
+    lengths = np.array([length for _, length in genome])
+    chrom = rng.choice(len(genome), n_promoters, p=lengths / lengths.sum())
+    pos = (rng.random(n_promoters) * (lengths[chrom] - 200)).astype(np.int64) + 100
+    strand = np.where(rng.random(n_promoters) < 0.5, '+', '-').astype(object)
+    return chrom_names[chrom], pos, strand
+
+
+def tss_positions(rng, n_rows, genome=None):
+    """Return unique (chr, pos, strand) of ~``n_rows`` TSS scattered around promoters, in TSSr order."""
+    n_promoters = max(1, n_rows // 20)
+    genome = genome or chromosomes(n_promoters * PROMOTER_SPACING)
+    chrom, pos, strand = promoters(rng, genome, n_promoters)
+    # TSS spread a few bases to tens of bases around the promoter peak
+    which = rng.integers(0, n_promoters, int(n_rows * 1.3))
+    offset = np.round(rng.laplace(0, 15, len(which))).astype(np.int64)
+    df = pd.DataFrame({'chr': chrom[which], 'pos': np.maximum(1, pos[which] + offset), 'strand': strand[which],
+                       'promoter': which})
+    df = df.drop_duplicates(['chr', 'pos', 'strand']).head(n_rows)
+    return df.sort_values(['strand', 'chr', 'pos'], ignore_index=True)
+
+
+def tss_table(path, rng, n_rows, samples=('S1', 'S2')):
+    """Write a TSSr-style raw TSS table with Zipf-like counts per sample."""
+    df = tss_positions(rng, n_rows)
+    expression = zipf_counts(rng, df['promoter'].max() + 1, a=1.5, cap=1000)
+    for sample in samples:
+        # Samples share promoter activity but differ in sampling noise
+        counts = rng.poisson(expression[df['promoter']] * rng.uniform(0.2, 1.0, len(df)))
+        df[sample] = np.where(counts > 0, counts, zipf_counts(rng, len(df)) * (rng.random(len(df)) < 0.3))
+    df.drop(columns='promoter').to_csv(path, sep='\t', index=False)
+    return path
+
+
+def sample_tables(directory, rng, n_samples, n_rows):
+    """Write one single-sample TSS table per sample; each holds ~70% of a shared TSS universe."""
+    universe = tss_positions(rng, int(n_rows / 0.7))
+    paths = []
+    for i in range(n_samples):
+        df = universe[rng.random(len(universe)) < 0.7][['chr', 'pos', 'strand']]
+        df = df.assign(**{f"sample{i + 1}": zipf_counts(rng, len(df))})
+        path = os.path.join(directory, f"sample{i + 1}.TSS.txt")
+        df.to_csv(path, sep='\t', index=False)
+        paths.append(path)
+    return paths
+
+
+def gene_models(rng, n_genes, genome=None):
+    """Random gene models; genes are placed independently so some overlap or nest."""
+    genome = genome or chromosomes(n_genes * GENE_SPACING)
+    chrom, start, strand = promoters(rng, genome, n_genes)
+    lengths = dict(genome)
+    models = []
+    for i in np.argsort(start, kind='stable'):
+        n_exons = int(rng.integers(1, 7))
+        exon_lengths = rng.integers(80, 600, n_exons)
+        intron_lengths = rng.integers(60, 1500, n_exons - 1)
+        starts = start[i] + np.r_[0, np.cumsum(exon_lengths[:-1] + intron_lengths)]
+        ends = starts + exon_lengths - 1
+        if ends[-1] >= lengths[chrom[i]]:
+            continue
+        models.append((chrom[i], strand[i], f"gene{i + 1}", list(zip(starts.tolist(), ends.tolist()))))
+    models.sort(key=lambda m: (m[0], m[3][0][0]))
+    return models
+
+
+def _cds(exons):
+    # Leave ~50 bp UTRs at both ends whenever the exons are long enough
+    first, last = exons[0], exons[-1]
+    cds = [list(e) for e in exons]
+    cds[0][0] = min(first[0] + 50, first[1])
+    cds[-1][1] = max(last[1] - 50, cds[-1][0])
+    return cds
+
+
+def gff3(path, rng, n_genes, models=None):
+    """Write a GFF3 with gene -> mRNA -> exon/CDS features."""
+    models = models if models is not None else gene_models(rng, n_genes)
+    with open(path, 'w') as f:
+        f.write("##gff-version 3\n")
+        for chrom, strand, gene, exons in models:
+            start, end = exons[0][0], exons[-1][1]
+            f.write(f"{chrom}\tsynthetic\tgene\t{start}\t{end}\t.\t{strand}\t.\tID={gene};Name={gene}\n")
+            f.write(f"{chrom}\tsynthetic\tmRNA\t{start}\t{end}\t.\t{strand}\t.\tID={gene}.t1;Parent={gene}\n")
+            for k, (s, e) in enumerate(exons):
+                f.write(f"{chrom}\tsynthetic\texon\t{s}\t{e}\t.\t{strand}\t.\tID={gene}.t1.exon{k + 1};Parent={gene}.t1\n")
+            for k, (s, e) in enumerate(_cds(exons)):
+                f.write(f"{chrom}\tsynthetic\tCDS\t{s}\t{e}\t.\t{strand}\t0\tID={gene}.t1.cds{k + 1};Parent={gene}.t1\n")
+    return path
+
+
+def gtf(path, rng, n_genes, models=None):
+    """Write a GTF with transcript, exon and CDS lines."""
+    models = models if models is not None else gene_models(rng, n_genes)
+    with open(path, 'w') as f:
+        for chrom, strand, gene, exons in models:
+            attributes = f'gene_id "{gene}"; transcript_id "{gene}.t1";'
+            f.write(f"{chrom}\tsynthetic\ttranscript\t{exons[0][0]}\t{exons[-1][1]}\t.\t{strand}\t.\t{attributes}\n")
+            for s, e in exons:
+                f.write(f"{chrom}\tsynthetic\texon\t{s}\t{e}\t.\t{strand}\t.\t{attributes}\n")
+            for s, e in _cds(exons):
+                f.write(f"{chrom}\tsynthetic\tCDS\t{s}\t{e}\t.\t{strand}\t0\t{attributes}\n")
+    return path
+
+
+def gene_region_table(path, rng, n_genes):
+    """Write a gene region table as produced by ``extract_gene_regions`` (no header)."""
+    rows = [(chrom, max(1, exons[0][0] - 2000) if strand == '+' else exons[0][0],
+             exons[-1][1] if strand == '+' else exons[-1][1] + 2000, strand, gene)
+            for chrom, strand, gene, exons in gene_models(rng, n_genes)]
+    pd.DataFrame(rows).to_csv(path, sep='\t', index=False, header=False)
+    return path
+
+
+def cluster_table(path, rng, n_clusters, assigned=False):
+    """Write a TSS cluster table; with ``assigned`` it also carries gene assignments."""
+    df = tss_positions(rng, n_clusters * 3)
+    df = df.drop_duplicates('promoter').head(n_clusters).reset_index(drop=True)
+    width = rng.geometric(0.08, len(df)) - 1
+    tags = np.round(zipf_counts(rng, len(df), a=1.4) * rng.uniform(1, 5, len(df)), 6)
+    clusters = pd.DataFrame({
+        'cluster': np.arange(1, len(df) + 1),
+        'chr': df['chr'],
+        'start': df['pos'],
+        'end': df['pos'] + width,
+        'strand': df['strand'],
+        'dominant_tss': df['pos'] + (width * rng.random(len(df))).astype(np.int64),
+        'tags': tags,
+        'tags.dominant_tss': np.round(tags * rng.uniform(0.2, 1, len(df)), 6),
+    })[CLUSTER_COLUMNS]
+    if assigned:
+        in_gene = rng.random(len(clusters)) < 0.6
+        clusters['gene'] = np.where(in_gene, [f"gene{i}" for i in range(len(clusters))], 'NA')
+        clusters['nearby'] = np.where(in_gene, 'NA', [f"gene{i}" for i in range(len(clusters))])
+        clusters['distance'] = np.where(in_gene, 'NA', [f"+{d}" for d in rng.integers(0, 5000, len(clusters))])
+    clusters.to_csv(path, sep='\t', index=False)
+    return path
+
+
+def bam(path, rng, n_reads, read_length=50):
+    """Write a sorted, indexed single-end BAM whose reads start around promoters."""
+    genome = chromosomes(max(1, n_reads // 100) * PROMOTER_SPACING, n_chroms=4)
+    positions = tss_positions(rng, max(1, n_reads // 10), genome)
+    weights = zipf_counts(rng, len(positions)).astype(np.float64)
+    picks = rng.choice(len(positions), n_reads, p=weights / weights.sum())
+    chrom_ids = {name: i for i, (name, _) in enumerate(genome)}
+    header = {'HD': {'VN': '1.6', 'SO': 'unsorted'},
+              'SQ': [{'SN': name, 'LN': length} for name, length in genome]}
+    unsorted = path + '.unsorted.bam'
+    chrom = positions['chr'].to_numpy()[picks]
+    pos = positions['pos'].to_numpy()[picks]
+    minus = positions['strand'].to_numpy()[picks] == '-'
+    mapq = np.where(rng.random(n_reads) < 0.05, 0, 60)
+    with pysam.AlignmentFile(unsorted, 'wb', header=header) as out:
+        for i in range(n_reads):
+            # The 5' end of a minus-strand read is its rightmost base
+            start = pos[i] - read_length if minus[i] else pos[i] - 1
+            read = pysam.AlignedSegment(out.header)
+            read.query_name = f"r{i}"
+            read.reference_id = chrom_ids[chrom[i]]
+            read.reference_start = max(0, int(start))
+            read.cigarstring = f"{read_length}M"
+            read.query_sequence = 'A' * read_length
+            read.flag = 0x10 if minus[i] else 0
+            read.mapping_quality = int(mapq[i])
+            out.write(read)
+    pysam.sort('-o', path, unsorted)
+    pysam.index(path)
+    os.remove(unsorted)
+    return path
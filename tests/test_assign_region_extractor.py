@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from tsstk import assign_region_extractor
+from tsstk.utils import file_digest
+
+GFF3 = """##gff-version 3
+chr1\tsrc\tCDS\t1200\t1500\t.\t+\t0\tParent=m1
+chr1\tsrc\tgene\t1000\t5000\t.\t+\t.\tID=g1
+chr1\tsrc\tmRNA\t1000\t5000\t.\t+\t.\tID=m1;Parent=g1
+chr1\tsrc\tCDS\t2000\t2600\t.\t+\t0\tParent=m1
+chr1\tsrc\tmRNA\t1000\t5000\t.\t+\t.\tID=m2;Parent=g1
+chr1\tsrc\tCDS\t3000\t3500\t.\t+\t0\tParent=m2
+chr1\tsrc\tgene\t10000\t15000\t.\t-\t.\tID=g2
+chr1\tsrc\tCDS\t12000\t12800\t.\t-\t0\tParent=g2
+chr1\tsrc\tCDS\t11000\t11500\t.\t-\t0\tParent=g2
+chr2\tsrc\tgene\t20000\t25000\t.\t+\t.\tID=g3
+chr2\tsrc\tgene\t20500\t24000\t.\t+\t.\tID=g4
+chr2\tsrc\tmRNA\t20000\t25000\t.\t+\t.\tID=m3;Parent=g3
+chr2\tsrc\tmRNA\t20500\t24000\t.\t+\t.\tID=m4;Parent=g4
+chr2\tsrc\texon\t20500\t21600\t.\t+\t.\tID=e1;Parent=m3,m4
+chr2\tsrc\tCDS\t21000\t21500\t.\t+\t0\tParent=m3,m4
+chr2\tsrc\tCDS\t22000\t22300\t.\t+\t0\tParent=m3
+chr2\tsrc\tgene\t500\t900\t.\t+\t.\tID=g5
+chr2\tsrc\tncRNA\t500\t900\t.\t+\t.\tID=n1;Parent=g5
+##FASTA
+>chr1
+ACGT
+"""
+
+REGIONS = [
+    ('chr1', 1, 3500, '+', 'g1'),
+    ('chr1', 11000, 17000, '-', 'g2'),
+    ('chr2', 18000, 22300, '+', 'g3'),
+    ('chr2', 18500, 21500, '+', 'g4'),
+]
+
+
+class TestRegionExtractor(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.gff3 = os.path.join(self.tmpdir, 'genes.gff3')
+        with open(self.gff3, 'w') as f:
+            f.write(GFF3)
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_regions(self):
+        index = assign_region_extractor.index_gff3(self.gff3)
+        self.assertEqual(index['gene_id'].tolist(), ['g1', 'g2', 'g3', 'g4', 'g5'])
+        self.assertEqual(index['cds_start'].tolist(), [1200, 11000, 21000, 21000, 0])
+        self.assertEqual(index['cds_end'].tolist(), [3500, 12800, 22300, 21500, 0])
+
+        output = os.path.join(self.tmpdir, 'regions.tsv')
+        assign_region_extractor.extract_gene_regions.main(['-i', self.gff3, '-o', output], standalone_mode=False)
+        with open(output) as f:
+            rows = [line.rstrip('\n').split('\t') for line in f]
+        self.assertEqual(rows, [[str(value) for value in region] for region in REGIONS])
+
+    def load(self):
+        return assign_region_extractor.load_index(self.gff3, self.cache_dir)
+
+    def assertSameIndex(self, index, expected):
+        self.assertEqual(set(index), set(assign_region_extractor.INDEX_KEYS))
+        for key in assign_region_extractor.INDEX_KEYS:
+            np.testing.assert_array_equal(index[key], expected[key])
+
+    def test_cache(self):
+        expected = assign_region_extractor.index_gff3(self.gff3)
+        with mock.patch.object(assign_region_extractor, 'index_gff3', wraps=assign_region_extractor.index_gff3) as index_gff3:
+            self.assertSameIndex(self.load(), expected)
+            self.assertSameIndex(self.load(), expected)
+            self.assertEqual(index_gff3.call_count, 1)
+            self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+            # A changed annotation misses the cache
+            with open(self.gff3, 'w') as f:
+                f.write(GFF3.replace('##FASTA', 'chr3\tsrc\tgene\t100\t200\t.\t+\t.\tID=g6\n##FASTA'))
+            index = self.load()
+            self.assertEqual(index['gene_id'].tolist()[-1], 'g6')
+            self.assertEqual(index_gff3.call_count, 2)
+            self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+            # A corrupt cache file is rebuilt
+            cache_file = os.path.join(self.cache_dir, f'{file_digest(self.gff3)}.gff3idx.npz')
+            for content in (b'not an npz file', b'PK\x03\x04truncated'):
+                with open(cache_file, 'wb') as f:
+                    f.write(content)
+                self.assertSameIndex(self.load(), index)
+            self.assertEqual(index_gff3.call_count, 4)
+            self.assertSameIndex(self.load(), index)
+            self.assertEqual(index_gff3.call_count, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import run, synthetic
+from tsstk.assign_region_extractor import index_gff3
+from tsstk.intron_stats import parse_gtf
+
+
+class TestSyntheticInputs(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.rng = np.random.default_rng(0)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_tss_table(self):
+        path = synthetic.tss_table(os.path.join(self.tmpdir, 'tss.txt'), self.rng, 5000)
+        df = pd.read_csv(path, sep='\t')
+        self.assertEqual(list(df.columns), ['chr', 'pos', 'strand', 'S1', 'S2'])
+        self.assertFalse(df.duplicated(['chr', 'pos', 'strand']).any())
+        pd.testing.assert_frame_equal(df, df.sort_values(['strand', 'chr', 'pos'], ignore_index=True))
+        # Zipf-like: a long tail far above the median
+        self.assertGreater(df['S1'].max(), 20 * df['S1'].median())
+
+    def test_annotations(self):
+        models = synthetic.gene_models(self.rng, 500)
+        gff3 = synthetic.gff3(os.path.join(self.tmpdir, 'genes.gff3'), self.rng, 0, models)
+        gtf = synthetic.gtf(os.path.join(self.tmpdir, 'genes.gtf'), self.rng, 0, models)
+        index = index_gff3(gff3)
+        self.assertEqual(len(index['gene_id']), len(models))
+        self.assertTrue((index['cds_start'] > 0).all())
+        introns = parse_gtf(gtf)
+        self.assertEqual(len(introns), sum(len(exons) - 1 for _, _, _, exons in models))
+        # Independently placed genes overlap now and then
+        ends = {}
+        overlaps = 0
+        for chrom, _, _, exons in models:
+            overlaps += exons[0][0] <= ends.get(chrom, 0)
+            ends[chrom] = max(ends.get(chrom, 0), exons[-1][1])
+        self.assertGreater(overlaps, 0)
+
+
+class TestRunner(unittest.TestCase):
+
+    def test_run_case(self):
+        workdir = tempfile.mkdtemp()
+        try:
+            report = run.run_benchmarks(['dominant-bed'], [0.01, 0.02], repeat=1, workdir=workdir)
+        finally:
+            shutil.rmtree(workdir)
+        self.assertEqual([r['size'] for r in report['results']], [500, 1000])
+        self.assertGreater(report['results'][0]['peak_rss_mb'], 0)
+        self.assertIsNotNone(report['curves']['dominant-bed']['scaling_exponent'])
+
+    def test_scaling_exponent(self):
+        self.assertAlmostEqual(run.scaling_exponent([10, 20, 40], [1.0, 4.0, 16.0]), 2.0)
+        # Small scales that round to the same size are one point
+        self.assertIsNone(run.scaling_exponent([1, 1], [0.2, 0.3]))
+        self.assertAlmostEqual(run.scaling_exponent([1, 1, 2], [0.5, 2.0, 2.0]), 1.0)
+        self.assertIsNone(run.scaling_exponent([1, 2], [0.0, 0.1]))
+
+    def test_compare(self):
+        def report(seconds, rss):
+            return {'results': [{'benchmark': 'a', 'size': 10, 'seconds': seconds, 'peak_rss_mb': rss}]}
+        self.assertFalse(run.compare(report(1.1, 100), report(1.0, 100))[0]['regression'])
+        self.assertTrue(run.compare(report(1.5, 100), report(1.0, 100))[0]['regression'])
+        self.assertTrue(run.compare(report(1.0, 200), report(1.0, 100))[0]['regression'])
+        self.assertEqual(run.compare(report(1.0, 100), {'results': []}), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
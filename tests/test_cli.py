@@ -0,0 +1,46 @@
+import subprocess
+import sys
+import unittest
+
+from click.testing import CliRunner
+
+from tsstk.cli import LAZY_COMMANDS, tsstk
+
+HEAVY_MODULES = ('numpy', 'pandas', 'pysam', 'gffutils', 'sortedcontainers')
+
+
+class TestLazyCli(unittest.TestCase):
+
+    def test_help_imports_no_heavy_modules(self):
+        code = ("import sys\n"
+                "from click.testing import CliRunner\n"
+                "from tsstk.cli import tsstk\n"
+                "CliRunner().invoke(tsstk, ['--help'])\n"
+                "CliRunner().invoke(tsstk, ['--version'])\n"
+                f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n")
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), '')
+
+    def test_every_command_resolves(self):
+        runner = CliRunner()
+        for name in LAZY_COMMANDS:
+            result = runner.invoke(tsstk, [name, '--help'])
+            self.assertEqual(result.exit_code, 0, msg=f"{name}: {result.output}")
+            self.assertIn(f'tsstk {name}', result.output)
+
+    def test_module_help_imports_no_heavy_modules(self):
+        # `python -m tsstk --help` as users run it, through tsstk/__main__.py
+        code = ("import runpy, sys\n"
+                "sys.argv = ['tsstk', '--help']\n"
+                "try:\n"
+                "    runpy.run_module('tsstk', run_name='__main__')\n"
+                "except SystemExit:\n"
+                "    pass\n"
+                f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules), file=sys.stderr)\n")
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        self.assertIn('Commands:', result.stdout)
+        self.assertEqual(result.stderr.strip(), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
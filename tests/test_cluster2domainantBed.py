@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import pysam
+
+from tsstk import cluster2domainantBed as dominant
+
+
+class TestPromoterWindows(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        self.genome = {'chrA': ''.join(rng.choice(list('ACGT'), 3000)), 'chrB': ''.join(rng.choice(list('ACGT'), 500))}
+        self.fasta = os.path.join(self.tmpdir, 'genome.fa')
+        with open(self.fasta, 'w') as f:
+            for chrom, seq in self.genome.items():
+                f.write(f">{chrom}\n" + '\n'.join(seq[i:i + 60] for i in range(0, len(seq), 60)) + '\n')
+        pysam.faidx(self.fasta)
+        self.clusters = pd.DataFrame({
+            'cluster': [1, 2, 3, 4],
+            'chr': ['chrA', 'chrA', 'chrB', 'chrB'],
+            'start': [40, 1500, 450, 100],
+            'end': [60, 1520, 495, 120],
+            'strand': ['+', '-', '-', '+'],
+            'dominant_tss': [50, 1510, 490, 110],
+            'tags': [10.0, 5.0, 3.0, 2.0],
+            'tags.dominant_tss': [4.0, 2.0, 1.5, 1.0],
+            'gene': ['g1', 'NA', 'g3', 'g4'],
+        })
+        self.input = os.path.join(self.tmpdir, 'clusters.txt')
+        self.clusters.to_csv(self.input, sep='\t', index=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_windows_are_clipped(self):
+        bed = dominant.dominant_windows(self.clusters, 150, 10, dominant.chromosome_sizes(fasta=self.fasta))
+        self.assertEqual(bed['start'].tolist(), [0, 1500, 480, 0])
+        self.assertEqual(bed['end'].tolist(), [60, 1660, 500, 120])
+        self.assertEqual(bed['name'].tolist(), ['g1_1', 'NA_2', 'g3_3', 'g4_4'])
+
+    def test_several_windows_and_fasta(self):
+        output, fasta_output = os.path.join(self.tmpdir, 'out.bed'), os.path.join(self.tmpdir, 'out.fa')
+        with mock.patch.object(dominant, 'FETCH_SPAN', 100):
+            dominant.main.main(['-i', self.input, '-w', '20,5', '-w', '5,20', '--fasta', self.fasta,
+                                '--fasta-output', fasta_output, '-o', output, '-p', '2'], standalone_mode=False)
+        bed = pd.read_csv(output, sep='\t', header=None, names=['chr', 'start', 'end', 'name', 'score', 'strand'])
+        self.assertEqual(bed['name'].tolist()[:2], ['g1_1:20-5', 'g1_1:5-20'])
+        self.assertEqual(bed['end'].tolist(), [55, 70, 1530, 1515, 500, 495, 115, 130])
+
+        with pysam.FastxFile(fasta_output) as f:
+            records = [(r.name, r.sequence) for r in f]
+        self.assertEqual(len(records), len(bed))
+        for (name, seq), row in zip(records, bed.itertuples()):
+            expected = self.genome[row.chr][row.start:row.end]
+            if row.strand == '-':
+                expected = expected[::-1].translate(str.maketrans('ACGT', 'TGCA'))
+            self.assertEqual(name, f"{row.name}::{row.chr}:{row.start}-{row.end}({row.strand})")
+            self.assertEqual(seq, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
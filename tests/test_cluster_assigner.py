@@ -0,0 +1,95 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from tsstk.cluster_assigner import assign_genes
+
+
+def brute_force(clusters_df, genes_df):
+    expected = []
+    for cluster in clusters_df.itertuples(index=False):
+        genes = genes_df[(genes_df['chromosome'] == cluster.chr) & (genes_df['strand'] == cluster.strand)]
+        containing = genes[(genes['gene_start'] <= cluster.start) & (genes['gene_end'] >= cluster.end)]
+        if len(containing):
+            expected.append((containing.sort_values('gene_start', kind='stable').iloc[-1]['gene_id'], 'NA', 'NA'))
+            continue
+        overlapping = genes[(genes['gene_start'] <= cluster.end) & (genes['gene_end'] >= cluster.start)]
+        if len(overlapping):
+            gene = overlapping.sort_values('gene_start', kind='stable').iloc[-1]
+            expected.append(('NA', gene['gene_id'], '+0' if gene['gene_start'] > cluster.start else '-0'))
+            continue
+        right = genes[genes['gene_start'] > cluster.end]
+        left = genes[genes['gene_end'] < cluster.start]
+        right_dist = (right['gene_start'] - cluster.end).min() if len(right) else np.inf
+        left_dist = (cluster.start - left['gene_end']).min() if len(left) else np.inf
+        if right_dist == np.inf and left_dist == np.inf:
+            expected.append(('NA', 'NA', 'NA'))
+        elif right_dist <= left_dist:
+            expected.append(('NA', None, f"+{int(right_dist)}"))
+        else:
+            expected.append(('NA', None, f"-{int(left_dist)}"))
+    return expected
+
+
+class TestAssignGenes(unittest.TestCase):
+
+    def setUp(self):
+        self.genes = pd.DataFrame([
+            ('chrI', 100, 1000, '+', 'outer'),
+            ('chrI', 200, 400, '+', 'nested'),
+            ('chrI', 1500, 2000, '+', 'right'),
+            ('chrI', 100, 1000, '-', 'minus'),
+            ('chrII', 50, 80, '+', 'other'),
+        ], columns=['chromosome', 'gene_start', 'gene_end', 'strand', 'gene_id'])
+
+    def test_nested_and_nearest(self):
+        clusters = pd.DataFrame([
+            ('chrI', 250, 260, '+', 1),    # inside nested gene
+            ('chrI', 500, 520, '+', 2),    # only the outer gene contains it
+            ('chrI', 1100, 1200, '+', 3),  # between genes, left is closer
+            ('chrI', 1300, 1400, '+', 4),  # right is closer
+            ('chrI', 900, 1600, '+', 5),   # partial overlaps
+            ('chrII', 10, 20, '+', 6),     # upstream of the only gene
+            ('chrIII', 10, 20, '+', 7),    # no genes on this chromosome
+            ('chrI', 1100, 1200, '-', 8),  # other strand
+        ], columns=['chr', 'start', 'end', 'strand', 'cluster'])
+        result = assign_genes(clusters, self.genes)
+        self.assertEqual(list(result['gene']), ['nested', 'outer', 'NA', 'NA', 'NA', 'NA', 'NA', 'NA'])
+        self.assertEqual(list(result['nearby']), ['NA', 'NA', 'outer', 'right', 'right', 'other', 'NA', 'minus'])
+        self.assertEqual(list(result['distance']), ['NA', 'NA', '-100', '+100', '+0', '+30', 'NA', '-100'])
+        self.assertEqual(list(result['cluster']), list(clusters['cluster']))
+
+    def test_matches_brute_force(self):
+        rng = np.random.default_rng(1)
+        n_genes, n_clusters = 300, 2000
+        starts = rng.integers(1, 100000, n_genes)
+        genes = pd.DataFrame({
+            'chromosome': rng.choice(['chr1', 'chr2', 'chr3'], n_genes),
+            'gene_start': starts,
+            'gene_end': starts + rng.integers(0, 5000, n_genes),
+            'strand': rng.choice(['+', '-'], n_genes),
+            'gene_id': [f"g{i}" for i in range(n_genes)],
+        })
+        cstarts = rng.integers(1, 110000, n_clusters)
+        clusters = pd.DataFrame({
+            'chr': rng.choice(['chr1', 'chr2', 'chr3', 'chr4'], n_clusters),
+            'start': cstarts,
+            'end': cstarts + rng.integers(0, 50, n_clusters),
+            'strand': rng.choice(['+', '-'], n_clusters),
+        })
+        result = assign_genes(clusters, genes)
+        for (gene, nearby, distance), row in zip(brute_force(clusters, genes), result.itertuples(index=False)):
+            self.assertEqual(row.gene, gene)
+            self.assertEqual(row.distance, distance)
+            if nearby is not None:
+                self.assertEqual(row.nearby, nearby)
+
+    def test_no_genes(self):
+        clusters = pd.DataFrame([('chrI', 1, 2, '+')], columns=['chr', 'start', 'end', 'strand'])
+        result = assign_genes(clusters, self.genes.iloc[:0])
+        self.assertEqual(list(result['gene']), ['NA'])
+
+
+if __name__ == '__main__':
+    unittest.main()
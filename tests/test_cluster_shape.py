@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from tsstk import cluster_shape, core
+
+TABLE = os.path.join(os.path.dirname(__file__), 'ALL.samples.TSS.raw.txt')
+
+
+def naive_shape(pos, counts, strand, lower, upper):
+    # Straightforward per-cluster version of the metrics
+    keep = counts > 0
+    pos, counts = pos[keep], counts[keep]
+    order = np.argsort(pos)
+    pos, counts = pos[order], counts[order]
+    if strand == '-':
+        pos, counts = pos[::-1], counts[::-1]
+    cum = np.cumsum(counts) / counts.sum()
+    q_lower, q_upper = pos[np.argmax(cum >= lower)], pos[np.argmax(cum >= upper)]
+    p = counts / counts.sum()
+    return counts.sum(), q_lower, q_upper, abs(q_upper - q_lower) + 1, 2 + (p * np.log2(p)).sum()
+
+
+class TestClusterShape(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.table = pd.read_csv(TABLE, sep='\t', nrows=30000).sample(frac=1, random_state=0)
+        cls.clusters = core.cluster_tss_table(cls.table)
+
+    def test_matches_per_cluster_loop(self):
+        shapes = cluster_shape.cluster_shapes(self.table, self.clusters, ['YPD.1', 'Arrest.2'], 0.1, 0.9, processes=2)
+        self.assertEqual(list(shapes.columns), cluster_shape.SHAPE_COLUMNS +
+                         ['q_0.1', 'q_0.9', 'interquantile_width', 'shape_index'])
+        self.assertGreater(len(shapes), len(self.clusters))
+        rows = shapes.set_index(['cluster', 'sample'])
+        for cluster in self.clusters.sample(200, random_state=1).itertuples():
+            tss = self.table[(self.table['chr'] == cluster.chr) & (self.table['strand'] == cluster.strand) &
+                             self.table['pos'].between(cluster.start, cluster.end)]
+            for sample in ('YPD.1', 'Arrest.2'):
+                counts = tss[sample].to_numpy()
+                if not counts.sum():
+                    self.assertNotIn((cluster.cluster, sample), rows.index)
+                    continue
+                row = rows.loc[(cluster.cluster, sample)]
+                tags, q_lower, q_upper, width, shape_index = naive_shape(tss['pos'].to_numpy(), counts,
+                                                                         cluster.strand, 0.1, 0.9)
+                self.assertEqual((row['tags'], row['q_0.1'], row['q_0.9'], row['interquantile_width']),
+                                 (tags, q_lower, q_upper, width))
+                self.assertAlmostEqual(row['shape_index'], shape_index, places=5)
+
+    def test_command(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            cluster_file, output = os.path.join(tmpdir, 'clusters.tsv'), os.path.join(tmpdir, 'shape.tsv')
+            self.clusters.to_csv(cluster_file, sep='\t', index=False)
+            cluster_shape.main.main(['-c', cluster_file, '-t', TABLE, '-s', 'YPD.2', '--lower', '0.2',
+                                     '-o', output], standalone_mode=False)
+            shapes = pd.read_csv(output, sep='\t')
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(set(shapes['sample']), {'YPD.2'})
+        self.assertTrue((shapes['shape_index'] <= 2).all())
+        self.assertTrue((shapes['interquantile_width'] >= 1).all())
+        self.assertTrue((shapes['interquantile_width'] <= shapes['end'] - shapes['start'] + 1).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import click
+import pandas as pd
+
+from tsstk import combine_multi_TSS_table as combine
+
+
+class TestStreamMerge(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        table = pd.read_csv(os.path.join(os.path.dirname(__file__), 'ALL.samples.TSS.raw.txt'), sep='\t', nrows=3000)
+        self.inputs = []
+        for i, col in enumerate(['YPD.1', 'YPD.2', 'Arrest.1', 'YPD.1']):
+            df = table[['chr', 'pos', 'strand', col]].iloc[i::2].sample(frac=1, random_state=i)
+            path = os.path.join(self.tmpdir, f'sample{i}.tsv')
+            df.to_csv(path, sep='\t', index=False)
+            self.inputs.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def merge(self, *args):
+        output = os.path.join(self.tmpdir, 'out.tsv')
+        combine.process_files.main(list(self.inputs) + ['-o', output] + list(args), standalone_mode=False)
+        return pd.read_csv(output, sep='\t')
+
+    def test_streaming_matches_in_memory(self):
+        expected = self.merge()
+        self.assertEqual(list(expected.columns), ['chr', 'pos', 'strand', 'YPD.1', 'YPD.2', 'Arrest.1'])
+        # Tiny blocks force many runs and several merge passes
+        with mock.patch.object(combine, 'MIN_BLOCK_ROWS', 50), mock.patch.object(combine, 'ROW_OVERHEAD', 10 ** 6):
+            streamed = self.merge('--streaming', '--memory', '1', '-p', '2')
+        pd.testing.assert_frame_equal(streamed, expected)
+
+    def test_matrix(self):
+        expected = self.merge('--matrix')
+        self.assertEqual(list(expected.columns), ['chr', 'pos', 'strand', 'YPD.1', 'YPD.2', 'Arrest.1', 'YPD.1.4'])
+        streamed = self.merge('--matrix', '--streaming')
+        pd.testing.assert_frame_equal(streamed, expected)
+
+    def test_append(self):
+        for args in ([], ['--matrix']):
+            expected = self.merge(*args)
+            output = os.path.join(self.tmpdir, 'appended.tsv')
+            for inputs in (self.inputs[:2], self.inputs):
+                combine.process_files.main(inputs + ['-o', output, '--append'] + args, standalone_mode=False)
+            pd.testing.assert_frame_equal(pd.read_csv(output, sep='\t'), expected)
+
+            with open(combine.manifest_path(output)) as f:
+                manifest = json.load(f)
+            self.assertEqual([entry['path'] for entry in manifest['inputs']], [os.path.abspath(p) for p in self.inputs])
+            mtime = os.stat(output).st_mtime_ns
+            self.assertEqual(combine.append_tables(self.inputs, output, matrix=bool(args)), [])
+            self.assertEqual(os.stat(output).st_mtime_ns, mtime)
+
+            with open(output, 'a') as f:
+                f.write('chrI\t1\t+' + '\t0' * (len(expected.columns) - 3) + '\n')
+            with self.assertRaises(click.ClickException):
+                combine.append_tables(self.inputs, output, matrix=bool(args))
+            os.remove(output)
+            os.remove(combine.manifest_path(output))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import click
+import pandas as pd
+
+from tsstk import consensus, core
+
+TABLE = os.path.join(os.path.dirname(__file__), 'ALL.samples.TSS.raw.txt')
+SAMPLES = ['YPD.1', 'YPD.2', 'Arrest.1']
+
+
+class TestConsensus(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        table = pd.read_csv(TABLE, sep='\t', nrows=40000)
+        cls.clusters, cls.inputs = {}, []
+        for sample in SAMPLES:
+            cls.clusters[sample] = core.cluster_tss_table(table, samples=[sample])
+            path = os.path.join(cls.tmpdir, f'{sample}.clusters.txt')
+            cls.clusters[sample].to_csv(path, sep='\t', index=False)
+            cls.inputs.append(path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def run_consensus(self, *args):
+        output = os.path.join(self.tmpdir, 'consensus.txt')
+        consensus.main.main(self.inputs + ['-o', output] + list(args), standalone_mode=False)
+        return pd.read_csv(output, sep='\t')
+
+    def test_consensus_table(self):
+        df = self.run_consensus('--max-distance', '10')
+        self.assertEqual(list(df.columns), consensus.CONSENSUS_COLUMNS + ['YPD.1.clusters', 'YPD.2.clusters', 'Arrest.1.clusters'])
+        self.assertEqual(df['cluster'].tolist(), list(range(1, len(df) + 1)))
+        # Per-sample tags are conserved and consensus clusters are far enough apart
+        for sample in SAMPLES:
+            self.assertAlmostEqual(df[f'{sample}.clusters'].sum(), self.clusters[sample]['tags'].sum(), places=2)
+        for _, group in df.groupby(['chr', 'strand']):
+            self.assertTrue((group['start'].to_numpy()[1:] > group['end'].to_numpy()[:-1] + 10).all())
+
+        # Every input cluster lies in exactly one consensus cluster
+        for sample in SAMPLES:
+            members = self.clusters[sample].merge(df[['chr', 'strand', 'start', 'end']].rename(
+                columns={'start': 'c_start', 'end': 'c_end'}), on=['chr', 'strand'])
+            inside = members[(members['start'] >= members['c_start']) & (members['end'] <= members['c_end'])]
+            self.assertEqual(len(inside), len(self.clusters[sample]))
+        self.assertTrue((df['samples'] == (df.iloc[:, -3:] > 0).sum(axis=1)).all())
+        self.assertTrue((df['tags'] - df.iloc[:, -3:].sum(axis=1)).abs().max() < 1e-4)
+
+    def test_names_and_min_samples(self):
+        df = self.run_consensus('-n', 'a', '-n', 'b', '-n', 'c', '--min-samples', '3')
+        self.assertEqual(list(df.columns[-3:]), ['a', 'b', 'c'])
+        self.assertTrue((df[['a', 'b', 'c']] > 0).all().all())
+
+    def test_unsorted_input(self):
+        path = os.path.join(self.tmpdir, 'shuffled.txt')
+        self.clusters['YPD.1'].sample(frac=1, random_state=0).to_csv(path, sep='\t', index=False)
+        with self.assertRaises(click.ClickException):
+            consensus.write_consensus([path], os.path.join(self.tmpdir, 'out.txt'))
+
+    def test_block_order(self):
+        # Both strands of two chromosomes, with the blocks in strand-major or BAM header order
+        table = pd.read_csv(TABLE, sep='\t').groupby(['chr', 'strand']).head(5000)
+        layouts = {
+            'YPD.1': [('chrII', '+'), ('chrI', '+'), ('chrII', '-'), ('chrI', '-')],
+            'YPD.2': [('chrII', '+'), ('chrI', '+'), ('chrI', '-')],
+            'Arrest.1': [('chrII', '+'), ('chrII', '-'), ('chrI', '-')],
+        }
+        paths, sorted_paths = [], []
+        for sample, blocks in layouts.items():
+            clusters = core.cluster_tss_table(table, samples=[sample])
+            parts = [clusters[(clusters['chr'] == chrom) & (clusters['strand'] == strand)] for chrom, strand in blocks]
+            paths.append(os.path.join(self.tmpdir, f'{sample}.blocks.txt'))
+            pd.concat(parts).to_csv(paths[-1], sep='\t', index=False)
+            sorted_paths.append(os.path.join(self.tmpdir, f'{sample}.sorted.txt'))
+            pd.concat(parts).sort_values(['chr', 'strand', 'start']).to_csv(sorted_paths[-1], sep='\t', index=False)
+
+        output, expected = os.path.join(self.tmpdir, 'blocks.txt'), os.path.join(self.tmpdir, 'sorted.txt')
+        consensus.write_consensus(paths, output, SAMPLES, max_distance=5)
+        consensus.write_consensus(sorted_paths, expected, SAMPLES, max_distance=5)
+        df, expected = pd.read_csv(output, sep='\t'), pd.read_csv(expected, sep='\t')
+        self.assertEqual(df.drop_duplicates(['chr', 'strand'])[['chr', 'strand']].values.tolist(),
+                         [['chrII', '+'], ['chrI', '+'], ['chrII', '-'], ['chrI', '-']])
+        keys = ['chr', 'strand', 'start']
+        pd.testing.assert_frame_equal(df.sort_values(keys).drop(columns='cluster').reset_index(drop=True),
+                                      expected.sort_values(keys).drop(columns='cluster').reset_index(drop=True))
+
+        # Blocks split in two, or ordered differently between inputs, are rejected
+        split = os.path.join(self.tmpdir, 'split.txt')
+        first = pd.read_csv(paths[0], sep='\t')
+        pd.concat([first.iloc[::2], first.iloc[1::2]]).to_csv(split, sep='\t', index=False)
+        with self.assertRaisesRegex(click.ClickException, 'not grouped by chr and strand'):
+            consensus.write_consensus([split], output)
+        with self.assertRaisesRegex(click.ClickException, 'conflicting orders'):
+            consensus.write_consensus([paths[0], sorted_paths[1]], output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,62 +1,124 @@
+import os
+import shutil
+import tempfile
 import unittest
-from tsstk import core  # 假设你在core.py中定义了具体的功能实现
+
+import numpy as np
+import pandas as pd
+import pysam
+
+from tsstk import core
+
+
+def write_bam(path, reads, references=(('chr1', 5000), ('chr2', 3000))):
+    """Write a sorted, indexed BAM from (chrom, start, cigar, flag, mapq) tuples."""
+    header = {'HD': {'VN': '1.6', 'SO': 'coordinate'},
+              'SQ': [{'SN': name, 'LN': length} for name, length in references]}
+    unsorted = path + '.unsorted.bam'
+    with pysam.AlignmentFile(unsorted, 'wb', header=header) as bam:
+        for i, (chrom, start, cigar, flag, mapq) in enumerate(reads):
+            read = pysam.AlignedSegment(bam.header)
+            read.query_name = f"read{i}"
+            read.reference_name = chrom
+            read.reference_start = start
+            read.cigarstring = cigar
+            read.query_sequence = 'A' * read.infer_query_length()
+            read.flag = flag
+            read.mapping_quality = mapq
+            bam.write(read)
+    pysam.sort('-o', path, unsorted)
+    pysam.index(path)
+    os.remove(unsorted)
+
+
+def read_table(path):
+    with open(path) as f:
+        header = f.readline().rstrip('\n').split('\t')
+        rows = [line.rstrip('\n').split('\t') for line in f]
+    return header, [(chrom, int(pos), strand, int(count)) for chrom, pos, strand, count in rows]
+
 
 class TestCoreFunctions(unittest.TestCase):
 
-    def get_tss_from_bam(bam_files, output_tsv):
-       # 创建一个字典来保存TSS信息
-       tss_dict = {}
-       # 遍历所有提供的BAM文件
-       for bam_file in bam_files:
-           # 使用pysam库读取BAM文件
-           with pysam.AlignmentFile(bam_file, "rb") as bam:
-               #遍历BAM文件中的每一个read
-               for read in bam:
-                  # 获得flag值
-                  flag = read.flag
-                  # 判断是否为primary alignment
-                  if flag >= 256:
-                      continue
-                
-                # 获取染色体名称和位置
-                chr_name = read.reference_name
-                position = read.reference_start   0-based
-                
-                #  根据flag判断链
-                strand = '+' if flag == 0 else '-' if flag == 16 else None
-                
-                if strand is None:
-                    continue
-                # 保存TSS信息
-                if chr_name not in tss_dict:
-                    tss_dict[chr_name] = {}
-                
-                if strand not in tss_dict[chr_name]:
-                    tss_dict[chr_name][strand] = []
-                
-                tss_dict[chr_name][strand].append(position + 1)   转为1-based
-                
-     # 将TSS信息写入TSV文件
-     with open(output_tsv, 'w') as out_file:
-         out_file.write("chr\tpos\tstrand\n")   # 写入表头
-         for chr_name in sorted(tss_dict.keys()):
-             for strand in sorted(tss_dict[chr_name].keys()):
-                 for position in sorted(tss_dict[chr_name][strand]):
-                     out_file.write(f"{chr_name}\t{position}\t{strand}\n")
-                    
-#  示例使用
-#bam_files = ["file1.bam", "file2.bam"]
-#output_tsv = "output_tss.tsv"
-#get_tss_from_bam(bam_files, output_tsv)
-
-
-        # 在这里写测试用于从BAM文件获取TSS信息的函数的代码
-        pass
-    
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.bam = os.path.join(self.tmpdir, 'sample1.bam')
+        write_bam(self.bam, [
+            ('chr1', 99, '20M', 0, 30),        # + TSS at 100
+            ('chr1', 99, '20M', 0, 30),        # + TSS at 100
+            ('chr1', 99, '20M', 0x100, 30),    # secondary, ignored
+            ('chr1', 199, '10M', 0x10, 30),    # - TSS at 209
+            ('chr1', 995, '10M', 0x10, 30),    # - TSS at 1005, crosses a 1 kb shard boundary
+            ('chr1', 1000, '5M', 0x10, 30),    # - TSS at 1005 from the next shard
+            ('chr1', 999, '20M', 0, 5),        # low MAPQ
+            ('chr1', 1499, '10M100N10M', 0x10, 30),  # spliced - read, TSS at 1619
+            ('chr1', 299, '20M', 0x1 | 0x80, 30),    # second mate, ignored
+            ('chr2', 9, '20M', 0x1 | 0x40, 30),      # first mate, + TSS at 10
+            ('chr2', 49, '20M', 0x4, 0),       # unmapped, ignored
+        ])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_position_counter(self):
+        counter = core.PositionCounter(buffer_size=4)
+        for pos in [5, 3, 5, 9, 3, 5, 1]:
+            counter.add(pos)
+        positions, counts = counter.result()
+        np.testing.assert_array_equal(positions, [1, 3, 5, 9])
+        np.testing.assert_array_equal(counts, [1, 2, 3, 1])
+
+    def test_get_tss_from_bam(self):
+        expected = [
+            ('chr1', 100, '+', 2),
+            ('chr1', 1000, '+', 1),
+            ('chr2', 10, '+', 1),
+            ('chr1', 209, '-', 1),
+            ('chr1', 1005, '-', 2),
+            ('chr1', 1619, '-', 1),
+        ]
+        for chunk_size in (core.DEFAULT_CHUNK_SIZE, 1000, 7):
+            output = os.path.join(self.tmpdir, f'out.{chunk_size}.tsv')
+            core.get_tss_from_bam(self.bam, output, processes=2, chunk_size=chunk_size)
+            header, rows = read_table(output)
+            self.assertEqual(header, ['chr', 'pos', 'strand', 'sample1'])
+            self.assertEqual(rows, expected)
+
+    def test_get_tss_from_bam_mapq(self):
+        output = os.path.join(self.tmpdir, 'out.tsv')
+        core.get_tss_from_bam(self.bam, output, processes=1, min_mapq=10, sample_name='S')
+        header, rows = read_table(output)
+        self.assertEqual(header[-1], 'S')
+        self.assertNotIn(('chr1', 1000, '+', 1), rows)
+
+    def test_segment_clusters(self):
+        pos = np.array([10, 12, 20, 50, 51, 100])
+        signal = np.array([1.0, 5.0, 5.0, 2.0, 1.0, 3.0])
+        start, end, dominant, total, peak = core.segment_clusters(pos, signal, max_distance=10)
+        np.testing.assert_array_equal(start, [10, 50, 100])
+        np.testing.assert_array_equal(end, [20, 51, 100])
+        np.testing.assert_array_equal(dominant, [12, 50, 100])
+        np.testing.assert_array_equal(total, [11.0, 3.0, 3.0])
+        np.testing.assert_array_equal(peak, [5.0, 2.0, 3.0])
+
     def test_get_tss_from_table(self):
-        # 在这里写测试用于从TSS表获取TSS信息的函数的代码
-        pass
+        table = os.path.join(self.tmpdir, 'tss.tsv')
+        pd.DataFrame({
+            'chr': ['chr1'] * 5 + ['chr2'],
+            'pos': [100, 105, 300, 104, 500, 7],
+            'strand': ['+', '+', '+', '-', '+', '+'],
+            'A': [10, 30, 5, 40, 1, 14],
+            'B': [0, 0, 5, 0, 0, 0],
+        }).to_csv(table, sep='\t', index=False)
+        output = os.path.join(self.tmpdir, 'clusters.tsv')
+        core.get_tss_from_table(table, output, max_distance=20, min_count=2, processes=2)
+        clusters = pd.read_csv(output, sep='\t')
+        self.assertEqual(list(clusters.columns), core.CLUSTER_COLUMNS)
+        rows = clusters[['chr', 'start', 'end', 'strand', 'dominant_tss']].values.tolist()
+        self.assertEqual(rows, [['chr1', 100, 105, '+', 105], ['chr1', 300, 300, '+', 300],
+                                ['chr1', 104, 104, '-', 104], ['chr2', 7, 7, '+', 7]])
+        self.assertEqual(list(clusters['cluster']), [1, 2, 3, 4])
+        self.assertAlmostEqual(clusters['tags'].sum(), 1e6 * 104 / 105, places=3)
 
 if __name__ == '__main__':
     unittest.main()
-
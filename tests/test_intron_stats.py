@@ -0,0 +1,131 @@
+import os
+import shutil
+import tempfile
+import unittest
+import contextlib
+import io
+
+import click
+import numpy as np
+import pandas as pd
+
+from tsstk import intron_stats
+from tsstk.intron_stats import LengthHistogram
+
+
+def gtf_lines(chrom, transcript, exons):
+    return [f'{chrom}\tsrc\texon\t{start}\t{end}\t.\t+\t.\tgene_id "g"; transcript_id "{transcript}";\n'
+            for start, end in exons]
+
+
+class TestLengthHistogram(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.small = rng.integers(1, 20_000, 5000)
+        self.large = np.r_[self.small, rng.lognormal(12, 1.5, 3000).astype(np.int64) + 1]
+
+    def test_exact_quantiles(self):
+        histogram = LengthHistogram()
+        histogram.add(self.small)
+        for q in (0, 0.05, 0.25, 0.5, 0.731, 0.95, 1):
+            self.assertAlmostEqual(histogram.quantile(q), np.quantile(self.small, q), places=6)
+        stats = histogram.statistics()
+        self.assertAlmostEqual(stats['mean_length'], self.small.mean())
+        self.assertAlmostEqual(stats['std_dev_length'], self.small.std(ddof=1), places=6)
+        self.assertEqual((stats['min_length'], stats['max_length'], stats['count']),
+                         (self.small.min(), self.small.max(), len(self.small)))
+
+    def test_log_binned_quantiles(self):
+        histogram = LengthHistogram()
+        histogram.add(self.large)
+        self.assertTrue(histogram.log_bins)
+        for q in (0.05, 0.5, 0.8, 0.95, 0.99):
+            expected = np.quantile(self.large, q)
+            self.assertLessEqual(abs(histogram.quantile(q) - expected), intron_stats.LOG_STEP * expected, q)
+        self.assertEqual(histogram.quantile(1), self.large.max())
+
+    def test_merge(self):
+        whole, left, right = LengthHistogram(), LengthHistogram(), LengthHistogram()
+        whole.add(self.large)
+        left.add(self.large[:4000])
+        right.add(self.large[4000:])
+        merged = left.merge(right).merge(LengthHistogram())
+        np.testing.assert_array_equal(merged.exact, whole.exact)
+        self.assertEqual(merged.log_bins, whole.log_bins)
+        for key, value in whole.statistics().items():
+            self.assertAlmostEqual(merged.statistics()[key], value, places=4)
+        self.assertEqual(LengthHistogram().merge(whole).count, whole.count)
+        self.assertEqual(LengthHistogram().statistics(), {'count': 0})
+
+
+class TestIntronStats(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, lines):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as f:
+            f.writelines(lines)
+        return path
+
+    def test_parent_parsing(self):
+        chunk = pd.DataFrame({
+            'seqname': ['chr1'] * 4,
+            'feature': ['exon', 'exon', 'CDS', 'exon'],
+            'start': [1, 50, 60, 100],
+            'end': [10, 60, 70, 120],
+            'attribute': ['gene_id "g1"; transcript_id "t1";', 'ID=e2;Parent=t2,t3', 'Parent=t2', 'Name=orphan'],
+        })
+        exons = intron_stats.extract_exons(chunk)
+        self.assertEqual(exons['transcript_id'].tolist(), ['t1', 't2', 't3'])
+        self.assertEqual(exons['start'].tolist(), [1, 50, 50])
+
+    def test_gff3_introns(self):
+        lines = ['##gff-version 3\n']
+        for start, end, parent in ((100, 200, 'm1,m2'), (301, 400, 'm1'), (351, 450, 'm2'), (600, 700, 'm1')):
+            lines.append(f'chr1\tsrc\texon\t{start}\t{end}\t.\t+\t.\tParent={parent}\n')
+        introns = intron_stats.parse_gtf(self.write('a.gff3', lines))
+        self.assertEqual(sorted(introns['intron_length'].tolist()), [100, 150, 199])
+
+    def test_chromosomes_across_chunks(self):
+        lines = []
+        for chrom in ('chr1', 'chr2', 'chr3'):
+            for t in range(5):
+                lines += gtf_lines(chrom, f'{chrom}.t{t}', [(1000 * t + 1, 1000 * t + 100), (1000 * t + 301, 1000 * t + 400)])
+        path = self.write('grouped.gtf', lines)
+        parts = list(intron_stats.iter_introns(path, chunksize=3))
+        self.assertEqual([part['seqname'].iat[0] for part in parts], ['chr1', 'chr2', 'chr3'])
+        self.assertEqual(sum(len(part) for part in parts), 15)
+        self.assertTrue((pd.concat(parts)['intron_length'] == 200).all())
+
+    def test_chromosome_reappears(self):
+        lines = (gtf_lines('chr1', 't1', [(1, 100), (201, 300)]) + gtf_lines('chr2', 't2', [(1, 100), (201, 300)]) +
+                 gtf_lines('chr1', 't3', [(1001, 1100), (1201, 1300)]))
+        path = self.write('ungrouped.gtf', lines)
+        with self.assertRaisesRegex(click.ClickException, 'chr1 appears again'):
+            list(intron_stats.iter_introns(path, chunksize=2))
+
+    def test_several_files(self):
+        first = self.write('first.gtf', gtf_lines('chr1', 't1', [(1, 100), (201, 300), (1001, 1100)]))
+        second = self.write('second.gtf', gtf_lines('chrX', 't2', [(1, 100), (151, 200)]))
+        prefix = os.path.join(self.tmpdir, 'out')
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            intron_stats.main.main(['-i', first, '-i', second, '-o', prefix, '-p', '2', '-q', '0.5'],
+                                   standalone_mode=False)
+        details = pd.read_csv(f'{prefix}.first.intron_len.txt', sep='\t')
+        self.assertEqual(details['intron_length'].tolist(), [100, 700])
+        self.assertEqual(pd.read_csv(f'{prefix}.second.intron_len.txt', sep='\t')['intron_length'].tolist(), [50])
+        report = out.getvalue()
+        self.assertIn('Intron Length Statistics (all files):', report)
+        self.assertIn('count: 3', report)
+        self.assertIn('p50: 100', report)
+
+
+if __name__ == '__main__':
+    unittest.main()
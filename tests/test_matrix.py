@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from tsstk import core
+from tsstk.matrix import TSSMatrix
+
+TABLE = os.path.join(os.path.dirname(__file__), 'ALL.samples.TSS.raw.txt')
+
+
+class TestTSSMatrix(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.df = pd.read_csv(TABLE, sep='\t', nrows=20000).sort_values(['strand', 'chr', 'pos'], ignore_index=True)
+        cls.samples = [c for c in cls.df.columns if c not in ('chr', 'pos', 'strand')]
+        cls.matrix = TSSMatrix.from_frames(cls.df.iloc[i:i + 3000] for i in range(0, len(cls.df), 3000))
+
+    def test_round_trip(self):
+        self.assertEqual(self.matrix.nnz, int((self.df[self.samples] != 0).to_numpy().sum()))
+        pd.testing.assert_frame_equal(self.matrix.to_frame(), self.df, check_dtype=False)
+        chunks = pd.concat(self.matrix.iter_frames(3000), ignore_index=True)
+        pd.testing.assert_frame_equal(chunks, self.df, check_dtype=False)
+
+    def test_normalization(self):
+        counts = self.df[self.samples]
+        cpm = self.matrix.cpm().to_frame()
+        expected = counts / counts.sum() * 1e6
+        np.testing.assert_allclose(cpm[self.samples].to_numpy(), expected.to_numpy())
+        np.testing.assert_array_equal(self.matrix.row_sums(), counts.sum(axis=1))
+        np.testing.assert_array_equal(self.matrix.row_sums(['YPD.2']), counts['YPD.2'])
+
+    def test_filters(self):
+        counts = self.df[self.samples]
+        kept = self.matrix.filter_rows(min_total=4, min_samples=2, min_value=2)
+        mask = (counts.sum(axis=1) >= 4) & ((counts >= 2).sum(axis=1) >= 2)
+        pd.testing.assert_frame_equal(kept.to_frame(), self.df[mask].reset_index(drop=True), check_dtype=False)
+
+        values = self.matrix.filter_values(3).to_frame()
+        masked = self.df.copy()
+        masked[self.samples] = counts.where(counts >= 3, 0)
+        masked = masked[(masked[self.samples] > 0).any(axis=1)].reset_index(drop=True)
+        pd.testing.assert_frame_equal(values, masked, check_dtype=False)
+
+        totals = self.matrix.sample_totals()
+        self.assertEqual(self.matrix.filter_samples(totals.iloc[1]).samples,
+                         [s for s in self.samples if totals[s] >= totals.iloc[1]])
+
+    def test_subset_and_merge(self):
+        subset = self.matrix.subset(['Arrest.1', 'YPD.1'])
+        expected = self.df[['chr', 'pos', 'strand', 'Arrest.1', 'YPD.1']]
+        expected = expected[(expected[['Arrest.1', 'YPD.1']] > 0).any(axis=1)].reset_index(drop=True)
+        pd.testing.assert_frame_equal(subset.to_frame(), expected, check_dtype=False)
+
+        left, right = self.matrix.subset(['YPD.1', 'YPD.2']), self.matrix.subset(['YPD.2', 'Arrest.2'])
+        merged = left.merge(right).to_frame()
+        self.assertEqual(list(merged.columns[3:]), ['YPD.1', 'YPD.2', 'Arrest.2'])
+        self.assertEqual(merged['YPD.2'].sum(), 2 * self.df['YPD.2'].sum())
+        self.assertEqual(merged['Arrest.2'].sum(), self.df['Arrest.2'].sum())
+
+    def test_clustering_accepts_matrix(self):
+        pd.testing.assert_frame_equal(core.cluster_tss_table(self.matrix), core.cluster_tss_table(self.df))
+
+    def test_clustering_ignores_row_order(self):
+        # Strand-major with chrII first, as in TSSr tables
+        df = pd.read_csv(TABLE, sep='\t').groupby(['chr', 'strand']).head(3000)
+        df = df.sort_values(['strand', 'chr', 'pos'], ascending=[True, False, True], ignore_index=True)
+        clusters = core.cluster_tss_table(df)
+        pd.testing.assert_frame_equal(core.cluster_tss_table(TSSMatrix.from_frame(df)), clusters)
+        pd.testing.assert_frame_equal(clusters, core.cluster_tss_table(df.sample(frac=1, random_state=0)))
+        self.assertEqual(clusters.drop_duplicates(['chr', 'strand'])[['chr', 'strand']].values.tolist(),
+                         [['chrI', '+'], ['chrI', '-'], ['chrII', '+'], ['chrII', '-']])
+
+    def test_memory_on_many_samples(self):
+        # 100 samples, each seeing ~3% of the positions
+        rng = np.random.default_rng(0)
+        n_rows, n_samples = 20000, 100
+        values = rng.integers(1, 50, (n_rows, n_samples)) * (rng.random((n_rows, n_samples)) < 0.03)
+        df = pd.DataFrame(values, columns=[f"s{i}" for i in range(n_samples)])
+        df.insert(0, 'chr', 'chr1')
+        df.insert(1, 'pos', np.arange(1, n_rows + 1))
+        df.insert(2, 'strand', '+')
+        matrix = TSSMatrix.from_frame(df)
+        self.assertLess(matrix.memory_usage() * 10, df.memory_usage(deep=True).sum())
+        tmpdir = tempfile.mkdtemp()
+        try:
+            matrix.write(os.path.join(tmpdir, 'out.tsv'))
+            written = pd.read_csv(os.path.join(tmpdir, 'out.tsv'), sep='\t')
+        finally:
+            shutil.rmtree(tmpdir)
+        pd.testing.assert_frame_equal(written, df[(values > 0).any(axis=1)].reset_index(drop=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from tsstk import merge_gff3
+
+
+def gene_block(chrom, start, name):
+    end = start + 500
+    return [
+        f'{chrom}\tsrc\tgene\t{start}\t{end}\t.\t+\t.\tID={name}\n',
+        f'{chrom}\tsrc\tmRNA\t{start}\t{end}\t.\t+\t.\tID={name}.t1;Parent={name}\n',
+        f'{chrom}\tsrc\texon\t{start}\t{end}\t.\t+\t.\tParent={name}.t1\n',
+    ]
+
+
+class TestMergeGff3(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        rng = random.Random(0)
+        # (chromosome number, start, file, block) of every gene, with repeated starts to check stable ties
+        self.genes = []
+        self.inputs = []
+        for file_index, (chroms, regions) in enumerate([
+                (['chr10', 'chr2', 'chr1'], ['chr1 1 5000', 'chr10 1 9000']),
+                (['chr2', 'chr10'], ['chr10 1 12000', 'chr2 1 7000'])]):
+            path = os.path.join(self.tmpdir, f'input{file_index}.gff3')
+            with open(path, 'w') as f:
+                f.write('##gff-version 3\n')
+                f.writelines(f'##sequence-region {region}\n' for region in regions)
+                f.write('# a comment that is dropped\n')
+                for block_index in range(150):
+                    chrom = rng.choice(chroms)
+                    start = rng.randrange(1, 40) * 100
+                    name = f'g{file_index}_{block_index}'
+                    self.genes.append((int(chrom[3:]), start, file_index, block_index, gene_block(chrom, start, name)))
+                    f.writelines(self.genes[-1][-1])
+                f.write('##FASTA\n>chr1\nACGT\n')
+            self.inputs.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read_output(self, path):
+        with open(path) as f:
+            return f.readlines()
+
+    def test_spilled_merge_matches_in_memory_sort(self):
+        spilled, in_memory = os.path.join(self.tmpdir, 'spilled.gff3'), os.path.join(self.tmpdir, 'memory.gff3')
+        with mock.patch.object(merge_gff3, 'MIN_MEMORY_MB', 0), \
+                mock.patch.object(merge_gff3, 'write_run', wraps=merge_gff3.write_run) as write_run:
+            merge_gff3.merge_gff3(self.inputs, spilled, memory_mb=0, tmpdir=self.tmpdir)
+        self.assertEqual(write_run.call_count, len(self.genes))
+        merge_gff3.merge_gff3(self.inputs, in_memory)
+
+        lines = self.read_output(spilled)
+        self.assertEqual(lines, self.read_output(in_memory))
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['input0.gff3', 'input1.gff3', 'memory.gff3', 'spilled.gff3'])
+
+        # Directives are merged once, in natural chromosome order, followed by the sorted genes
+        self.assertEqual(lines[:4], ['##gff-version 3\n', '##sequence-region chr1 1 5000\n',
+                                     '##sequence-region chr2 1 7000\n', '##sequence-region chr10 1 12000\n'])
+        expected = [line for *_, block in sorted(self.genes, key=lambda gene: gene[:4]) for line in block]
+        self.assertEqual(lines[4:], expected)
+        chroms = [line.split('\t')[0] for line in lines[4:]]
+        self.assertEqual(sorted(set(chroms), key=chroms.index), ['chr1', 'chr2', 'chr10'])
+
+    def test_command(self):
+        output = os.path.join(self.tmpdir, 'merged.gff3')
+        with mock.patch.object(merge_gff3, 'MIN_MEMORY_MB', 0):
+            merge_gff3.main.main(['-i1', self.inputs[0], '-i2', self.inputs[1], '-o', output, '--memory', '0'],
+                                 standalone_mode=False)
+        lines = self.read_output(output)
+        self.assertEqual(sum(line.startswith('##gff-version') for line in lines), 1)
+        self.assertEqual(len(lines), 4 + 3 * len(self.genes))
+
+    def test_natural_chromosome_order(self):
+        names = ['chr10', 'chrM', 'chr2', 'chr1', 'scaffold_10', 'scaffold_9']
+        self.assertEqual(sorted(names, key=merge_gff3.chrom_key),
+                         ['chr1', 'chr2', 'chr10', 'chrM', 'scaffold_9', 'scaffold_10'])
+
+
+if __name__ == '__main__':
+    unittest.main()
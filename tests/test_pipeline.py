@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+from click.testing import CliRunner
+
+from tsstk import core
+from tsstk.cluster_assigner import assign_genes
+from tsstk.combine_multi_TSS_table import combine_tables
+from tsstk.pipeline import Stage, build_stages, gene_table, pipeline, run_pipeline, topological_order
+from tsstk.store import write_store
+from tests.test_core import write_bam
+
+GFF3 = """##gff-version 3
+chr1\t.\tgene\t50\t900\t.\t+\t.\tID=geneA
+chr1\t.\tmRNA\t50\t900\t.\t+\t.\tID=rnaA;Parent=geneA
+chr1\t.\tCDS\t120\t800\t.\t+\t0\tID=cdsA;Parent=rnaA
+chr1\t.\tgene\t1500\t2500\t.\t-\t.\tID=geneB
+chr1\t.\tmRNA\t1500\t2500\t.\t-\t.\tID=rnaB;Parent=geneB
+chr1\t.\tCDS\t1600\t2400\t.\t-\t0\tID=cdsB;Parent=rnaB
+"""
+
+
+def add(a, b):
+    return a + b
+
+
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.bams = []
+        for name, shift in (('s1', 0), ('s2', 3)):
+            bam = os.path.join(self.tmpdir, f'{name}.bam')
+            write_bam(bam, [('chr1', 99 + shift, '20M', 0, 30)] * 4 +
+                           [('chr1', 1990, '10M', 0x10, 30)] * 3 +
+                           [('chr2', 9, '20M', 0, 30)] * (2 + shift))
+            self.bams.append(bam)
+        self.gff3 = os.path.join(self.tmpdir, 'genes.gff3')
+        with open(self.gff3, 'w') as f:
+            f.write(GFF3)
+        self.outdir = os.path.join(self.tmpdir, 'out')
+        os.makedirs(self.outdir)
+        self.checkpoints = os.path.join(self.tmpdir, 'checkpoints')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_stages(self, workers=2, **options):
+        stages = build_stages(self.bams, gff3=self.gff3, outdir=self.outdir, prefix='run', workers=workers,
+                              **options)
+        return run_pipeline(stages, workers, self.checkpoints)
+
+    def test_matches_separate_tools(self):
+        status = self.run_stages()
+        self.assertEqual(set(status.values()), {'run'})
+
+        table = combine_tables([core.tss_frame_from_bam(bam, processes=1) for bam in self.bams])
+        pd.testing.assert_frame_equal(pd.read_csv(os.path.join(self.outdir, 'run.TSS.raw.txt'), sep='\t'),
+                                      table.reset_index(drop=True))
+        clusters = assign_genes(core.cluster_tss_table(table), gene_table(self.gff3))
+        written = pd.read_csv(os.path.join(self.outdir, 'run.clusters.txt'), sep='\t', keep_default_na=False)
+        self.assertEqual(written['gene'].tolist(), clusters['gene'].tolist())
+        self.assertEqual(written['dominant_tss'].tolist(), clusters['dominant_tss'].tolist())
+        self.assertIn('geneA', written['gene'].tolist())
+        bed = pd.read_csv(os.path.join(self.outdir, 'run.dominant_tss.bed'), sep='\t', header=None)
+        self.assertEqual(len(bed), len(clusters))
+        for strand in ('plus', 'minus'):
+            self.assertTrue(os.path.exists(os.path.join(self.outdir, f'run_normalized_TPM.{strand}.bedgraph')))
+
+    def test_rerun_uses_checkpoints(self):
+        self.run_stages()
+        self.assertEqual(set(self.run_stages().values()), {'cached'})
+
+        # Only the tracks depend on the bedGraph threshold
+        status = self.run_stages(min_signal=5)
+        self.assertEqual([name for name, s in status.items() if s == 'run'], ['tracks'])
+
+        # A clustering parameter reruns the clustering and everything below it
+        status = self.run_stages(workers=1, min_signal=5, max_distance=5)
+        self.assertEqual(sorted(name for name, s in status.items() if s == 'run'),
+                         ['assign', 'clusters', 'dominant-bed', 'write-clusters'])
+
+        # The number of processes per BAM does not change the counts
+        self.assertEqual(set(self.run_stages(workers=4, min_signal=5, max_distance=5).values()), {'cached'})
+
+        # A deleted output is written again
+        os.remove(os.path.join(self.outdir, 'run.dominant_tss.bed'))
+        status = self.run_stages(min_signal=5, max_distance=5)
+        self.assertEqual([name for name, s in status.items() if s == 'run'], ['dominant-bed'])
+
+    def test_store_changes_rerun_table(self):
+        store = os.path.join(self.tmpdir, 'samples.tsss')
+        table = pd.DataFrame({'chr': ['chr1', 'chr1'], 'pos': [100, 1990], 'strand': ['+', '-'], 'A': [5, 3]})
+        write_store(table, store)
+
+        def run():
+            stages = build_stages(tables=[store], outdir=self.outdir, prefix='run', workers=1)
+            return run_pipeline(stages, 1, self.checkpoints)
+
+        run()
+        self.assertEqual(run()['table:samples.tsss'], 'cached')
+        # A rewritten store with the same path has new content
+        write_store(table.assign(A=[5, 4]), store)
+        self.assertEqual(run()['table:samples.tsss'], 'run')
+
+        other = os.path.join(self.tmpdir, 'other')
+        shutil.copytree(store, os.path.join(other, 'samples.tsss'))
+        result = CliRunner().invoke(pipeline, ['-t', store, '-t', os.path.join(other, 'samples.tsss'),
+                                               '-o', self.outdir])
+        self.assertEqual(result.exit_code, 2, result.output)
+        self.assertIn('distinct file names', result.output)
+
+    def test_dag_order(self):
+        stages = [Stage('c', add, deps=['a', 'b']), Stage('a', add, params={'a': 1, 'b': 2}),
+                  Stage('b', add, deps=['a'], params={'b': 10})]
+        self.assertEqual([s.name for s in topological_order(stages)], ['a', 'b', 'c'])
+        with self.assertRaises(ValueError):
+            topological_order([Stage('a', add, deps=['b']), Stage('b', add, deps=['a'])])
+        with self.assertRaises(ValueError):
+            topological_order([Stage('a', add, deps=['missing'])])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from tsstk import quantify
+
+TABLE = os.path.join(os.path.dirname(__file__), 'ALL.samples.TSS.raw.txt')
+
+
+def naive_counts(regions, table, sample, rule):
+    # Per-TSS loop over the regions containing it
+    counts = dict.fromkeys(regions['gene_id'], 0.0)
+    for row in table[table[sample] > 0].itertuples(index=False):
+        hits = regions[(regions['chromosome'] == row.chr) & (regions['strand'] == row.strand) &
+                       (regions['gene_start'] <= row.pos) & (regions['gene_end'] >= row.pos)]
+        value = getattr(row, sample.replace('.', '_'))
+        if not len(hits) or (rule == 'unique' and len(hits) > 1):
+            continue
+        if rule == 'nearest':
+            five_prime = np.where(hits['strand'] == '-', hits['gene_end'], hits['gene_start'])
+            hits = hits.iloc[[np.argmin(np.abs(five_prime - row.pos))]]
+        for gene in hits['gene_id']:
+            counts[gene] += value / len(hits) if rule == 'split' else value
+    return counts
+
+
+class TestQuantify(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        table = pd.read_csv(TABLE, sep='\t', nrows=3000)
+        cls.table = table.rename(columns=lambda c: c.replace('.', '_'))
+        rng = np.random.default_rng(0)
+        # Overlapping regions on both strands, some genes with two regions
+        starts = rng.integers(1, table['pos'].max(), 60)
+        cls.regions = pd.DataFrame({
+            'chromosome': rng.choice(['chrI', 'chrII', 'chrM'], 60),
+            'gene_start': starts,
+            'gene_end': starts + rng.integers(0, 3000, 60),
+            'strand': rng.choice(['+', '-'], 60),
+            'gene_id': [f'gene{i % 50}' for i in range(60)],
+        })
+        cls.regions_file = os.path.join(cls.tmpdir, 'regions.txt')
+        cls.regions.to_csv(cls.regions_file, sep='\t', index=False, header=False)
+        cls.inputs = []
+        for i, columns in enumerate((['YPD_1', 'YPD_2'], ['Arrest_1'])):
+            path = os.path.join(cls.tmpdir, f'tss{i}.tsv')
+            cls.table[['chr', 'pos', 'strand'] + columns].to_csv(path, sep='\t', index=False)
+            cls.inputs.append(path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def test_rules_match_per_tss_loop(self):
+        for rule in quantify.OVERLAP_RULES:
+            matrix = quantify.quantify(self.regions, self.inputs, rule, processes=2).set_index('gene_id')
+            self.assertEqual(list(matrix.columns), ['YPD_1', 'YPD_2', 'Arrest_1'])
+            self.assertEqual(len(matrix), 50)
+            for sample in ('YPD_2', 'Arrest_1'):
+                expected = pd.Series(naive_counts(self.regions, self.table, sample, rule))
+                np.testing.assert_allclose(matrix[sample].reindex(expected.index), expected, err_msg=rule)
+
+    def test_command(self):
+        output = os.path.join(self.tmpdir, 'genes.txt')
+        quantify.main.main(['-r', self.regions_file, self.inputs[0], self.inputs[0], '-o', output, '-p', '1'],
+                           standalone_mode=False)
+        matrix = pd.read_csv(output, sep='\t')
+        self.assertEqual(list(matrix.columns), ['gene_id', 'YPD_1', 'YPD_2', 'YPD_1.2', 'YPD_2.2'])
+        self.assertTrue((matrix['YPD_1'] == matrix['YPD_1.2']).all())
+        self.assertGreater(matrix['YPD_1'].sum(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+from tsstk import store
+
+TABLE = os.path.join(os.path.dirname(__file__), 'ALL.samples.TSS.raw.txt')
+
+
+class TestTSSStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.table = os.path.join(self.tmpdir, 'table.tsv')
+        pd.read_csv(TABLE, sep='\t').iloc[::20].to_csv(self.table, sep='\t', index=False)
+        self.df = pd.read_csv(self.table, sep='\t')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip(self):
+        path = store.convert_table(self.table)
+        self.assertTrue(store.is_store(path))
+        frame = store.TSSStore(path).to_frame()
+        frame['chr'] = frame['chr'].astype(object)
+        frame['strand'] = frame['strand'].astype(object)
+        expected = self.df.sort_values(['strand', 'chr', 'pos']).reset_index(drop=True)
+        pd.testing.assert_frame_equal(frame, expected, check_dtype=False)
+        chunks = pd.concat(store.TSSStore(path).iter_frames(chunksize=100), ignore_index=True)
+        pd.testing.assert_frame_equal(chunks, expected, check_dtype=False)
+
+    def test_query(self):
+        tss_store = store.TSSStore(store.convert_table(self.table))
+        expected = self.df[(self.df['chr'] == 'chrII') & (self.df['strand'] == '-')
+                           & self.df['pos'].between(100000, 200000)].reset_index(drop=True)
+        result = tss_store.query('chrII', 100000, 200000, '-')
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+        totals = tss_store.count('chrII', 100000, 200000, '-', samples=['YPD.2'])
+        self.assertEqual(totals, {'YPD.2': expected['YPD.2'].sum()})
+        self.assertEqual(len(tss_store.query('chrX', 1, 10)), 0)
+
+    def test_cache(self):
+        cache_dir = os.path.join(self.tmpdir, 'cache')
+        first = store.cached_store(self.table, cache_dir)
+        mtime = os.path.getmtime(os.path.join(first.path, 'pos.npy'))
+        self.assertEqual(store.cached_store(self.table, cache_dir).path, first.path)
+        self.assertEqual(os.path.getmtime(os.path.join(first.path, 'pos.npy')), mtime)
+
+        # Changing the source invalidates the cached store
+        self.df.iloc[:10].to_csv(self.table, sep='\t', index=False)
+        self.assertEqual(len(store.cached_store(self.table, cache_dir)), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
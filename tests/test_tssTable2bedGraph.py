@@ -0,0 +1,128 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from tsstk import tssTable2bedGraph
+from tsstk.matrix import TSSMatrix
+
+TABLE = os.path.join(os.path.dirname(__file__), 'ALL.samples.TSS.raw.txt')
+BEDGRAPH_COLUMNS = ['chr', 'start', 'end', 'value']
+
+
+def read_bedgraph(path):
+    return pd.read_csv(path, sep='\t', header=None, names=BEDGRAPH_COLUMNS)
+
+
+class TestBedGraph(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        # Both strands of two chromosomes
+        cls.df = pd.read_csv(TABLE, sep='\t').groupby(['chr', 'strand']).head(1500).reset_index(drop=True)
+        cls.table = os.path.join(cls.tmpdir, 'table.txt')
+        cls.df.to_csv(cls.table, sep='\t', index=False)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def prefix(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def assertSameFiles(self, outputs, expected):
+        for pair, expected_pair in zip(outputs, expected):
+            for path, expected_path in zip(pair, expected_pair):
+                with open(path, 'rb') as handle, open(expected_path, 'rb') as expected_handle:
+                    self.assertEqual(handle.read(), expected_handle.read())
+
+    def test_streaming_matches_in_memory(self):
+        for merge in (False, True):
+            expected = tssTable2bedGraph.process_table(self.table, self.prefix(f'memory{merge}'), merge=merge)
+            outputs = tssTable2bedGraph.process_table(self.table, self.prefix(f'stream{merge}'), chunksize=700,
+                                                      merge=merge)
+            self.assertSameFiles(outputs, expected)
+            self.assertGreater(os.path.getsize(outputs[0][0]), 0)
+            self.assertGreater(os.path.getsize(outputs[0][1]), 0)
+
+    def test_matrix_is_expanded_in_chunks(self):
+        matrix = TSSMatrix.from_frame(self.df)
+        expected = tssTable2bedGraph.process_table(matrix.to_frame(), self.prefix('matrix_frame'))
+        with mock.patch.object(tssTable2bedGraph, 'STREAMING_CHUNKSIZE', 700), \
+                mock.patch.object(TSSMatrix, 'to_frame', autospec=True, side_effect=TSSMatrix.to_frame) as to_frame:
+            outputs = tssTable2bedGraph.process_table(matrix, self.prefix('matrix'))
+        rows = [call.args[2] - call.args[1] for call in to_frame.call_args_list]
+        self.assertEqual(max(rows), 700)
+        self.assertEqual(sum(rows), 2 * matrix.n_rows)
+        self.assertSameFiles(outputs, expected)
+
+    def test_values(self):
+        (plus, minus), = tssTable2bedGraph.process_table(self.table, self.prefix('values'))
+        signal = self.df[list(self.df.columns[3:5])].sum(axis=1)
+        expected = self.df.assign(start=self.df['pos'] - 1, end=self.df['pos'],
+                                  value=(signal / signal.sum() * 1e6).round(6))[signal >= 2]
+        for path, strand, sign in ((plus, '+', 1), (minus, '-', -1)):
+            rows = expected[expected['strand'] == strand]
+            bedgraph = read_bedgraph(path)
+            self.assertEqual(bedgraph[['chr', 'start', 'end']].values.tolist(),
+                             rows[['chr', 'start', 'end']].values.tolist())
+            pd.testing.assert_series_equal(bedgraph['value'], sign * rows['value'].reset_index(drop=True),
+                                           check_names=False, atol=1e-6)
+
+    def test_merge_runs_across_chunks(self):
+        # chrA 10-17 carry one value, 18-19 another, 30 is not adjacent, and chrB 31-32 starts over
+        df = pd.DataFrame({
+            'chr': ['chrA'] * 11 + ['chrB'] * 2,
+            'pos': list(range(10, 20)) + [30, 31, 32],
+            'strand': '+',
+            'a': [2] * 8 + [4, 4, 2, 2, 2],
+            'b': 0,
+        })
+        table = os.path.join(self.tmpdir, 'runs.txt')
+        df.to_csv(table, sep='\t', index=False)
+        for chunksize in (None, 1, 3, 5):
+            (plus, minus), = tssTable2bedGraph.process_table(table, self.prefix(f'runs{chunksize}'),
+                                                             chunksize=chunksize, merge=True)
+            bedgraph = read_bedgraph(plus)
+            self.assertEqual(bedgraph[['chr', 'start', 'end']].values.tolist(),
+                             [['chrA', 9, 17], ['chrA', 17, 19], ['chrA', 29, 30], ['chrB', 30, 32]], chunksize)
+            self.assertEqual(bedgraph['value'].tolist(), [66666.666667, 133333.333333, 66666.666667, 66666.666667])
+            self.assertEqual(os.path.getsize(minus), 0)
+
+    def test_each_sample_columns_and_threshold(self):
+        outputs = tssTable2bedGraph.process_table(self.table, self.prefix('each'), chunksize=1000, each_sample=True,
+                                                  min_signal=3)
+        samples = list(self.df.columns[3:])
+        self.assertEqual(outputs, [(self.prefix(f'each_{s}') + '_normalized_TPM.plus.bedgraph',
+                                    self.prefix(f'each_{s}') + '_normalized_TPM.minus.bedgraph') for s in samples])
+        for sample, (plus, _) in zip(samples, outputs):
+            rows = self.df[(self.df['strand'] == '+') & (self.df[sample] >= 3)]
+            bedgraph = read_bedgraph(plus)
+            self.assertEqual(bedgraph['end'].tolist(), rows['pos'].tolist())
+            expected = (rows[sample] / self.df[sample].sum() * 1e6).round(6)
+            self.assertEqual(bedgraph['value'].tolist(), expected.tolist())
+
+        (plus, _), = tssTable2bedGraph.process_table(self.table, self.prefix('columns'), signal_columns=samples[-2:],
+                                                     min_signal=5)
+        signal = self.df[samples[-2:]].sum(axis=1)
+        rows = self.df[(self.df['strand'] == '+') & (signal >= 5)]
+        bedgraph = read_bedgraph(plus)
+        self.assertEqual(bedgraph['end'].tolist(), rows['pos'].tolist())
+        self.assertEqual(bedgraph['value'].tolist(), (signal[rows.index] / signal.sum() * 1e6).round(6).tolist())
+
+    def test_command(self):
+        prefix = self.prefix('command')
+        tssTable2bedGraph.process_tss.main(['-i', self.table, '--prefix', prefix, '--streaming', '--chunksize', '500',
+                                            '--merge-runs', '--columns', 'YPD.1,YPD.2'], standalone_mode=False)
+        expected = tssTable2bedGraph.process_table(self.table, self.prefix('command_expected'), merge=True,
+                                                   signal_columns=['YPD.1', 'YPD.2'])
+        self.assertSameFiles([(prefix + '_normalized_TPM.plus.bedgraph', prefix + '_normalized_TPM.minus.bedgraph')],
+                             expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
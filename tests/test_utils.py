@@ -0,0 +1,211 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import click
+import numpy as np
+import pandas as pd
+from click.testing import CliRunner
+
+from tsstk import utils
+from tsstk import combine_multi_TSS_table as combine
+
+TABLE = os.path.join(os.path.dirname(__file__), 'ALL.samples.TSS.raw.txt')
+
+
+@click.command()
+@click.option('-n', type=int, default=1000)
+@utils.instrumented
+def toy(n):
+    with utils.stage('build') as s:
+        values = list(range(n))
+        s.rows = n
+    for _ in range(3):
+        with utils.stage('sum') as s:
+            with utils.stage('inner'):
+                total = sum(values)
+            s.rows += n
+    click.echo(total)
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_disabled_is_a_no_op(self):
+        self.assertIs(utils.stage('anything'), utils.NULL_STAGE)
+        result = CliRunner().invoke(toy, ['-n', '10'])
+        self.assertEqual(result.output, '45\n')
+        self.assertIsNone(utils.current_stats())
+
+    def test_stats_json(self):
+        stats_file = os.path.join(self.tmpdir, 'stats.json')
+        prof_file = os.path.join(self.tmpdir, 'hot.prof')
+        result = CliRunner().invoke(toy, ['--stats-json', stats_file, '--cprofile', prof_file])
+        self.assertEqual(result.exit_code, 0, result.output)
+        with open(stats_file) as f:
+            report = json.load(f)
+        stages = {s['name']: s for s in report['stages']}
+        self.assertEqual(list(stages), ['total', 'build', 'sum', 'inner'])
+        self.assertEqual(stages['sum']['calls'], 3)
+        self.assertEqual(stages['sum']['rows'], 3000)
+        self.assertGreater(stages['build']['peak_rss_mb'], 0)
+        self.assertGreaterEqual(stages['total']['seconds'], stages['sum']['seconds'])
+        self.assertTrue(os.path.getsize(prof_file))
+        self.assertIsNone(utils.current_stats())
+
+    def test_profile_table(self):
+        result = CliRunner().invoke(toy, ['--profile'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('rows/s', result.output)
+        self.assertIn('build', result.output)
+
+
+class TestCompressedIO(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        with open(TABLE, 'rb') as f:
+            self.data = f.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def test_bgzf_round_trip(self):
+        with utils.open_output(self.path('a.txt.gz'), 'wb', threads=3) as f:
+            f.write(self.data)
+        self.assertEqual(utils.compression_of(self.path('a.txt.gz')), 'bgzf')
+        with gzip.open(self.path('a.txt.gz')) as f:
+            self.assertEqual(f.read(), self.data)
+        with utils.open_input(self.path('a.txt.gz'), 'rb', threads=3) as f:
+            self.assertEqual(f.read(), self.data)
+        with open(self.path('a.txt.gz'), 'rb') as f:
+            self.assertTrue(f.read().endswith(utils.BGZF_EOF))
+
+    def test_gzip_and_plain_inputs(self):
+        # Two concatenated gzip members, as written by `cat a.gz b.gz`
+        with open(self.path('b.gz'), 'wb') as f:
+            f.write(gzip.compress(self.data[:1000]) + gzip.compress(self.data[1000:]))
+        self.assertEqual(utils.compression_of(self.path('b.gz')), 'gzip')
+        with utils.open_input(self.path('b.gz'), 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertIsNone(utils.compression_of(TABLE))
+
+        expected = pd.read_csv(TABLE, sep='\t')
+        pd.testing.assert_frame_equal(utils.read_csv(self.path('b.gz'), sep='\t'), expected)
+        chunks = utils.read_csv(self.path('b.gz'), sep='\t', chunksize=7000)
+        pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), expected)
+
+        # Closing before the end stops the background thread
+        handle = utils.open_input(self.path('b.gz'))
+        self.assertTrue(handle.readline().startswith('chr'))
+        handle.close()
+
+    def test_close_stops_inflating(self):
+        with utils.open_output(self.path('c.gz'), 'wb') as f:
+            f.write(self.data)
+        with open(self.path('d.gz'), 'wb') as f:
+            f.write(gzip.compress(self.data))
+        for name in ('c.gz', 'd.gz'):
+            emitted = []
+            for header_only in (False, True):
+                with mock.patch.object(utils, 'READ_SIZE', 1 << 14), \
+                        mock.patch.object(utils._ThreadedReader, '_emit', autospec=True,
+                                          side_effect=utils._ThreadedReader._emit) as emit:
+                    columns = utils.read_csv(self.path(name), sep='\t', nrows=0 if header_only else None).columns
+                    emitted.append(emit.call_count)
+                self.assertEqual(list(columns), ['chr', 'pos', 'strand', 'YPD.1', 'YPD.2', 'Arrest.1', 'Arrest.2'])
+            # The header comes from the first chunks; the rest of the file is never inflated
+            self.assertLess(emitted[1] * 3, emitted[0], name)
+
+    def test_tool_reads_and_writes_gzip(self):
+        with open(self.path('t.txt.gz'), 'wb') as f:
+            f.write(gzip.compress(self.data))
+        combine.process_files.main([self.path('t.txt.gz'), TABLE, '-o', self.path('out.txt.bgz')], standalone_mode=False)
+        combine.process_files.main([TABLE, TABLE, '-o', self.path('out.txt')], standalone_mode=False)
+        self.assertEqual(utils.compression_of(self.path('out.txt.bgz')), 'bgzf')
+        pd.testing.assert_frame_equal(utils.read_csv(self.path('out.txt.bgz'), sep='\t'),
+                                      pd.read_csv(self.path('out.txt'), sep='\t'))
+
+
+class TestReadTable(unittest.TestCase):
+
+    def test_tss_schema(self):
+        expected = pd.read_csv(TABLE, sep='\t')
+        for pyarrow in (True, False):
+            with mock.patch.object(utils, 'has_pyarrow', return_value=pyarrow):
+                df = utils.read_table(TABLE, 'tss')
+            self.assertIsInstance(df['chr'].dtype, pd.CategoricalDtype)
+            self.assertIsInstance(df['strand'].dtype, pd.CategoricalDtype)
+            self.assertTrue((df.dtypes.iloc[1:] != object).all())
+            self.assertEqual(set(df.dtypes.drop(['chr', 'strand'])), {np.dtype(np.int32)})
+            pd.testing.assert_frame_equal(df.astype({'chr': str, 'strand': str}), expected, check_dtype=False)
+        self.assertLess(df.memory_usage(deep=True).sum() * 2, expected.memory_usage(deep=True).sum())
+
+        projected = utils.read_table(TABLE, 'tss', columns=['chr', 'pos', 'YPD.2'])
+        self.assertEqual(list(projected.columns), ['chr', 'pos', 'YPD.2'])
+        chunks = list(utils.read_table(TABLE, 'tss', chunksize=7000))
+        self.assertEqual(chunks[0]['YPD.1'].dtype, np.int32)
+        self.assertEqual(sum(map(len, chunks)), len(expected))
+
+    def test_missing_counts_and_headerless_schemas(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            table, genes = os.path.join(tmpdir, 'tss.tsv'), os.path.join(tmpdir, 'genes.txt')
+            with open(table, 'w') as f:
+                f.write('chr\tpos\tstrand\tA\tB\nchrI\t5\t+\tNA\t3\nchrI\t9\t-\t4000000000\tNA\n')
+            with open(genes, 'w') as f:
+                f.write('chrI\t1\t500\t+\tYAL001C\n')
+            df = utils.read_table(table, 'tss')
+            genes_df = utils.read_table(genes, 'gene_region')
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(df['A'].tolist(), [0, 4000000000])
+        self.assertEqual(df['A'].dtype, np.int64)
+        self.assertEqual((df['B'].tolist(), df['B'].dtype), ([3, 0], np.int32))
+        self.assertEqual(list(genes_df.columns), ['chromosome', 'gene_start', 'gene_end', 'strand', 'gene_id'])
+        self.assertEqual(genes_df['gene_end'].dtype, np.int32)
+
+    def test_numeric_labels_stay_strings(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            a, b, genes = (os.path.join(tmpdir, name) for name in ('a.tsv', 'b.tsv', 'genes.txt'))
+            with open(a, 'w') as f:
+                f.write('chr\tpos\tstrand\tA\n1\t100\t+\t3\n')
+            with open(b, 'w') as f:
+                f.write('chr\tpos\tstrand\tB\tC\n1\t100\t+\t5\tNA\nX\t7\t-\tNA\tNA\n')
+            with open(genes, 'w') as f:
+                f.write('1\t1\t500\t+\t000123\n')
+            for pyarrow in (True, False):
+                with mock.patch.object(utils, 'has_pyarrow', return_value=pyarrow):
+                    df = utils.read_table(a, 'tss')
+                    genes_df = utils.read_table(genes, 'gene_region')
+                self.assertEqual(list(df['chr'].cat.categories), ['1'])
+                self.assertEqual(genes_df['gene_id'].tolist(), ['000123'])
+                self.assertEqual(genes_df['chromosome'].tolist(), ['1'])
+
+            # The in-memory and the streaming combine agree on the key
+            outputs = []
+            for args in ([], ['--streaming']):
+                outputs.append(os.path.join(tmpdir, f'out{len(outputs)}.tsv'))
+                combine.process_files.main([a, b, '-o', outputs[-1]] + args, standalone_mode=False)
+            tables = [pd.read_csv(path, sep='\t', dtype={'chr': str}) for path in outputs]
+        finally:
+            shutil.rmtree(tmpdir)
+        pd.testing.assert_frame_equal(tables[0], tables[1])
+        self.assertEqual(tables[0].values.tolist(), [['1', 100, '+', 3, 5, 0], ['X', 7, '-', 0, 0, 0]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,3 @@
+from tsstk.cli import tsstk
+
+tsstk(prog_name='tsstk')
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+import os
+import zipfile
+import click
+import numpy as np
+from tsstk.utils import file_digest, instrumented, open_input, open_output, stage
+
+__version__ = "0.2.0"
+
+# Upstream (+) or downstream (-) extension of every gene region
+FLANK = 2000
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'tsstk')
+
+# Arrays of an annotation index, as returned by index_gff3()
+INDEX_KEYS = ('chrom', 'start', 'end', 'strand', 'gene_id', 'cds_start', 'cds_end')
+
+
+def parse_attributes(field):
+    attributes = {}
+    for item in field.strip().split(';'):
+        if '=' in item:
+            key, value = item.split('=', 1)
+            attributes[key.strip()] = value
+    return attributes
+
+
+def merge_extent(extent, first_start, last_start, last_end):
+    # extent is [first CDS start, last CDS start, end of the last CDS], where
+    # "last" is the CDS starting furthest right, as in a start-ordered CDS list
+    extent[0] = min(extent[0], first_start)
+    if last_start > extent[1]:
+        extent[1], extent[2] = last_start, last_end
+    elif last_start == extent[1]:
+        extent[2] = max(extent[2], last_end)
+
+
+def index_gff3(input_file):
+    """Read a GFF3 file once and return its genes with the extent of their CDS.
+
+    Parent chains (CDS -> mRNA -> gene, or CDS -> gene) are resolved after the
+    pass, so features may appear in any order. CDS coordinates are folded into
+    a small per-parent extent as they are read and never kept per line.
+    Returns a dict of arrays in gene file order holding the first CDS start and
+    the end of the last CDS of every gene; genes without any CDS have a CDS
+    start of 0.
+    """
+    genes = {}          # gene ID -> row index
+    chroms, starts, ends, strands, ids = [], [], [], [], []
+    parents = {}        # feature ID -> parent IDs
+    cds_extent = {}     # direct CDS parent ID -> extent, see merge_extent()
+
+    with open_input(input_file) as f:
+        for line in f:
+            if line.startswith('#'):
+                if line.startswith('##FASTA'):
+                    break
+                continue
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 9:
+                continue
+            feature = fields[2]
+            if feature == 'CDS':
+                start, end = int(fields[3]), int(fields[4])
+                parent = parse_attributes(fields[8]).get('Parent')
+                if not parent:
+                    continue
+                for pid in parent.split(','):
+                    extent = cds_extent.get(pid)
+                    if extent is None:
+                        cds_extent[pid] = [start, start, end]
+                    else:
+                        merge_extent(extent, start, start, end)
+                continue
+            attributes = parse_attributes(fields[8])
+            fid = attributes.get('ID')
+            if not fid:
+                continue
+            if feature == 'gene':
+                start, end = int(fields[3]), int(fields[4])
+                if fid in genes:
+                    # Lines sharing an ID describe one feature
+                    i = genes[fid]
+                    starts[i], ends[i] = min(starts[i], start), max(ends[i], end)
+                    continue
+                genes[fid] = len(ids)
+                chroms.append(fields[0])
+                starts.append(start)
+                ends.append(end)
+                strands.append(fields[6])
+                ids.append(fid)
+            elif 'Parent' in attributes:
+                parents.setdefault(fid, []).extend(attributes['Parent'].split(','))
+
+    gene_extent = [None] * len(ids)
+    ancestors = {}
+
+    def gene_ancestors(fid, seen=()):
+        # Walk the Parent chain up to the gene(s) a feature belongs to
+        if fid in genes:
+            return [genes[fid]]
+        if fid not in ancestors:
+            found = []
+            for pid in parents.get(fid, ()):
+                if pid not in seen:
+                    found.extend(gene_ancestors(pid, seen + (fid,)))
+            ancestors[fid] = found
+        return ancestors[fid]
+
+    for pid, extent in cds_extent.items():
+        for i in set(gene_ancestors(pid)):
+            if gene_extent[i] is None:
+                gene_extent[i] = list(extent)
+            else:
+                merge_extent(gene_extent[i], *extent)
+
+    cds_start = np.array([e[0] if e else 0 for e in gene_extent], dtype=np.int64)
+    cds_end = np.array([e[2] if e else 0 for e in gene_extent], dtype=np.int64)
+
+    return {
+        'chrom': np.array(chroms, dtype=str),
+        'start': np.array(starts, dtype=np.int64),
+        'end': np.array(ends, dtype=np.int64),
+        'strand': np.array(strands, dtype=str),
+        'gene_id': np.array(ids, dtype=str),
+        'cds_start': cds_start,
+        'cds_end': cds_end,
+    }
+
+
+def load_index(input_file, cache_dir=None):
+    """Return the parsed annotation, reusing a cached copy keyed on the file's SHA-1.
+
+    A cache file that cannot be read is rebuilt.
+    """
+    if cache_dir is None:
+        return index_gff3(input_file)
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_file = os.path.join(cache_dir, f"{file_digest(input_file)}.gff3idx.npz")
+    if os.path.exists(cache_file):
+        try:
+            with np.load(cache_file) as cached:
+                return {key: cached[key] for key in INDEX_KEYS}
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            pass
+    index = index_gff3(input_file)
+    tmp = f"{cache_file}.{os.getpid()}.tmp.npz"
+    np.savez(tmp, **index)
+    os.replace(tmp, cache_file)
+    return index
+
+
+def gene_regions(index, flank=FLANK):
+    """Turn indexed genes into regions running from `flank` bp upstream to the CDS end.
+
+    Genes without CDS are dropped. On the plus strand the region ends at the
+    end of the last CDS; on the minus strand it starts at the first CDS.
+    """
+    has_cds = index['cds_start'] > 0
+    chrom, strand, gene_id = index['chrom'][has_cds], index['strand'][has_cds], index['gene_id'][has_cds]
+    start, end = index['start'][has_cds].copy(), index['end'][has_cds].copy()
+    cds_start, cds_end = index['cds_start'][has_cds], index['cds_end'][has_cds]
+
+    plus, minus = strand == '+', strand == '-'
+    end[plus] = cds_end[plus]  # Positive strand, extend to the end of the last CDS
+    start[plus] = np.maximum(1, start[plus] - flank)  # Extend upstream, but not less than 1
+    start[minus] = cds_start[minus]  # Negative strand, start from the first CDS
+    end[minus] += flank  # Extend downstream
+    return chrom, start, end, strand, gene_id
+
+
+@click.command()
+@click.option('-i', '--input', 'input_file', required=True, help='Input GFF3 file')
+@click.option('-o', '--output', 'output_file', required=True, help='Output TSV file')
+@click.option('--cache', is_flag=True, help='Cache the parsed annotation, keyed by the file hash')
+@click.option('--cache-dir', type=click.Path(file_okay=False), default=None, help='Cache directory [default: $TSSTK_CACHE_DIR or ~/.cache/tsstk]')
+@click.option('--version', is_flag=True, help='Print the version number and exit')
+@instrumented
+def extract_gene_regions(input_file, output_file, cache, cache_dir, version):
+    if version:
+        print(f"extract_gene_regions version {__version__}")
+        return
+
+    if cache or cache_dir:
+        cache_dir = cache_dir or os.environ.get('TSSTK_CACHE_DIR', DEFAULT_CACHE_DIR)
+
+    # Index genes and their CDS extents in a single pass over the GFF3
+    with stage('index') as s:
+        index = load_index(input_file, cache_dir)
+        s.rows = len(index['gene_id'])
+
+    # Open a file to save the results
+    with stage('write') as s, open_output(output_file) as out_file:
+        for chromosome, gene_start, gene_end, strand, gene_id in zip(*gene_regions(index)):
+            # Write the extracted information
+            out_file.write(f"{chromosome}\t{gene_start}\t{gene_end}\t{strand}\t{gene_id}\n")
+            s.rows += 1
+
+    print(f"Extraction complete, results saved in {output_file}")
+
+if __name__ == "__main__":
+    extract_gene_regions()
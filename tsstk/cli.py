@@ -1,28 +1,59 @@
 # cli.py
 
+import importlib
 import click
-from tsstk import core  # 假设你在core.py中定义了具体的功能实现
+from tsstk import __version__
 
-@click.group()
+# 子命令 -> (模块, 命令对象, 简短说明)。模块只在该子命令真正运行时才导入，
+# 这样 `tsstk --help` 和 `--version` 不会加载 pandas、numpy、pysam 等重量级依赖。
+LAZY_COMMANDS = {
+    'gettss': ('tsstk.commands', 'gettss', 'Get TSS from a BAM file, or TSS clusters from a TSS table.'),
+    'convert': ('tsstk.commands', 'convert', 'Convert a TSS table into a memory-mapped binary TSS store.'),
+    'query': ('tsstk.commands', 'query', 'Print the TSS of a region from a TSS store.'),
+    'combine': ('tsstk.combine_multi_TSS_table', 'process_files', 'Merge multiple TSS tables on chr/pos/strand.'),
+    'bedgraph': ('tsstk.tssTable2bedGraph', 'process_tss', 'Convert a TSS table into TPM-normalized bedGraphs.'),
+    'regions': ('tsstk.assign_region_extractor', 'extract_gene_regions', 'Extract gene regions (flank to CDS end) from a GFF3.'),
+    'assign': ('tsstk.cluster_assigner', 'assign_clusters_to_genes', 'Assign TSS clusters to containing or nearby genes.'),
+    'dominant-bed': ('tsstk.cluster2domainantBed', 'main', 'Write promoter windows around dominant TSS as BED.'),
+    'merge-gff3': ('tsstk.merge_gff3', 'main', 'Merge and sort any number of GFF3 files.'),
+    'introns': ('tsstk.intron_stats', 'main', 'Report intron length statistics of GTF/GFF3 files.'),
+    'consensus': ('tsstk.consensus', 'main', 'Merge per-sample cluster tables into consensus clusters.'),
+    'quantify': ('tsstk.quantify', 'main', 'Count TSS signal per gene and sample over gene regions.'),
+    'shape': ('tsstk.cluster_shape', 'main', 'Compute interquantile width and shape index of TSS clusters per sample.'),
+    'pipeline': ('tsstk.pipeline', 'pipeline', 'Run BAM -> TSS table -> clusters -> gene assignment -> tracks.'),
+}
+
+
+class LazyGroup(click.Group):
+    """Click group that imports a subcommand's module only when it is invoked."""
+
+    def __init__(self, *args, lazy_commands=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands or {}
+
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_commands))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name in self.lazy_commands:
+            module_name, attr, _ = self.lazy_commands[cmd_name]
+            return getattr(importlib.import_module(module_name), attr)
+        return super().get_command(ctx, cmd_name)
+
+    def format_commands(self, ctx, formatter):
+        # Use the stored short help so listing the commands imports nothing
+        rows = [(name, self.lazy_commands[name][2]) for name in self.list_commands(ctx) if name in self.lazy_commands]
+        rows += [(name, cmd.get_short_help_str()) for name, cmd in self.commands.items() if name not in self.lazy_commands]
+        if rows:
+            with formatter.section('Commands'):
+                formatter.write_dl(sorted(rows))
+
+
+@click.group(cls=LazyGroup, lazy_commands=LAZY_COMMANDS)
+@click.version_option(version=__version__, prog_name='tsstk')
 def tsstk():
     """tsstk toolset for TSS analysis."""
     pass
 
-@click.command()
-@click.option('--bam', type=click.Path(exists=True), help='Path to the BAM file.')
-@click.option('--tsstable', type=click.Path(exists=True), help='Path to the TSS table.')
-def gettss(bam, tsstable):
-    """Get TSS information from BAM or TSS table."""
-    if bam:
-        core.get_tss_from_bam(bam)  # 假设在core.py中定义了这个函数
-    elif tsstable:
-        core.get_tss_from_table(tsstable)  # 假设在core.py中定义了这个函数
-    else:
-        click.echo("Please provide either --bam or --tsstable.")
-
-# 将子命令添加到主命令
-tsstk.add_command(gettss)
-
 if __name__ == '__main__':
     tsstk()
-
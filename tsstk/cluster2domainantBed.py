@@ -20,37 +20,169 @@ downstream adjustment, and output file path. For example:
 Replace 'script_name.py', 'input.tsv', and 'output.bed' with your actual script file name and file paths.
 
 Note: Default values for upstream and downstream adjustments are set to 150 and 10, respectively.
+
+Several windows can be written in one pass with repeated -w UP,DOWN options.
+With --fai (or --fasta) windows are clipped to the chromosome ends, and with
+--fasta and --fasta-output the window sequences are written as FASTA too:
+    python script_name.py -i input.tsv -w 150,10 -w 500,100 --fasta genome.fa --fasta-output windows.fa -o output.bed
 """
 
+import os
+import concurrent.futures
+
+import numpy as np
 import pandas as pd
 import click
+import pysam
+from tsstk.utils import instrumented, open_output, read_csv, read_table, stage
+
+# Windows fetched from the FASTA together when they lie within this many bases
+FETCH_SPAN = 1 << 20
+
+COMPLEMENT = str.maketrans('ACGTRYKMBDHVNacgtrykmbdhvn', 'TGCAYRMKVHDBNtgcayrmkvhdbn')
+
+def chromosome_sizes(fai=None, fasta=None):
+    """Return {chromosome: length} from a .fai index, or from the index of an indexed FASTA."""
+    if fai is None and fasta is not None:
+        if not os.path.exists(fasta + '.fai'):
+            with pysam.FastaFile(fasta) as fa:
+                return dict(zip(fa.references, fa.lengths))
+        fai = fasta + '.fai'
+    if fai is None:
+        return None
+    sizes = read_csv(fai, sep='\t', header=None, usecols=[0, 1], names=['chr', 'length'], dtype={'chr': str})
+    return dict(zip(sizes['chr'], sizes['length']))
 
-def process_file(input_file, upstream, downstream, output_file):
-    # Read the file
-    df = pd.read_csv(input_file, sep='\t')
+def promoter_windows(df, windows, sizes=None):
+    """Return BED rows of every (upstream, downstream) window around the dominant TSS of every cluster.
+
+    Rows are grouped by cluster, windows in the given order. With more than one
+    window the name gets a ``:upstream-downstream`` suffix. With chromosome
+    ``sizes`` windows are clipped to [0, length) and dropped when nothing is
+    left of them; otherwise only negative starts are clipped.
+    """
+    n = len(df)
+    upstream = np.tile(np.array([w[0] for w in windows], dtype=np.int64), n)
+    downstream = np.tile(np.array([w[1] for w in windows], dtype=np.int64), n)
+    row = np.repeat(np.arange(n), len(windows))
+    plus = (df['strand'] == '+').to_numpy()[row]
+    dominant = df['dominant_tss'].to_numpy(np.int64)[row]
+    chrom = df['chr'].astype(str).to_numpy()[row]
 
     # Calculate start and end based on the strand symbol
-    df['start'] = df.apply(lambda row: row['dominant_tss'] - upstream if row['strand'] == '+' else row['dominant_tss'] - downstream, axis=1)
-    df['end'] = df.apply(lambda row: row['dominant_tss'] + downstream if row['strand'] == '+' else row['dominant_tss'] + upstream, axis=1)
+    start = np.maximum(dominant - np.where(plus, upstream, downstream), 0)
+    end = dominant + np.where(plus, downstream, upstream)
+    if sizes is not None:
+        length = pd.Series(chrom).map(sizes).to_numpy(np.float64)
+        end = np.where(np.isnan(length), end, np.minimum(end, np.nan_to_num(length))).astype(np.int64)
 
     # Combine gene and cluster columns for a new column
-    df['name'] = df['gene'] + '_' + df['cluster'].astype(str)
+    name = (df['gene'].astype(str) + '_' + df['cluster'].astype(str)).to_numpy()[row]
+    if len(windows) > 1:
+        name = name + ':' + upstream.astype(str) + '-' + downstream.astype(str)
+
+    bed = pd.DataFrame({'chr': chrom, 'start': start, 'end': end, 'name': name,
+                        'tags.dominant_tss': df['tags.dominant_tss'].to_numpy()[row], 'strand': df['strand'].to_numpy()[row]})
+    return bed[bed['end'] > bed['start']].reset_index(drop=True)
+
+def dominant_windows(df, upstream, downstream, sizes=None):
+    """Return BED rows of the window around the dominant TSS of every cluster."""
+    return promoter_windows(df, [(upstream, downstream)], sizes)
+
+def fetch_sequences(fasta, chrom, start, end, strand):
+    """Return the sequences of windows on one chromosome, reverse-complemented on the minus strand.
 
-    # Select the required columns
-    bed_df = df[['chr', 'start', 'end', 'name', 'tags.dominant_tss', 'strand']]
+    Windows within FETCH_SPAN bases of each other are read with one fetch.
+    """
+    sequences = [None] * len(start)
+    order = np.argsort(start, kind='stable')
+    bucket = (start[order] - start[order[0]]) // FETCH_SPAN
+    with pysam.FastaFile(fasta) as fa:
+        for b in np.unique(bucket):
+            members = order[bucket == b]
+            lo, hi = int(start[members].min()), int(end[members].max())
+            span = fa.fetch(chrom, lo, hi)
+            for i in members:
+                seq = span[start[i] - lo:end[i] - lo]
+                sequences[i] = seq.translate(COMPLEMENT)[::-1] if strand[i] == '-' else seq
+    return sequences
+
+def _fetch_task(args):
+    return fetch_sequences(*args)
+
+def window_sequences(bed, fasta, processes=None):
+    """Fetch the sequence of every BED row, one chromosome per worker process."""
+    groups = bed.groupby('chr', sort=False, observed=True).indices
+    tasks = [(fasta, chrom, bed['start'].to_numpy()[idx], bed['end'].to_numpy()[idx], bed['strand'].to_numpy()[idx])
+             for chrom, idx in groups.items()]
+    if processes == 1 or len(tasks) < 2:
+        results = [_fetch_task(task) for task in tasks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(_fetch_task, tasks))
+    sequences = np.empty(len(bed), dtype=object)
+    for idx, seqs in zip(groups.values(), results):
+        sequences[idx] = seqs
+    return sequences
+
+def write_fasta(bed, sequences, output_file):
+    # Headers follow `bedtools getfasta -name -s`: name::chr:start-end(strand)
+    with open_output(output_file) as f:
+        for name, chrom, start, end, strand, seq in zip(bed['name'], bed['chr'], bed['start'], bed['end'],
+                                                         bed['strand'], sequences):
+            f.write(f">{name}::{chrom}:{start}-{end}({strand})\n{seq}\n")
+
+def process_file(input_file, upstream, downstream, output_file, windows=None, fai=None, fasta=None,
+                 fasta_output=None, processes=None):
+    # Read the file; keep unassigned genes as the literal 'NA'
+    with stage('read') as s:
+        df = read_table(input_file, 'cluster', keep_default_na=False)
+        sizes = chromosome_sizes(fai, fasta)
+        s.rows = len(df)
+
+    with stage('windows') as s:
+        bed_df = promoter_windows(df, windows or [(upstream, downstream)], sizes)
+        s.rows = len(df)
 
     # Write the results to a new BED file
-    bed_df.to_csv(output_file, sep='\t', index=False, header=False)
+    with stage('write') as s, open_output(output_file) as f:
+        bed_df.to_csv(f, sep='\t', index=False, header=False)
+        s.rows = len(bed_df)
+
+    if fasta and fasta_output:
+        with stage('sequences') as s:
+            write_fasta(bed_df, window_sequences(bed_df, fasta, processes), fasta_output)
+            s.rows = len(bed_df)
+
+def parse_window(ctx, param, values):
+    windows = []
+    for value in values:
+        try:
+            up, down = (int(v) for v in value.split(','))
+        except ValueError:
+            raise click.BadParameter(f"expected UP,DOWN, got {value!r}") from None
+        windows.append((up, down))
+    return windows
 
 # Command line interface using click
 @click.command()
 @click.option('-i', '--input', 'input_file', required=True, help='Input file path')
 @click.option('-u', '--upstream', default=150, help='Upstream adjustment value', type=int)
 @click.option('-d', '--downstream', default=10, help='Downstream adjustment value', type=int)
+@click.option('-w', '--window', 'windows', multiple=True, callback=parse_window,
+              help='Upstream,downstream window, repeatable; replaces -u/-d')
+@click.option('--fai', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Chromosome sizes (.fai) to clip windows to')
+@click.option('--fasta', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Indexed genome FASTA; also gives the chromosome sizes')
+@click.option('--fasta-output', default=None, help='Write the window sequences to this FASTA file (needs --fasta)')
+@click.option('-p', '--processes', type=int, default=None, help='Number of worker processes for --fasta-output')
 @click.option('-o', '--output', 'output_file', required=True, help='Output file path')
-def main(input_file, upstream, downstream, output_file):
-    process_file(input_file, upstream, downstream, output_file)
+@instrumented
+def main(input_file, upstream, downstream, windows, fai, fasta, fasta_output, processes, output_file):
+    if fasta_output and not fasta:
+        raise click.UsageError('--fasta-output needs --fasta')
+    process_file(input_file, upstream, downstream, output_file, windows, fai, fasta, fasta_output, processes)
 
 if __name__ == '__main__':
     main()
-
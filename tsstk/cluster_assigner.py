@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+import numpy as np
+import pandas as pd
+import click
+from tsstk.utils import instrumented, open_output, read_table, stage
+
+__version__ = "0.4.0"
+
+
+def build_max_table(values):
+    # Sparse table for range maxima: table[k][i] == values[i:i + 2**k].max()
+    table = [values]
+    k = 1
+    while (1 << k) <= len(values):
+        half = 1 << (k - 1)
+        table.append(np.maximum(table[-1][:-half], table[-1][half:]))
+        k += 1
+    return table
+
+
+def last_at_least(table, stop, threshold):
+    """For every query return the largest j < stop with values[j] >= threshold, or -1.
+
+    Walks left from ``stop`` with binary lifting over the range-maximum table,
+    skipping blocks whose maximum is below the threshold, so all queries are
+    answered together in O(log n) vectorized steps.
+    """
+    values = table[0]
+    pos = stop.copy()
+    for k in reversed(range(len(table))):
+        width = 1 << k
+        can_skip = pos >= width
+        block = np.where(can_skip, pos - width, 0)
+        can_skip &= table[k][block] < threshold
+        pos[can_skip] -= width
+    found = pos > 0
+    found[found] = values[pos[found] - 1] >= threshold[found]
+    return np.where(found, pos - 1, -1)
+
+
+def assign_genes(clusters_df, genes_df):
+    """Assign every cluster to a containing gene, or to its nearest gene on the same strand.
+
+    Adds the ``gene``, ``nearby`` and ``distance`` columns to a copy of
+    ``clusters_df``. When several genes contain a cluster (overlapping or nested
+    genes) the one starting closest to the cluster is reported. Otherwise the
+    nearest gene is reported in ``nearby`` with a signed distance: ``+`` for a
+    gene downstream in genome coordinates, ``-`` for one upstream, and a
+    distance of 0 for a gene that only partially overlaps the cluster.
+    """
+    clusters_df = clusters_df.copy()
+    n_clusters = len(clusters_df)
+    gene = np.full(n_clusters, 'NA', dtype=object)
+    nearby = np.full(n_clusters, 'NA', dtype=object)
+    distance = np.full(n_clusters, 'NA', dtype=object)
+    if genes_df.empty:
+        clusters_df['gene'], clusters_df['nearby'], clusters_df['distance'] = gene, nearby, distance
+        return clusters_df
+
+    # Place every (chromosome, strand) pair in its own block of one global
+    # coordinate axis so that all clusters are resolved in a single pass.
+    chrom_codes, _ = pd.factorize(pd.concat([clusters_df['chr'], genes_df['chromosome']]).astype(str))
+    strand_codes, strands = pd.factorize(pd.concat([clusters_df['strand'], genes_df['strand']]))
+    keys = chrom_codes.astype(np.int64) * max(len(strands), 1) + strand_codes
+    cluster_keys, gene_keys = keys[:n_clusters], keys[n_clusters:]
+
+    gene_start = genes_df['gene_start'].to_numpy(np.int64)
+    gene_end = genes_df['gene_end'].to_numpy(np.int64)
+    cluster_start = clusters_df['start'].to_numpy(np.int64)
+    cluster_end = clusters_df['end'].to_numpy(np.int64)
+    stride = max(gene_end.max(), cluster_end.max(initial=0)) + 2
+
+    # Queries are answered in coordinate order, which keeps the binary searches cache friendly
+    order = np.argsort(cluster_keys * stride + cluster_start, kind='stable')
+    cluster_keys, cluster_start, cluster_end = cluster_keys[order], cluster_start[order], cluster_end[order]
+    offset = cluster_keys * stride
+    cs, ce = offset + cluster_start, offset + cluster_end
+    gs, ge = gene_keys * stride + gene_start, gene_keys * stride + gene_end
+
+    by_start = np.argsort(gs, kind='stable')
+    gs_sorted, ge_by_start = gs[by_start], ge[by_start]
+    ends_table = build_max_table(ge_by_start)
+    gene_ids = genes_df['gene_id'].astype(str).to_numpy()
+
+    # Containing gene: starts at or before the cluster start and ends at or after its end
+    contain = last_at_least(ends_table, np.searchsorted(gs_sorted, cs, side='right'), ce)
+    has_gene = contain >= 0
+
+    # Genes partially overlapping the cluster are nearby at distance 0
+    overlap = last_at_least(ends_table, np.searchsorted(gs_sorted, ce, side='right'), cs)
+    has_overlap = ~has_gene & (overlap >= 0)
+
+    # Nearest gene entirely downstream (first start after the cluster end)
+    right = np.searchsorted(gs_sorted, ce, side='right')
+    right_ok = right < len(gs_sorted)
+    right = np.where(right_ok, right, 0)
+    right_ok &= gs_sorted[right] < offset + stride
+    right_dist = np.where(right_ok, gs_sorted[right] - ce, np.inf)
+
+    # Nearest gene entirely upstream (last end before the cluster start)
+    by_end = np.argsort(ge, kind='stable')
+    ge_sorted = ge[by_end]
+    left = np.searchsorted(ge_sorted, cs, side='left') - 1
+    left_ok = left >= 0
+    left = np.where(left_ok, left, 0)
+    left_ok &= ge_sorted[left] >= offset
+    left_dist = np.where(left_ok, cs - ge_sorted[left], np.inf)
+
+    # Downstream genes win ties, as in the neighbour scan this replaces
+    use_right = ~has_gene & ~has_overlap & right_ok & (right_dist <= left_dist)
+    use_left = ~has_gene & ~has_overlap & left_ok & ~use_right
+
+    gene[has_gene] = gene_ids[by_start[contain[has_gene]]]
+
+    overlap_gene = by_start[overlap[has_overlap]]
+    nearby[has_overlap] = gene_ids[overlap_gene]
+    distance[has_overlap] = np.where(gene_start[overlap_gene] > cluster_start[has_overlap], '+0', '-0')
+
+    nearby[use_right] = gene_ids[by_start[right[use_right]]]
+    distance[use_right] = ['+' + str(d) for d in right_dist[use_right].astype(np.int64).tolist()]
+    nearby[use_left] = gene_ids[by_end[left[use_left]]]
+    distance[use_left] = ['-' + str(d) for d in left_dist[use_left].astype(np.int64).tolist()]
+
+    clusters_df['gene'] = _unsort(gene, order)
+    clusters_df['nearby'] = _unsort(nearby, order)
+    clusters_df['distance'] = _unsort(distance, order)
+    return clusters_df
+
+
+def _unsort(values, order):
+    result = np.empty_like(values)
+    result[order] = values
+    return result
+
+
+@click.command()
+@click.option('-c', '--clusters', 'clusters_file', required=True, help='Input TSV file containing cluster information')
+@click.option('-g', '--genes', 'genes_file', required=True, help='Input TSV file containing gene regions extracted from GFF3')
+@click.option('-o', '--output', 'output_file', required=True, help='Output TSV file with assigned gene information')
+@click.option('--version', is_flag=True, help='Print the version number and exit')
+@instrumented
+def assign_clusters_to_genes(clusters_file, genes_file, output_file, version):
+    if version:
+        print(f"assign_clusters_to_genes version {__version__}")
+        return
+
+    # Load the clusters and genes data
+    with stage('read') as s:
+        clusters_df = read_table(clusters_file, 'cluster')
+        genes_df = read_table(genes_file, 'gene_region')
+        s.rows = len(clusters_df) + len(genes_df)
+
+    # Assign all clusters at once against the sorted gene coordinates
+    with stage('assign') as s:
+        clusters_df = assign_genes(clusters_df, genes_df)
+        s.rows = len(clusters_df)
+
+    # Save the updated clusters DataFrame to the output file
+    with stage('write') as s, open_output(output_file) as f:
+        clusters_df.to_csv(f, sep='\t', index=False)
+        s.rows = len(clusters_df)
+    print(f"Assignment complete, results saved in {output_file}")
+
+if __name__ == "__main__":
+    assign_clusters_to_genes()
@@ -1,39 +1,353 @@
+import os
+import json
+import hashlib
 import click
 import pandas as pd
+import tempfile
 import concurrent.futures
 
+from tsstk.store import TSSStore, is_store
+from tsstk.matrix import TSSMatrix
+from tsstk.utils import file_digest, instrumented, input_bytes, is_compressed_name, open_output, read_csv, read_table, stage
+
+KEYS = ["chr", "pos", "strand"]
+SORT_KEYS = ["strand", "chr", "pos"]
+
+# Rough in-memory size of one table row (key columns plus per-sample counts),
+# used to turn the memory budget into chunk sizes.
+ROW_OVERHEAD = 160
+COUNT_BYTES = 8
+
+# Smallest block read from a sorted run while merging; it bounds how many runs
+# can be merged in one pass under the memory budget.
+MIN_BLOCK_ROWS = 10000
+
+MANIFEST_VERSION = 1
+MANIFEST_SUFFIX = ".manifest.json"
+
 
 def process_file(file):
-    df = pd.read_csv(file, sep="\t", low_memory=False)
-    df = df[(df["chr"] != 0) | (df["pos"] != 0)]  # remove incorrect line if any
-    df.fillna(0, inplace=True)  # replace NA with 0
-    return df
+    if is_store(file):
+        return TSSStore(file).to_frame()
+    # Counts come back with NA replaced by 0
+    df = read_table(file, "tss")
+    return df[(df["chr"] != "0") | (df["pos"] != 0)]  # remove incorrect line if any
+
+
+def combine_tables(dfs):
+    """Sum TSS tables on chr/pos/strand into one table in TSSr (strand, chr, pos) order."""
+    # combine all files
+    combined_df = pd.concat(dfs).groupby(KEYS, observed=True, sort=False).sum().reset_index()
+
+    # as value type into int
+    for col in combined_df.columns:
+        if combined_df[col].dtype == "float64":
+            combined_df[col] = combined_df[col].astype(int)
+
+    # sort
+    combined_df.sort_values(by=SORT_KEYS, inplace=True)
+    return combined_df
+
+
+def read_columns(file):
+    if is_store(file):
+        return KEYS + TSSStore(file).samples
+    return list(read_csv(file, sep="\t", nrows=0).columns)
+
+
+def sample_columns(input_files, matrix=False, columns=None, first=1):
+    """Return the output sample columns and, per input, a mapping of its columns to them.
+
+    In the default mode columns with the same name in different inputs are
+    summed. With ``matrix=True`` every input keeps its own columns, and names
+    that collide with an earlier input get the input's 1-based index as suffix.
+    ``columns`` and ``first`` continue the numbering of an existing table.
+    """
+    columns, renames = list(columns or []), []
+    for i, file in enumerate(input_files, first):
+        rename = {}
+        for col in read_columns(file):
+            if col in KEYS:
+                continue
+            name = col
+            if matrix and name in columns:
+                name = f"{col}.{i}"
+            if name not in columns:
+                columns.append(name)
+            rename[col] = name
+        renames.append(rename)
+    return columns, renames
+
+
+def clean_chunk(df, rename):
+    df = df[(df["chr"] != "0") | (df["pos"] != 0)]  # remove incorrect line if any
+    df = df.rename(columns=rename).fillna(0)
+    counts = list(rename.values())
+    df[counts] = df[counts].astype("int64")
+    return df.groupby(SORT_KEYS, sort=True, observed=True)[counts].sum().reset_index()
+
+
+def spill_sorted_runs(file, rename, chunk_rows, run_prefix):
+    """Sort one input chunk by chunk into temporary run files and return their paths."""
+    runs = []
+    if is_store(file):
+        reader = TSSStore(file).iter_frames(chunk_rows)
+    else:
+        reader = read_table(file, "tss", chunksize=chunk_rows)
+    for i, chunk in enumerate(reader):
+        run = f"{run_prefix}.{i}.tsv"
+        clean_chunk(chunk, rename).to_csv(run, sep="\t", index=False)
+        runs.append(run)
+    return runs
+
+
+def _key_le(df, key):
+    # Rows whose (strand, chr, pos) key is lexicographically <= key
+    strand, chrom, pos = key
+    s, c = df["strand"], df["chr"]
+    return (s < strand) | ((s == strand) & ((c < chrom) | ((c == chrom) & (df["pos"] <= pos))))
+
+
+def merge_runs(runs, columns, block_rows, handle):
+    """K-way merge sorted run files block by block and write the summed rows.
+
+    Each run contributes one block at a time. All buffered rows up to the
+    smallest last key among the blocks are final, because every run is sorted
+    and holds unique keys, so they are aggregated and written out before the
+    exhausted block is refilled.
+    """
+    readers = [read_csv(run, sep="\t", dtype={"chr": str, "strand": str}, chunksize=block_rows) for run in runs]
+    buffers = [next(reader, None) for reader in readers]
+    while True:
+        active = [i for i, buf in enumerate(buffers) if buf is not None and len(buf)]
+        if not active:
+            break
+        frontier = min(tuple(buffers[i].iloc[-1][SORT_KEYS]) for i in active)
+        parts = []
+        for i in active:
+            ready = int(_key_le(buffers[i], frontier).sum())
+            parts.append(buffers[i].iloc[:ready])
+            buffers[i] = buffers[i].iloc[ready:]
+            if not len(buffers[i]):
+                buffers[i] = next(readers[i], None)
+        merged = pd.concat(parts).groupby(SORT_KEYS, sort=True).sum().reset_index()
+        merged = merged.reindex(columns=KEYS + columns, fill_value=0)
+        merged[columns] = merged[columns].astype("int64")
+        merged.to_csv(handle, sep="\t", index=False, header=False)
+
+
+def memory_budget(memory_mb, n_columns):
+    """Return the rows that fit in ``memory_mb`` and how many runs one merge pass can take."""
+    budget_rows = max(memory_mb * 1024 * 1024 // (ROW_OVERHEAD + COUNT_BYTES * n_columns), 10 * MIN_BLOCK_ROWS)
+    return budget_rows, max(2, budget_rows // MIN_BLOCK_ROWS - 1)
+
+
+def spill_inputs(input_files, renames, budget_rows, processes, run_dir):
+    """Sort every input into temporary runs in parallel and return the run paths."""
+    workers = max(1, min(processes or os.cpu_count() or 1, len(input_files)))
+    with stage('spill') as s, concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        # The workers' reads do not show up in this process's I/O counters
+        s.bytes_read = input_bytes(input_files)
+        futures = [executor.submit(spill_sorted_runs, file, rename, budget_rows // workers, os.path.join(run_dir, str(i)))
+                   for i, (file, rename) in enumerate(zip(input_files, renames))]
+        return [run for future in futures for run in future.result()]
+
+
+def reduce_runs(runs, columns, budget_rows, fan_in, run_dir):
+    """Merge runs in passes of ``fan_in`` until at most ``fan_in`` are left."""
+    level = 0
+    while len(runs) > fan_in:
+        merged_runs = []
+        for j in range(0, len(runs), fan_in):
+            group = runs[j:j + fan_in]
+            merged = os.path.join(run_dir, f"merge{level}.{j}.tsv")
+            with open(merged, "w") as handle:
+                handle.write("\t".join(KEYS + columns) + "\n")
+                merge_runs(group, columns, budget_rows // (len(group) + 1), handle)
+            for run in group:
+                os.remove(run)
+            merged_runs.append(merged)
+        runs = merged_runs
+        level += 1
+    return runs
+
+
+def stream_merge(input_files, output, matrix=False, memory_mb=1024, processes=None, tmpdir=None):
+    """Merge TSS tables in bounded memory with an external sort and k-way merge."""
+    columns, renames = sample_columns(input_files, matrix)
+    budget_rows, fan_in = memory_budget(memory_mb, len(columns))
+
+    with tempfile.TemporaryDirectory(dir=tmpdir) as run_dir:
+        runs = spill_inputs(input_files, renames, budget_rows, processes, run_dir)
+
+        # Merge in several passes when there are more runs than fit in the budget
+        with stage('merge'):
+            runs = reduce_runs(runs, columns, budget_rows, fan_in, run_dir)
+            with open_output(output) as handle:
+                handle.write("\t".join(KEYS + columns) + "\n")
+                merge_runs(runs, columns, budget_rows // (len(runs) + 1), handle)
+    return columns, renames
+
+
+def manifest_path(output):
+    return output + MANIFEST_SUFFIX
+
+
+def input_digest(path):
+    """SHA-1 of an input table, or of every file of a store directory."""
+    if not is_store(path):
+        return file_digest(path)
+    digests = [f"{name}:{file_digest(os.path.join(path, name))}" for name in sorted(os.listdir(path))]
+    return hashlib.sha1("\n".join(digests).encode()).hexdigest()
+
+
+def output_fingerprint(output):
+    st = os.stat(output)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def read_manifest(output):
+    """Return the manifest of a combined table, checking that the table was not changed since."""
+    path = manifest_path(output)
+    if not os.path.exists(path):
+        raise click.ClickException(f"{output} exists but has no manifest ({path}); "
+                                   "combine all inputs again with --append to start one.")
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise click.ClickException(f"Unsupported manifest version in {path}")
+    if manifest["output"] != output_fingerprint(output):
+        raise click.ClickException(f"{output} was modified after {path} was written; "
+                                   "combine all inputs again without the old manifest.")
+    return manifest
+
+
+def write_manifest(output, manifest):
+    manifest["output"] = output_fingerprint(output)
+    tmp = manifest_path(output) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, manifest_path(output))
+
+
+def append_tables(input_files, output, matrix=False, memory_mb=1024, processes=None, tmpdir=None):
+    """Merge new inputs into an existing combined table and record them in its manifest.
+
+    Inputs whose checksum is already in the manifest are skipped, so only new
+    files are read. They are sorted into runs and merged with the existing
+    table (itself a sorted run) in one streaming pass; the table is replaced
+    atomically, then the manifest. Without an existing table all inputs are
+    combined with the streaming merge and a new manifest is started.
+    Returns the list of inputs that were merged.
+    """
+    if os.path.exists(output):
+        manifest = read_manifest(output)
+        if manifest["matrix"] != matrix:
+            raise click.ClickException(f"{output} was combined {'with' if manifest['matrix'] else 'without'} --matrix")
+    else:
+        manifest = {"version": MANIFEST_VERSION, "matrix": matrix, "columns": [], "inputs": []}
+
+    with stage('checksum') as s:
+        known = {entry["sha1"] for entry in manifest["inputs"]}
+        merged_paths = {entry["path"]: entry["sha1"] for entry in manifest["inputs"]}
+        new_files, entries = [], []
+        for file in input_files:
+            path, sha1 = os.path.abspath(file), input_digest(file)
+            if path in merged_paths and merged_paths[path] != sha1:
+                raise click.ClickException(f"{file} changed since it was merged into {output}; "
+                                           "combine all inputs again without --append.")
+            if sha1 in known:
+                continue
+            known.add(sha1)
+            new_files.append(file)
+            entries.append({"path": path, "sha1": sha1, "size": input_bytes([file])})
+        s.rows = len(input_files)
+
+    if not new_files:
+        return []
+
+    if not manifest["inputs"]:
+        columns, renames = stream_merge(new_files, output, matrix, memory_mb, processes, tmpdir)
+    else:
+        columns, renames = sample_columns(new_files, matrix, manifest["columns"], len(manifest["inputs"]) + 1)
+        budget_rows, fan_in = memory_budget(memory_mb, len(columns))
+        with tempfile.TemporaryDirectory(dir=tmpdir) as run_dir:
+            runs = spill_inputs(new_files, renames, budget_rows, processes, run_dir)
+            with stage('merge'):
+                # One slot of the final pass is taken by the existing table
+                runs = reduce_runs(runs, columns, budget_rows, fan_in - 1, run_dir) + [output]
+                tmp = os.path.join(os.path.dirname(os.path.abspath(output)), f".{os.path.basename(output)}.tmp")
+                try:
+                    with open_output(tmp, compress=is_compressed_name(output)) as handle:
+                        handle.write("\t".join(KEYS + columns) + "\n")
+                        merge_runs(runs, columns, budget_rows // (len(runs) + 1), handle)
+                    os.replace(tmp, output)
+                except BaseException:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+                    raise
+
+    for entry, rename in zip(entries, renames):
+        entry["columns"] = rename
+    manifest["columns"] = columns
+    manifest["inputs"].extend(entries)
+    write_manifest(output, manifest)
+    return new_files
 
 
 @click.command()
 @click.argument("input_files", nargs=-1, type=click.Path(exists=True))
 @click.option("--output", "-o", default="combined_TSS.raw.txt", help="Output file name.")
-def process_files(input_files, output):
+@click.option("--matrix", is_flag=True, help="Keep every input's sample columns separate (outer-join matrix) instead of summing columns with the same name.")
+@click.option("--streaming", is_flag=True, help="Merge with an external sort in bounded memory.")
+@click.option("--memory", "memory_mb", default=1024, show_default=True, help="Memory budget in MB for --streaming.")
+@click.option("--processes", "-p", type=int, default=None, help="Number of worker processes.")
+@click.option("--tmpdir", type=click.Path(file_okay=False), default=None, help="Directory for temporary sorted runs.")
+@click.option("--sparse", is_flag=True, help="Combine into a sparse count matrix; memory scales with the non-zero counts only.")
+@click.option("--append", is_flag=True, help="Merge only inputs not yet listed in the output's manifest into the existing output.")
+@instrumented
+def process_files(input_files, output, matrix, streaming, memory_mb, processes, tmpdir, sparse, append):
     """
     This script processes and merges multiple TSSr TSS table files based on 'chr', 'pos', 'strand' columns.
     """
-    
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        dfs = list(executor.map(process_file, input_files))
+    if append:
+        merged = append_tables(input_files, output, matrix, memory_mb, processes, tmpdir)
+        click.echo(f"Merged {len(merged)} new input(s) into {output}; "
+                   f"{len(input_files) - len(merged)} already merged.", err=True)
+        return
 
-    # combine all files
-    combined_df = pd.concat(dfs).groupby(["chr", "pos", "strand"]).sum().reset_index()
+    if streaming:
+        stream_merge(input_files, output, matrix, memory_mb, processes, tmpdir)
+        return
 
-    # as value type into int
-    for col in combined_df.columns:
-        if combined_df[col].dtype == "float64":
-            combined_df[col] = combined_df[col].astype(int)
+    if sparse:
+        _, renames = sample_columns(input_files, matrix)
+        with stage('combine') as s:
+            combined = TSSMatrix.from_tables(input_files, renames)
+            s.rows = combined.nnz
+        with stage('write') as s:
+            combined.write(output)
+            s.rows = combined.n_rows
+        return
 
-    # sort
-    combined_df.sort_values(by=["strand", "chr", "pos"], inplace=True)
+    with stage('read') as s, concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        dfs = list(executor.map(process_file, input_files))
+        s.rows = sum(len(df) for df in dfs)
+        s.bytes_read = input_bytes(input_files)
+
+    if matrix:
+        _, renames = sample_columns(input_files, matrix)
+        dfs = [df.rename(columns=rename) for df, rename in zip(dfs, renames)]
+
+    with stage('combine') as s:
+        s.rows = sum(len(df) for df in dfs)
+        combined_df = combine_tables(dfs)
 
     # save
-    combined_df.to_csv(output, sep="\t", index=False)
+    with stage('write') as s:
+        with open_output(output) as handle:
+            combined_df.to_csv(handle, sep="\t", index=False)
+        s.rows = len(combined_df)
 
 
 if __name__ == "__main__":
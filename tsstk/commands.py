@@ -0,0 +1,69 @@
+# commands.py
+
+import re
+import click
+from tsstk import core
+from tsstk import store
+from tsstk.utils import instrumented, stage
+
+@click.command()
+@click.option('--bam', type=click.Path(exists=True), help='Path to the BAM file (must be indexed).')
+@click.option('--tsstable', type=click.Path(exists=True), help='Path to the TSS table (or TSS store) to cluster.')
+@click.option('-o', '--output', 'output_file', default='-', help='Output TSS or cluster table, "-" for stdout.')
+@click.option('-p', '--processes', type=int, default=None, help='Number of worker processes [default: all cores].')
+@click.option('--mapq', 'min_mapq', type=int, default=0, help='Minimum mapping quality of counted reads.')
+@click.option('--chunk-size', type=int, default=core.DEFAULT_CHUNK_SIZE, help='Size of the regions the BAM is split into.')
+@click.option('--samples', default=None, help='Comma-separated sample columns summed for clustering [default: all].')
+@click.option('--max-dist', 'max_distance', type=int, default=core.DEFAULT_MAX_DISTANCE, show_default=True, help='Largest gap between neighbouring TSS of a cluster.')
+@click.option('--min-tpm', type=float, default=core.DEFAULT_MIN_TPM, show_default=True, help='Minimum TPM of a clustered TSS.')
+@click.option('--min-count', type=int, default=0, show_default=True, help='Minimum read count of a clustered TSS.')
+@click.option('--cluster-tpm', type=float, default=core.DEFAULT_CLUSTER_TPM, show_default=True, help='Minimum total TPM of a reported cluster.')
+@instrumented
+def gettss(bam, tsstable, output_file, processes, min_mapq, chunk_size, samples, max_distance, min_tpm, min_count,
+           cluster_tpm):
+    """Get TSS from a BAM file, or TSS clusters from a TSS table."""
+    if bam:
+        core.get_tss_from_bam(bam, output_file, processes=processes, min_mapq=min_mapq, chunk_size=chunk_size)
+    elif tsstable:
+        core.get_tss_from_table(tsstable, output_file, samples.split(',') if samples else None, max_distance,
+                                min_tpm, min_count, cluster_tpm, processes)
+    else:
+        click.echo("Please provide either --bam or --tsstable.")
+
+@click.command()
+@click.option('-i', '--input', 'input_file', type=click.Path(exists=True, dir_okay=False), required=True, help='TSS table to convert.')
+@click.option('-o', '--output', 'output_path', default=None, help='Output store directory [default: <input>.tsss].')
+@click.option('--cache', is_flag=True, help='Write to the shared cache instead, skipping the build if the table is unchanged.')
+@instrumented
+def convert(input_file, output_path, cache):
+    """Convert a TSS table into a memory-mapped binary TSS store."""
+    if cache:
+        path = store.cached_store(input_file).path
+    else:
+        path = store.convert_table(input_file, output_path)
+    click.echo(f"TSS store written to {path}")
+
+@click.command()
+@click.argument('store_path', type=click.Path(exists=True, file_okay=False))
+@click.argument('region')
+@click.option('-s', '--strand', type=click.Choice(['+', '-']), default=None, help='Restrict the query to one strand.')
+@click.option('--sum', 'summed', is_flag=True, help='Print per-sample totals instead of the TSS rows.')
+@instrumented
+def query(store_path, region, strand, summed):
+    """Print the TSS of REGION (chr:start-end, 1-based) from a TSS store."""
+    match = re.fullmatch(r'(.+):([\d,]+)-([\d,]+)', region)
+    if not match:
+        raise click.BadParameter('expected chr:start-end', param_hint='REGION')
+    chrom, start, end = match.group(1), int(match.group(2).replace(',', '')), int(match.group(3).replace(',', ''))
+    with stage('open'):
+        tss_store = store.TSSStore(store_path)
+    if summed:
+        with stage('query'):
+            totals = tss_store.count(chrom, start, end, strand)
+        for sample, total in totals.items():
+            click.echo(f"{sample}\t{total}")
+    else:
+        with stage('query') as s:
+            rows = tss_store.query(chrom, start, end, strand)
+            s.rows = len(rows)
+        click.echo(rows.to_csv(sep='\t', index=False), nl=False)
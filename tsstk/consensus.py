@@ -0,0 +1,184 @@
+# consensus.py
+
+import os
+import sys
+import heapq
+
+import click
+import pandas as pd
+
+from tsstk.utils import input_bytes, instrumented, open_output, read_table, stage
+
+CONSENSUS_COLUMNS = ['cluster', 'chr', 'start', 'end', 'strand', 'dominant_tss', 'tags', 'tags.dominant_tss', 'samples']
+CLUSTER_FIELDS = ['chr', 'strand', 'start', 'end', 'dominant_tss', 'tags', 'tags.dominant_tss']
+
+# Rows read from each input at a time, and consensus clusters written per batch
+CHUNKSIZE = 20_000
+BATCH = 50_000
+
+
+def sample_name(path):
+    name = os.path.basename(path)
+    for suffix in ('.gz', '.bgz'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return os.path.splitext(name)[0]
+
+
+def block_order(paths, chunksize=CHUNKSIZE):
+    """Return the rank of every (chr, strand) block of several cluster tables.
+
+    Each table must hold every block in one contiguous run, but blocks may
+    come in any order, e.g. strand-major as in TSSr tables or in BAM header
+    order. The block sequences of all tables are combined into one order that
+    agrees with each of them (tables may lack some blocks); a table listing
+    two blocks the other way round from another is an error. Only the chr and
+    strand columns are read.
+    """
+    after, first_seen = {}, {}
+    for path in paths:
+        blocks, seen = [], set()
+        for chunk in read_table(path, 'cluster', columns=['chr', 'strand'], chunksize=chunksize):
+            chrom, strand = chunk['chr'].astype(str), chunk['strand'].astype(str)
+            change = (chrom != chrom.shift()) | (strand != strand.shift())
+            for key in zip(chrom[change].tolist(), strand[change].tolist()):
+                if blocks and blocks[-1] == key:
+                    continue
+                if key in seen:
+                    raise click.ClickException(f"{path} is not grouped by chr and strand "
+                                               f"({key[0]}:{key[1]} appears again after {blocks[-1][0]}:{blocks[-1][1]})")
+                blocks.append(key)
+                seen.add(key)
+        for key in blocks:
+            first_seen.setdefault(key, len(first_seen))
+            after.setdefault(key, set())
+        for prev, key in zip(blocks, blocks[1:]):
+            after[prev].add(key)
+
+    # Topological sort, taking blocks in order of first appearance when free to choose
+    pending = {key: 0 for key in after}
+    for successors in after.values():
+        for key in successors:
+            pending[key] += 1
+    ready = [(first_seen[key], key) for key, n in pending.items() if not n]
+    heapq.heapify(ready)
+    ranks = {}
+    while ready:
+        _, key = heapq.heappop(ready)
+        ranks[key] = len(ranks)
+        for successor in after[key]:
+            pending[successor] -= 1
+            if not pending[successor]:
+                heapq.heappush(ready, (first_seen[successor], successor))
+    if len(ranks) < len(after):
+        raise click.ClickException('The cluster tables list their chr/strand blocks in conflicting orders; '
+                                   'sort them the same way, e.g. by chr, strand and start.')
+    return ranks
+
+
+def iter_clusters(path, sample, ranks, chunksize=CHUNKSIZE):
+    """Yield (block, chr, strand, start, end, dominant_tss, tags, tags.dominant_tss, sample) of a cluster table.
+
+    The table is read ``chunksize`` rows at a time. ``ranks`` is the block
+    order of :func:`block_order`, and within each block the clusters must be
+    sorted by start.
+    """
+    last = None
+    for chunk in read_table(path, 'cluster', columns=CLUSTER_FIELDS, chunksize=chunksize):
+        columns = [chunk[col].astype(str) if col in ('chr', 'strand') else chunk[col] for col in CLUSTER_FIELDS]
+        for row in zip(*(col.tolist() for col in columns)):
+            key = (ranks[row[:2]],) + row[:3]
+            if last is not None and key < last:
+                raise click.ClickException(f"{path} is not sorted by start within each chr/strand block "
+                                           f"({':'.join(map(str, key[1:]))} follows {':'.join(map(str, last[1:]))})")
+            last = key
+            yield key + row[3:] + (sample,)
+
+
+def consensus_clusters(streams, n_samples, max_distance=0, min_samples=1):
+    """Merge sorted per-sample cluster streams into consensus clusters.
+
+    ``heapq.merge`` sweeps all streams in (block, start) order, holding
+    one pending cluster per stream. A cluster joins the open consensus cluster
+    when it lies on the same chromosome strand and starts at most
+    ``max_distance`` after its end, otherwise the open cluster is emitted. So
+    memory holds the heap and the open cluster, not the clusters of all
+    samples. Yields (chr, start, end, strand, dominant_tss, tags,
+    tags.dominant_tss, samples, tags of every sample): the dominant TSS is
+    that of the member cluster with the highest dominant signal, and samples
+    is the number of samples with a member. Consensus clusters found in
+    fewer than ``min_samples`` samples are dropped.
+    """
+    def finish(current, counts):
+        found = sum(1 for value in counts if value)
+        if found >= min_samples:
+            return (current[0], current[2], current[3], current[1], current[4], round(sum(counts), 6),
+                    current[5], found, *(round(value, 6) for value in counts))
+
+    current, counts = None, None
+    for _, chrom, strand, start, end, dominant, tags, dominant_tags, sample in heapq.merge(*streams):
+        if current is not None and chrom == current[0] and strand == current[1] and start <= current[3] + max_distance:
+            current[3] = max(current[3], end)
+            if dominant_tags > current[5]:
+                current[4], current[5] = dominant, dominant_tags
+            counts[sample] += tags
+            continue
+        row = finish(current, counts) if current is not None else None
+        if row:
+            yield row
+        current = [chrom, strand, start, end, dominant, dominant_tags]
+        counts = [0.0] * n_samples
+        counts[sample] = tags
+    row = finish(current, counts) if current is not None else None
+    if row:
+        yield row
+
+
+def write_consensus(cluster_files, output, samples=None, max_distance=0, min_samples=1, chunksize=CHUNKSIZE):
+    """Write the consensus cluster table of several cluster tables and return its number of clusters."""
+    samples = list(samples) if samples else [sample_name(path) for path in cluster_files]
+    header = CONSENSUS_COLUMNS + samples
+    ranks = block_order(cluster_files, chunksize)
+    streams = [iter_clusters(path, i, ranks, chunksize) for i, path in enumerate(cluster_files)]
+    handle = open_output(output) if output != '-' else sys.stdout
+    n_clusters = 0
+    try:
+        handle.write('\t'.join(header) + '\n')
+        batch = []
+        for row in consensus_clusters(streams, len(samples), max_distance, min_samples):
+            n_clusters += 1
+            batch.append((n_clusters,) + row)
+            if len(batch) == BATCH:
+                pd.DataFrame(batch, columns=header).to_csv(handle, sep='\t', index=False, header=False)
+                batch = []
+        if batch:
+            pd.DataFrame(batch, columns=header).to_csv(handle, sep='\t', index=False, header=False)
+    finally:
+        if handle is not sys.stdout:
+            handle.close()
+    return n_clusters
+
+
+@click.command()
+@click.argument('cluster_files', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('-o', '--output', default='-', help='Output consensus table (default: stdout).')
+@click.option('-n', '--name', 'samples', multiple=True,
+              help='Sample name of each input, in order (default: file name without extension).')
+@click.option('--max-distance', default=0, show_default=True,
+              help='Merge clusters whose gap is at most this many bases; 0 merges overlapping clusters only.')
+@click.option('--min-samples', default=1, show_default=True, help='Keep consensus clusters found in at least this many samples.')
+@instrumented
+def main(cluster_files, output, samples, max_distance, min_samples):
+    """Merge per-sample TSS cluster tables into consensus clusters with per-sample tags."""
+    if samples and len(samples) != len(cluster_files):
+        raise click.UsageError('Give one --name per input cluster table.')
+    names = list(samples) or [sample_name(path) for path in cluster_files]
+    if len(set(names)) != len(names):
+        raise click.UsageError('Sample names must be distinct; set them with --name.')
+    with stage('consensus') as s:
+        s.bytes_read = input_bytes(cluster_files)
+        s.rows = write_consensus(cluster_files, output, names, max_distance, min_samples)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,330 @@
 # core.py
 
-def get_tss_from_bam(bam_path):
-    # 在这里实现从BAM文件中获取TSS信息的逻辑
-    pass
+import os
+import sys
+import shutil
+import tempfile
+import concurrent.futures
 
-def get_tss_from_table(table_path):
-    # 在这里实现从TSS表中获取TSS信息的逻辑
-    pass
+import numpy as np
+import pandas as pd
+import pysam
 
+from tsstk.store import read_tss_table
+from tsstk.matrix import TSSMatrix
+from tsstk.utils import open_output, stage
+
+# Flags of alignments that never contribute a TSS: unmapped, secondary,
+# QC-failed and supplementary records.
+SKIP_FLAGS = 0x4 | 0x100 | 0x200 | 0x800
+
+# Default shard size when splitting chromosomes across workers.
+DEFAULT_CHUNK_SIZE = 10_000_000
+
+# Number of 5' positions buffered per strand before they are collapsed into counts.
+DEFAULT_BUFFER_SIZE = 1 << 20
+
+# Clustering defaults: largest gap between neighbouring TSS of a cluster, and
+# the TPM a position and a whole cluster need to be kept.
+DEFAULT_MAX_DISTANCE = 20
+DEFAULT_MIN_TPM = 0.1
+DEFAULT_CLUSTER_TPM = 1
+
+CLUSTER_COLUMNS = ['cluster', 'chr', 'start', 'end', 'strand', 'dominant_tss', 'tags', 'tags.dominant_tss']
+
+
+class PositionCounter:
+    """Accumulate integer positions into sorted (position, count) arrays.
+
+    Positions are appended to a fixed-size buffer which is collapsed with
+    ``np.unique`` whenever it fills up, so memory is bounded by the number of
+    distinct positions seen rather than the number of reads.
+    """
+
+    def __init__(self, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.buffer = np.empty(buffer_size, dtype=np.int64)
+        self.size = 0
+        self.positions = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+
+    def add(self, pos):
+        self.buffer[self.size] = pos
+        self.size += 1
+        if self.size == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        if not self.size:
+            return
+        pos, cnt = np.unique(self.buffer[:self.size], return_counts=True)
+        self.size = 0
+        if not len(self.positions):
+            self.positions, self.counts = pos, cnt
+            return
+        self.positions, self.counts = merge_counts(self.positions, self.counts, pos, cnt)
+
+    def result(self):
+        self.flush()
+        return self.positions, self.counts
+
+
+def merge_counts(pos_a, cnt_a, pos_b, cnt_b):
+    # Merge two sorted (position, count) arrays, summing counts of shared positions
+    pos = np.concatenate([pos_a, pos_b])
+    cnt = np.concatenate([cnt_a, cnt_b])
+    if not len(pos):
+        return pos, cnt
+    order = np.argsort(pos, kind='mergesort')
+    pos, cnt = pos[order], cnt[order]
+    starts = np.flatnonzero(np.r_[True, pos[1:] != pos[:-1]])
+    return pos[starts], np.add.reduceat(cnt, starts)
+
+
+def bam_regions(bam_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Split the mapped references of an indexed BAM into (chrom, start, end) shards."""
+    with pysam.AlignmentFile(bam_path, 'rb') as bam:
+        if not bam.has_index():
+            raise ValueError(f"BAM file {bam_path} has no index, run `samtools index` first")
+        lengths = dict(zip(bam.references, bam.lengths))
+        # Use the index statistics to skip contigs without mapped reads
+        mapped = {stat.contig for stat in bam.get_index_statistics() if stat.mapped}
+        regions = []
+        for chrom in bam.references:
+            if chrom not in mapped:
+                continue
+            for start in range(0, lengths[chrom], chunk_size):
+                regions.append((chrom, start, min(start + chunk_size, lengths[chrom])))
+    return regions
+
+
+def count_region_tss(bam_path, chrom, start, end, min_mapq=0, buffer_size=DEFAULT_BUFFER_SIZE):
+    """Count 5' ends of the reads whose alignment starts in [start, end).
+
+    Returns 1-based (positions, counts) arrays for the plus and minus strands.
+    Reads are assigned to the shard containing their leftmost aligned base, so
+    every read is counted exactly once even though ``fetch`` also yields reads
+    overlapping the shard from the left.
+    """
+    plus = PositionCounter(buffer_size)
+    minus = PositionCounter(buffer_size)
+    add_plus, add_minus = plus.add, minus.add
+    with pysam.AlignmentFile(bam_path, 'rb') as bam:
+        for read in bam.fetch(chrom, start, end):
+            flag = read.flag
+            if flag & SKIP_FLAGS:
+                continue
+            # For paired-end libraries only the first mate carries the 5' cap
+            if flag & 0x1 and flag & 0x80:
+                continue
+            if read.mapping_quality < min_mapq:
+                continue
+            read_start = read.reference_start
+            if read_start < start:
+                continue
+            if flag & 0x10:
+                add_minus(read.reference_end)
+            else:
+                add_plus(read_start + 1)
+    return plus.result(), minus.result()
+
+
+def _count_region_task(args):
+    return count_region_tss(*args)
+
+
+def write_tss_counts(handle, chrom, strand, positions, counts):
+    handle.writelines(f"{chrom}\t{pos}\t{strand}\t{cnt}\n" for pos, cnt in zip(positions.tolist(), counts.tolist()))
+
+
+def default_sample_name(bam_path):
+    sample_name = os.path.basename(bam_path)
+    return sample_name[:-4] if sample_name.endswith('.bam') else sample_name
+
+
+def iter_tss_counts(bam_path, processes=None, min_mapq=0, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield (chrom, strand, positions, counts) of an indexed BAM shard by shard.
+
+    The BAM is split into shards with the index and counted in a process pool
+    (in-process when ``processes`` is 1). Both strands come out in coordinate
+    order; minus-strand 5' ends of reads crossing a shard boundary fall into the
+    next shard, so they are carried over until that shard is merged.
+    """
+    regions = bam_regions(bam_path, chunk_size)
+    tasks = [(bam_path, chrom, start, end, min_mapq) for chrom, start, end in regions]
+    carry_chrom = None
+    carry = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+    if processes == 1:
+        results = map(_count_region_task, tasks)
+        executor = None
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=processes)
+        # map() yields results in shard order, so output stays sorted
+        results = executor.map(_count_region_task, tasks)
+    try:
+        for (chrom, _, end), (plus, minus) in zip(regions, results):
+            yield chrom, '+', plus[0], plus[1]
+            if chrom != carry_chrom:
+                if carry_chrom is not None:
+                    yield carry_chrom, '-', carry[0], carry[1]
+                carry_chrom = chrom
+            else:
+                minus = merge_counts(*carry, *minus)
+            split = np.searchsorted(minus[0], end, side='right')
+            yield chrom, '-', minus[0][:split], minus[1][:split]
+            carry = (minus[0][split:], minus[1][split:])
+        if carry_chrom is not None:
+            yield carry_chrom, '-', carry[0], carry[1]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def get_tss_from_bam(bam_path, output_file=None, processes=None, min_mapq=0,
+                     chunk_size=DEFAULT_CHUNK_SIZE, sample_name=None):
+    """Count TSS (read 5' ends) in an indexed BAM and write a TSSr-style raw table.
+
+    Rows are streamed out as shards finish: plus-strand rows go straight to the
+    output while minus-strand rows are spooled to a temporary file and appended
+    at the end, giving the TSSr ordering (strand, chr, pos).
+    """
+    if sample_name is None:
+        sample_name = default_sample_name(bam_path)
+
+    out = open_output(output_file) if output_file and output_file != '-' else sys.stdout
+    try:
+        out.write(f"chr\tpos\tstrand\t{sample_name}\n")
+        with tempfile.TemporaryFile('w+') as minus_spool:
+            with stage('count') as s:
+                for chrom, strand, positions, counts in iter_tss_counts(bam_path, processes, min_mapq, chunk_size):
+                    write_tss_counts(out if strand == '+' else minus_spool, chrom, strand, positions, counts)
+                    s.rows += len(positions)
+            with stage('write'):
+                minus_spool.seek(0)
+                shutil.copyfileobj(minus_spool, out)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def tss_frame_from_bam(bam_path, processes=None, min_mapq=0, chunk_size=DEFAULT_CHUNK_SIZE, sample_name=None):
+    """Count the TSS of an indexed BAM into a TSSr-ordered (strand, chr, pos) DataFrame."""
+    if sample_name is None:
+        sample_name = default_sample_name(bam_path)
+    parts = {'+': [], '-': []}
+    for chrom, strand, positions, counts in iter_tss_counts(bam_path, processes, min_mapq, chunk_size):
+        if len(positions):
+            parts[strand].append((chrom, strand, positions, counts))
+    parts = parts['+'] + parts['-']
+    lengths = [len(positions) for _, _, positions, _ in parts]
+    empty = np.empty(0, dtype=np.int64)
+    return pd.DataFrame({
+        'chr': np.repeat(np.array([chrom for chrom, _, _, _ in parts], dtype=object), lengths),
+        'pos': np.concatenate([positions for _, _, positions, _ in parts] or [empty]),
+        'strand': np.repeat(np.array([strand for _, strand, _, _ in parts], dtype=object), lengths),
+        sample_name: np.concatenate([counts for _, _, _, counts in parts] or [empty]),
+    })
+
+
+def segment_clusters(pos, signal, max_distance):
+    """Split sorted positions into clusters wherever the gap exceeds ``max_distance``.
+
+    Returns the cluster start, end and dominant (highest-signal, leftmost on
+    ties) positions together with the total and dominant signal of every
+    cluster, computed with a single sweep of reduceat calls.
+    """
+    new_cluster = np.r_[True, np.diff(pos) > max_distance]
+    starts = np.flatnonzero(new_cluster)
+    ends = np.r_[starts[1:], len(pos)] - 1
+    total = np.add.reduceat(signal, starts)
+    peak = np.maximum.reduceat(signal, starts)
+    segment = np.cumsum(new_cluster) - 1
+    at_peak = np.flatnonzero(signal == peak[segment])
+    _, first = np.unique(segment[at_peak], return_index=True)
+    dominant = at_peak[first]
+    return pos[starts], pos[ends], pos[dominant], total, signal[dominant]
+
+
+def cluster_strand(chrom, strand, pos, counts, tpm, max_distance=DEFAULT_MAX_DISTANCE, min_tpm=DEFAULT_MIN_TPM,
+                   min_count=0, cluster_tpm=DEFAULT_CLUSTER_TPM):
+    """Cluster the TSS of one chromosome strand and return the cluster table rows."""
+    keep = (tpm >= min_tpm) & (counts >= min_count)
+    pos, tpm = pos[keep], tpm[keep]
+    if not len(pos):
+        return pd.DataFrame(columns=CLUSTER_COLUMNS[1:])
+    order = np.argsort(pos, kind='stable')
+    start, end, dominant, tags, dominant_tags = segment_clusters(pos[order], tpm[order], max_distance)
+    passed = tags >= cluster_tpm
+    return pd.DataFrame({
+        'chr': chrom,
+        'start': start[passed],
+        'end': end[passed],
+        'strand': strand,
+        'dominant_tss': dominant[passed],
+        'tags': tags[passed].round(6),
+        'tags.dominant_tss': dominant_tags[passed].round(6),
+    })
+
+
+def _cluster_strand_task(args):
+    return cluster_strand(*args)
+
+
+def cluster_tss_table(df, samples=None, max_distance=DEFAULT_MAX_DISTANCE, min_tpm=DEFAULT_MIN_TPM, min_count=0,
+                      cluster_tpm=DEFAULT_CLUSTER_TPM, processes=1):
+    """Cluster a TSS table into a TSSr-style cluster table.
+
+    The signal is the sum of the ``samples`` columns (all sample columns by
+    default), normalized to TPM over the whole table. Positions below
+    ``min_tpm`` or ``min_count`` are dropped, the remaining ones are grouped
+    into clusters whose neighbouring TSS are at most ``max_distance`` apart,
+    and clusters with fewer than ``cluster_tpm`` TPM in total are discarded.
+    Chromosome strands are clustered in parallel when ``processes`` > 1 and
+    clusters are numbered in (chr, strand, start) order whatever the row order
+    of the input. ``df`` may also be a sparse TSSMatrix.
+    """
+    if isinstance(df, TSSMatrix):
+        counts = df.row_sums(samples)
+        pos = df.pos.astype(np.int64)
+        groups = {(chrom, strand): np.arange(start, stop) for chrom, strand, start, stop in df.blocks()}
+    else:
+        if samples is None:
+            samples = [c for c in df.columns if c not in ('chr', 'pos', 'strand')]
+        counts = df[list(samples)].sum(axis=1).to_numpy(np.int64)
+        pos = df['pos'].to_numpy(np.int64)
+        groups = df.groupby(['chr', 'strand'], sort=False, observed=True).indices
+    tpm = counts / max(counts.sum(), 1) * 1e6
+    # Both inputs give their groups in (chr, strand) order, so cluster IDs do not depend on the input layout
+    groups = dict(sorted(groups.items(), key=lambda item: (str(item[0][0]), str(item[0][1]))))
+
+    tasks = [(chrom, strand, pos[idx], counts[idx], tpm[idx], max_distance, min_tpm, min_count, cluster_tpm)
+             for (chrom, strand), idx in groups.items()]
+    if processes == 1:
+        parts = [_cluster_strand_task(task) for task in tasks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+            parts = list(executor.map(_cluster_strand_task, tasks, chunksize=max(1, len(tasks) // 64)))
+
+    parts = [part for part in parts if len(part)]
+    if not parts:
+        return pd.DataFrame(columns=CLUSTER_COLUMNS)
+    clusters = pd.concat(parts, ignore_index=True)
+    clusters.insert(0, 'cluster', np.arange(1, len(clusters) + 1))
+    return clusters
+
+
+def get_tss_from_table(table_path, output_file=None, samples=None, max_distance=DEFAULT_MAX_DISTANCE,
+                       min_tpm=DEFAULT_MIN_TPM, min_count=0, cluster_tpm=DEFAULT_CLUSTER_TPM, processes=None):
+    """Cluster the TSS of a table (TSV or TSS store) and write the cluster table."""
+    with stage('read') as s:
+        df = read_tss_table(table_path)
+        s.rows = len(df)
+    with stage('cluster') as s:
+        clusters = cluster_tss_table(df, samples, max_distance, min_tpm, min_count, cluster_tpm, processes)
+        s.rows = len(df)
+    with stage('write') as s:
+        if output_file and output_file != '-':
+            with open_output(output_file) as handle:
+                clusters.to_csv(handle, sep='\t', index=False)
+        else:
+            clusters.to_csv(sys.stdout, sep='\t', index=False)
+        s.rows = len(clusters)
@@ -1,84 +1,265 @@
 #!/usr/bin/env python
 
-VERSION = "0.1.0"
+VERSION = "0.2.0"
 
 import click
+import numpy as np
 import pandas as pd
 import os
+import concurrent.futures
+
+from tsstk.utils import input_bytes, instrumented, open_output, read_csv, stage
+
+# Intron lengths below this limit are counted exactly; longer ones fall into
+# log-spaced bins LOG_STEP wide (relative), so quantiles stay within 0.5%.
+EXACT_LIMIT = 100_000
+LOG_STEP = 0.005
+
+DEFAULT_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+CHUNKSIZE = 500_000
+
+
+class LengthHistogram:
+    """Mergeable summary of intron lengths: running moments plus a fixed-bin histogram."""
+
+    def __init__(self):
+        self.exact = np.zeros(EXACT_LIMIT, dtype=np.int64)
+        self.log_bins = {}
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, lengths):
+        lengths = np.asarray(lengths, dtype=np.int64)
+        if not len(lengths):
+            return
+        self.count += len(lengths)
+        self.total += float(lengths.sum())
+        self.total_sq += float(np.square(lengths, dtype=np.float64).sum())
+        low, high = lengths.min(), lengths.max()
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+        small = lengths[lengths < EXACT_LIMIT]
+        self.exact += np.bincount(small, minlength=EXACT_LIMIT)
+        large = lengths[lengths >= EXACT_LIMIT]
+        if len(large):
+            bins, counts = np.unique(np.floor(np.log(large / EXACT_LIMIT) / np.log1p(LOG_STEP)).astype(np.int64),
+                                     return_counts=True)
+            for b, c in zip(bins.tolist(), counts.tolist()):
+                self.log_bins[b] = self.log_bins.get(b, 0) + c
+
+    def merge(self, other):
+        if not other.count:
+            return self
+        self.exact += other.exact
+        for b, c in other.log_bins.items():
+            self.log_bins[b] = self.log_bins.get(b, 0) + c
+        self.count += other.count
+        self.total += other.total
+        self.total_sq += other.total_sq
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    def bins(self):
+        """Return (value, count) arrays of the non-empty bins, in increasing value order."""
+        values = np.flatnonzero(self.exact).astype(np.float64)
+        counts = self.exact[values.astype(np.int64)]
+        if self.log_bins:
+            log_bins = np.array(sorted(self.log_bins))
+            centers = EXACT_LIMIT * np.power(1 + LOG_STEP, log_bins + 0.5)
+            values = np.concatenate([values, np.clip(centers, self.min, self.max)])
+            counts = np.concatenate([counts, [self.log_bins[b] for b in log_bins.tolist()]])
+        return values, counts
+
+    def quantile(self, q):
+        # Linear interpolation between order statistics, like numpy and R type 7
+        if not self.count:
+            return np.nan
+        values, counts = self.bins()
+        cumulative = np.cumsum(counts)
+        rank = q * (self.count - 1)
+        lower, upper = int(np.floor(rank)), int(np.ceil(rank))
+        v_lower = values[np.searchsorted(cumulative, lower, side='right')]
+        v_upper = values[np.searchsorted(cumulative, upper, side='right')]
+        return v_lower + (rank - lower) * (v_upper - v_lower)
+
+    def statistics(self, quantiles=DEFAULT_QUANTILES):
+        if not self.count:
+            return {'count': 0}
+        mean = self.total / self.count
+        variance = (self.total_sq - self.count * mean * mean) / (self.count - 1) if self.count > 1 else np.nan
+        stats = {
+            'max_length': self.max,
+            'min_length': self.min,
+            'mean_length': mean,
+            'median_length': self.quantile(0.5),
+            'std_dev_length': np.sqrt(max(variance, 0)) if self.count > 1 else np.nan,
+            'count': self.count,
+        }
+        for q in quantiles:
+            stats[f"p{q * 100:g}"] = self.quantile(q)
+        return stats
+
+    def distribution(self):
+        values, counts = self.bins()
+        return pd.Series(counts, index=values.astype(np.int64), name='count').rename_axis('intron_length')
+
+
+def extract_exons(chunk):
+    """Keep exon rows of a GTF/GFF3 chunk with the transcript they belong to.
+
+    Transcripts come from ``transcript_id "..."`` (GTF) or ``Parent=`` (GFF3);
+    an exon with several GFF3 parents is counted once for each of them.
+    """
+    exons = chunk[chunk['feature'] == 'exon']
+    transcript = exons['attribute'].str.extract(r'transcript_id "([^"]+)"', expand=False)
+    missing = transcript.isna()
+    if missing.any():
+        transcript[missing] = exons.loc[missing, 'attribute'].str.extract(r'(?:^|;)\s*Parent=([^;]+)', expand=False)
+    exons = exons[['seqname', 'start', 'end']].assign(transcript_id=transcript.str.split(','))
+    exons = exons.explode('transcript_id')
+    return exons[exons['transcript_id'].notna()]
+
+
+def chromosome_introns(exons):
+    # Sort by transcript ID and start position
+    exons = exons.sort_values(by=['transcript_id', 'start'])
 
-def parse_gtf(gtf_file):
-    # Load the GTF file into a DataFrame, considering only the necessary columns
-    col_names = ["seqname", "source", "feature", "start", "end", "score", "strand", "frame", "attribute"]
-    df = pd.read_csv(gtf_file, sep='\t', comment='#', names=col_names)
-    
-    # Filter for exons
-    exons = df[df['feature'] == 'exon'].copy()
-    
-    # Extract transcript ID from the attributes column
-    exons.loc[:, 'transcript_id'] = exons['attribute'].str.extract('transcript_id "([^"]+)"')
-    
-    # Sort by sequence name, transcript ID, and start position
-    exons = exons.sort_values(by=['seqname', 'transcript_id', 'start'])
-    
     # Calculate intron start and end positions
-    exons['intron_start'] = exons['end'].shift(1) + 1
-    exons['intron_end'] = exons['start'] - 1
-    
+    intron_start = exons['end'].shift(1) + 1
+    intron_end = exons['start'] - 1
+
     # Find introns within the same transcript
-    exons['same_transcript'] = exons['transcript_id'].eq(exons['transcript_id'].shift(1))
-    
-    # Filter rows that are introns
-    introns = exons[exons['same_transcript']].copy()
-    
-    # Calculate intron length
-    introns.loc[:, 'intron_length'] = introns['intron_end'] - introns['intron_start'] + 1
-    
-    return introns[['seqname', 'intron_start', 'intron_end', 'intron_length']]
-
-def calculate_statistics(introns):
+    same_transcript = exons['transcript_id'].eq(exons['transcript_id'].shift(1))
+
+    introns = pd.DataFrame({
+        'seqname': exons['seqname'],
+        'intron_start': intron_start,
+        'intron_end': intron_end,
+    })[same_transcript]
+    introns['intron_start'] = introns['intron_start'].astype(np.int64)
+
+    # Calculate intron length; overlapping exons leave no intron
+    introns['intron_length'] = introns['intron_end'] - introns['intron_start'] + 1
+    return introns[introns['intron_length'] > 0]
+
+
+def iter_introns(gtf_file, chunksize=CHUNKSIZE):
+    """Yield introns of a GTF/GFF3 file one chromosome at a time.
+
+    The file is read in chunks and only the exons of the chromosome currently
+    being read are held in memory, so the file must be grouped by chromosome,
+    as GTF and GFF3 files normally are. A chromosome that comes back after
+    another one has been read is an error.
+    """
+    col_names = ["seqname", "source", "feature", "start", "end", "score", "strand", "frame", "attribute"]
+    reader = read_csv(gtf_file, sep='\t', comment='#', names=col_names, usecols=[0, 2, 3, 4, 8],
+                         dtype={'seqname': str, 'feature': str, 'attribute': str}, chunksize=chunksize)
+    pending, current = [], None
+    seen = set()
+    for chunk in reader:
+        exons = extract_exons(chunk)
+        if not len(exons):
+            continue
+        # Chromosome of every run of rows, continuing the run of the previous chunk
+        chroms = exons['seqname']
+        for chrom in chroms[chroms != chroms.shift(fill_value=current or '')].tolist():
+            if chrom in seen:
+                raise click.ClickException(f"{gtf_file} is not grouped by chromosome: {chrom} appears again after "
+                                           f"other chromosomes; sort it by chromosome first, e.g. with "
+                                           f"`sort -k1,1 -k4,4n`")
+            seen.add(chrom)
+        last = chroms.iat[-1]
+        done = chroms != last
+        if done.any() or (current is not None and current != last):
+            for _, chrom_exons in pd.concat(pending + [exons[done]]).groupby('seqname', sort=False):
+                yield chromosome_introns(chrom_exons)
+            pending = []
+        pending.append(exons[~done])
+        current = last
+    if pending:
+        yield chromosome_introns(pd.concat(pending))
+
+
+def parse_gtf(gtf_file):
+    # Kept for callers that want every intron at once
+    parts = list(iter_introns(gtf_file))
+    if not parts:
+        return pd.DataFrame(columns=['seqname', 'intron_start', 'intron_end', 'intron_length'])
+    return pd.concat(parts, ignore_index=True)
+
+
+def calculate_statistics(introns, quantiles=DEFAULT_QUANTILES):
     # Calculate statistics for intron lengths
-    stats = {
-        'max_length': introns['intron_length'].max(),
-        'min_length': introns['intron_length'].min(),
-        'mean_length': introns['intron_length'].mean(),
-        'median_length': introns['intron_length'].median(),
-        'std_dev_length': introns['intron_length'].std(),
-        'count': introns['intron_length'].count()
-    }
-    return stats
+    histogram = LengthHistogram()
+    histogram.add(introns['intron_length'].to_numpy())
+    return histogram.statistics(quantiles)
+
+
+def summarize_file(gtf_file, output_file=None):
+    """Stream one annotation file, optionally writing intron details, and return its histogram."""
+    histogram = LengthHistogram()
+    handle = open_output(output_file) if output_file else None
+    try:
+        header = True
+        for introns in iter_introns(gtf_file):
+            histogram.add(introns['intron_length'].to_numpy())
+            if handle:
+                introns.to_csv(handle, sep='\t', index=False, header=header)
+                header = False
+        if handle and header:
+            handle.write("seqname\tintron_start\tintron_end\tintron_length\n")
+    finally:
+        if handle:
+            handle.close()
+    return histogram
 
-@click.command()
-@click.option('-i', '--input', 'input_file', required=True, type=click.Path(exists=True), help='Path to the input GTF file')
-@click.option('-o', '--output', 'output_prefix', required=False, type=str, help='Prefix for the output file (optional)')
-@click.version_option(version=VERSION, prog_name="Intron Length Analyzer")
 
-def main(input_file, output_prefix):
-    # Determine output file name
-    if output_prefix:
-        output_file = f"{output_prefix}.intron_len.txt"
-    else:
-        base_name = os.path.splitext(os.path.basename(input_file))[0]
-        output_file = f"{base_name}.intron_len.txt"
-
-    # Parse GTF and get introns
-    introns = parse_gtf(input_file)
-    
-    # Calculate statistics
-    stats = calculate_statistics(introns)
-
-    # Print statistics
-    print("Intron Length Statistics:")
+def output_name(input_file, output_prefix, several):
+    base_name = os.path.splitext(os.path.basename(input_file))[0]
+    if output_prefix and several:
+        return f"{output_prefix}.{base_name}.intron_len.txt"
+    return f"{output_prefix or base_name}.intron_len.txt"
+
+
+def print_statistics(title, stats, histogram):
+    print(f"{title}:")
     for stat, value in stats.items():
         print(f"{stat}: {value}")
-    
-    # Save intron details to a file
-    introns.to_csv(output_file, sep='\t', index=False)
-
     # Print the intron lengths distribution
-    length_distribution = introns['intron_length'].value_counts().sort_index()
     print("\nIntron Length Distribution:")
-    print(length_distribution)
+    print(histogram.distribution())
+
+
+@click.command()
+@click.option('-i', '--input', 'input_files', required=True, multiple=True, type=click.Path(exists=True), help='Path to an input GTF or GFF3 file (repeat for several)')
+@click.option('-o', '--output', 'output_prefix', required=False, type=str, help='Prefix for the output file (optional)')
+@click.option('-q', '--quantile', 'quantiles', multiple=True, type=click.FloatRange(0, 1), default=DEFAULT_QUANTILES, show_default=True, help='Quantile to report (repeat for several)')
+@click.option('-p', '--processes', type=int, default=None, help='Number of files processed in parallel')
+@click.version_option(version=VERSION, prog_name="Intron Length Analyzer")
+@instrumented
+def main(input_files, output_prefix, quantiles, processes):
+    several = len(input_files) > 1
+    outputs = [output_name(f, output_prefix, several) for f in input_files]
+
+    # Parse every annotation in its own process and merge the summaries
+    with stage('parse') as s, concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        histograms = list(executor.map(summarize_file, input_files, outputs))
+        s.rows = sum(h.count for h in histograms)
+        s.bytes_read = input_bytes(input_files)
+
+    for input_file, histogram in zip(input_files, histograms):
+        print_statistics(f"Intron Length Statistics ({input_file})" if several else "Intron Length Statistics",
+                         histogram.statistics(quantiles), histogram)
+
+    if several:
+        combined = LengthHistogram()
+        for histogram in histograms:
+            combined.merge(histogram)
+        print_statistics("Intron Length Statistics (all files)", combined.statistics(quantiles), combined)
 
 if __name__ == "__main__":
     main()
-
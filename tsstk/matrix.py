@@ -0,0 +1,367 @@
+# matrix.py
+
+"""
+Sparse multi-sample TSS count matrix.
+
+A TSSMatrix holds the rows of a TSSr-style table in (strand, chr, pos) order
+as a compact coordinate index (chromosome codes into sorted categories, int8
+strand codes with 0 for '+' and 1 for '-', int32 positions) and the counts as
+a compressed sparse column matrix with one column per sample:
+
+    indptr    sample j owns entries indptr[j]:indptr[j + 1]
+    indices   row of every stored entry, increasing within a sample
+    data      count (or normalized value) of every stored entry
+
+Zeros are never stored, so a 100-sample set where most positions are seen in
+a few samples takes a fraction of the memory of the zero-filled wide table.
+"""
+
+import numpy as np
+import pandas as pd
+
+from tsstk.store import TSSStore, is_store
+from tsstk.utils import open_output, read_table
+
+KEYS = ['chr', 'pos', 'strand']
+STRANDS = np.array(['+', '-'], dtype=object)
+
+
+def _count_dtype(values):
+    if np.issubdtype(values.dtype, np.floating):
+        return np.float64
+    return np.int32 if not len(values) or values.max() <= np.iinfo(np.int32).max else np.int64
+
+
+def _segment_sums(values, indptr):
+    # Sum of values[indptr[j]:indptr[j + 1]] for every j, empty segments included
+    cumulative = np.r_[0, np.cumsum(values)]
+    return cumulative[indptr[1:]] - cumulative[indptr[:-1]]
+
+
+class TSSMatrix:
+    """Sparse (positions x samples) TSS count matrix in TSSr row order."""
+
+    def __init__(self, categories, chr_codes, strand, pos, samples, indptr, indices, data):
+        self.categories = list(categories)
+        self.chr_codes = chr_codes
+        self.strand = strand
+        self.pos = pos
+        self.samples = list(samples)
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+
+    # -- construction ------------------------------------------------------
+
+    @classmethod
+    def from_entries(cls, chrom, strand, pos, sample, counts, samples):
+        """Build a matrix from one (chr, strand, pos, sample index, count) entry per value.
+
+        Entries may come in any order; entries of the same position and sample
+        are summed and zero sums are dropped.
+        """
+        chrom = pd.Categorical(chrom)
+        categories = sorted(chrom.categories.astype(str))
+        codes = pd.Categorical(chrom.astype(str), categories=categories).codes
+        strand = (np.asarray(strand) == '-').astype(np.int8)
+        return cls._build(categories, codes, strand, np.asarray(pos), np.asarray(sample), np.asarray(counts), samples)
+
+    @classmethod
+    def _build(cls, categories, chr_codes, strand, pos, sample, counts, samples):
+        n_samples = max(len(samples), 1)
+        chr_codes = np.asarray(chr_codes, dtype=np.int64)
+        # One sortable integer per position: strand, then chromosome, then position
+        key = ((strand.astype(np.int64) * max(len(categories), 1) + chr_codes) << 32) | pos.astype(np.int64)
+        row_keys, row = np.unique(key, return_inverse=True)
+        entry = row.astype(np.int64) * n_samples + sample
+        entry_keys, inverse = np.unique(entry, return_inverse=True)
+        dtype = _count_dtype(counts)
+        if dtype == np.float64:
+            values = np.bincount(inverse, weights=counts, minlength=len(entry_keys))
+        else:
+            values = np.zeros(len(entry_keys), dtype=np.int64)
+            np.add.at(values, inverse, counts)
+            dtype = _count_dtype(values)
+        keep = values != 0
+        entry_keys, values = entry_keys[keep], values[keep]
+        rows, cols = entry_keys // n_samples, entry_keys % n_samples
+
+        # Drop positions whose counts all cancelled out
+        used = np.zeros(len(row_keys), dtype=bool)
+        used[rows] = True
+        if not used.all():
+            rows = (np.cumsum(used) - 1)[rows]
+            row_keys = row_keys[used]
+
+        order = np.lexsort((rows, cols))
+        indptr = np.zeros(len(samples) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cols, minlength=len(samples)), out=indptr[1:])
+        stacked = row_keys >> 32
+        n_chr = max(len(categories), 1)
+        return cls(
+            categories,
+            (stacked % n_chr).astype(np.int16 if n_chr < 2 ** 15 else np.int32),
+            (stacked // n_chr).astype(np.int8),
+            (row_keys & 0xFFFFFFFF).astype(np.int32),
+            samples,
+            indptr,
+            rows[order].astype(np.int32 if len(row_keys) < 2 ** 31 else np.int64),
+            values[order].astype(dtype),
+        )
+
+    @classmethod
+    def from_frames(cls, frames, samples=None):
+        """Build a matrix from wide TSS table chunks, keeping only their non-zero counts.
+
+        Chromosomes are turned into integer codes chunk by chunk, so only the
+        compact entries of the non-zero counts are held until the matrix is built.
+        """
+        names = list(samples) if samples else []
+        chrom_ids, parts = {}, []
+        for df in frames:
+            columns = [c for c in df.columns if c not in KEYS]
+            names += [c for c in columns if c not in names]
+            values = df[columns].fillna(0).to_numpy()
+            row, col = np.nonzero(values)
+            codes, uniques = pd.factorize(df['chr'].astype(str).to_numpy()[row])
+            ids = np.array([chrom_ids.setdefault(c, len(chrom_ids)) for c in uniques], dtype=np.int32)
+            sample_index = np.array([names.index(c) for c in columns], dtype=np.int32)
+            parts.append((ids[codes] if len(codes) else codes.astype(np.int32),
+                          (df['strand'].to_numpy()[row] == '-').astype(np.int8),
+                          df['pos'].to_numpy()[row].astype(np.int64), sample_index[col], values[row, col]))
+        if not parts:
+            return cls._build([], *(np.empty(0, dtype=np.int64) for _ in range(5)), names)
+        codes, strand, pos, sample, counts = (np.concatenate(p) for p in zip(*parts))
+        if np.issubdtype(counts.dtype, np.floating) and np.array_equal(counts, np.round(counts)):
+            counts = counts.astype(np.int64)  # zero-filled integer columns come back as floats
+        categories = sorted(chrom_ids)
+        rank = np.array([categories.index(c) for c in chrom_ids], dtype=np.int64)
+        return cls._build(categories, rank[codes] if len(codes) else codes, strand, pos, sample, counts, names)
+
+    @classmethod
+    def from_frame(cls, df):
+        return cls.from_frames([df])
+
+    @classmethod
+    def read(cls, path, chunksize=500_000):
+        """Read a TSS table (TSV or TSS store) chunk by chunk into a sparse matrix."""
+        if is_store(path):
+            return cls.from_frames(TSSStore(path).iter_frames(chunksize))
+        return cls.from_frames(read_table(path, 'tss', chunksize=chunksize))
+
+    @classmethod
+    def from_tables(cls, paths, renames=None, chunksize=500_000):
+        """Combine several TSS tables, summing sample columns that share a (renamed) name."""
+        def frames():
+            for i, path in enumerate(paths):
+                chunks = TSSStore(path).iter_frames(chunksize) if is_store(path) else read_table(path, 'tss', chunksize=chunksize)
+                for chunk in chunks:
+                    chunk = chunk[(chunk['chr'] != '0') | (chunk['pos'] != 0)]  # remove incorrect line if any
+                    yield chunk.rename(columns=renames[i]) if renames else chunk
+        return cls.from_frames(frames())
+
+    # -- shape and index ---------------------------------------------------
+
+    @property
+    def n_rows(self):
+        return len(self.pos)
+
+    @property
+    def n_samples(self):
+        return len(self.samples)
+
+    @property
+    def shape(self):
+        return self.n_rows, self.n_samples
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    def __len__(self):
+        return self.n_rows
+
+    def __repr__(self):
+        return f"<TSSMatrix {self.n_rows} positions x {self.n_samples} samples, {self.nnz} non-zero>"
+
+    def memory_usage(self):
+        """Bytes held by the index and the sparse counts."""
+        return sum(a.nbytes for a in (self.chr_codes, self.strand, self.pos, self.indptr, self.indices, self.data))
+
+    @property
+    def chr(self):
+        return pd.Categorical.from_codes(self.chr_codes, categories=self.categories)
+
+    def sample_of_entries(self):
+        return np.repeat(np.arange(self.n_samples), np.diff(self.indptr))
+
+    def blocks(self):
+        """Yield (chr, strand, start, stop) row ranges of every chromosome strand."""
+        if not self.n_rows:
+            return
+        change = np.flatnonzero((np.diff(self.chr_codes) != 0) | (np.diff(self.strand) != 0)) + 1
+        starts = np.r_[0, change]
+        stops = np.r_[change, self.n_rows]
+        for start, stop in zip(starts.tolist(), stops.tolist()):
+            yield self.categories[self.chr_codes[start]], STRANDS[self.strand[start]], start, stop
+
+    def _sample_index(self, samples):
+        if samples is None:
+            return np.arange(self.n_samples)
+        missing = [s for s in samples if s not in self.samples]
+        if missing:
+            raise KeyError(f"unknown sample(s): {', '.join(map(str, missing))}")
+        return np.array([self.samples.index(s) for s in samples], dtype=np.int64)
+
+    # -- summaries ---------------------------------------------------------
+
+    def sample_totals(self):
+        """Total count (or value) of every sample."""
+        return pd.Series(_segment_sums(self.data, self.indptr), index=self.samples)
+
+    def row_sums(self, samples=None):
+        """Sum of every position over ``samples`` (all by default)."""
+        entries = self._entries_of(samples)
+        sums = np.bincount(self.indices[entries], weights=self.data[entries], minlength=self.n_rows)
+        return sums if self.data.dtype == np.float64 else sums.astype(np.int64)
+
+    def _entries_of(self, samples):
+        if samples is None:
+            return slice(None)
+        columns = self._sample_index(samples)
+        return np.concatenate([np.arange(self.indptr[j], self.indptr[j + 1]) for j in columns] or
+                              [np.empty(0, dtype=np.int64)])
+
+    def samples_detected(self, min_value=1, samples=None):
+        """Number of ``samples`` (all by default) in which every position reaches ``min_value``."""
+        entries = self._entries_of(samples)
+        return np.bincount(self.indices[entries][self.data[entries] >= min_value], minlength=self.n_rows)
+
+    # -- transformations ---------------------------------------------------
+
+    def _replace(self, **arrays):
+        fields = dict(categories=self.categories, chr_codes=self.chr_codes, strand=self.strand, pos=self.pos,
+                      samples=self.samples, indptr=self.indptr, indices=self.indices, data=self.data)
+        fields.update(arrays)
+        return TSSMatrix(**fields)
+
+    def cpm(self):
+        """Counts per million of every sample's total."""
+        totals = self.sample_totals().to_numpy().astype(np.float64)
+        scale = np.divide(1e6, totals, out=np.zeros_like(totals), where=totals > 0)
+        return self._replace(data=self.data * scale[self.sample_of_entries()])
+
+    def tpm(self):
+        """Tags per million; TSS tags carry no length, so this equals ``cpm()``."""
+        return self.cpm()
+
+    def filter_values(self, min_value):
+        """Drop the individual counts below ``min_value`` (per-sample filtering)."""
+        keep = self.data >= min_value
+        indptr = np.r_[0, np.cumsum(_segment_sums(keep, self.indptr))].astype(np.int64)
+        return self._replace(indptr=indptr, indices=self.indices[keep], data=self.data[keep])._drop_empty_rows()
+
+    def filter_rows(self, min_total=0, min_samples=0, min_value=1, samples=None):
+        """Keep positions whose sum over ``samples`` reaches ``min_total`` and that reach
+        ``min_value`` in at least ``min_samples`` samples (across-sample filtering)."""
+        keep = self.row_sums(samples) >= min_total
+        if min_samples:
+            keep &= self.samples_detected(min_value, samples) >= min_samples
+        return self.take_rows(keep)
+
+    def take_rows(self, mask):
+        """Keep the positions selected by a boolean mask."""
+        mask = np.asarray(mask, dtype=bool)
+        new_row = np.cumsum(mask) - 1
+        keep = mask[self.indices]
+        return self._replace(chr_codes=self.chr_codes[mask], strand=self.strand[mask], pos=self.pos[mask],
+                             indptr=np.r_[0, np.cumsum(_segment_sums(keep, self.indptr))].astype(np.int64),
+                             indices=new_row[self.indices[keep]].astype(self.indices.dtype), data=self.data[keep])
+
+    def _drop_empty_rows(self):
+        used = np.zeros(self.n_rows, dtype=bool)
+        used[self.indices] = True
+        return self if used.all() else self.take_rows(used)
+
+    def subset(self, samples, drop_empty=True):
+        """Keep the given samples, in that order; positions left without counts are dropped."""
+        columns = self._sample_index(samples)
+        lengths = np.diff(self.indptr)[columns]
+        entries = self._entries_of(samples)
+        result = self._replace(samples=[self.samples[j] for j in columns],
+                               indptr=np.r_[0, np.cumsum(lengths)].astype(np.int64),
+                               indices=self.indices[entries], data=self.data[entries])
+        return result._drop_empty_rows() if drop_empty else result
+
+    def filter_samples(self, min_total):
+        """Keep the samples whose total reaches ``min_total``."""
+        totals = self.sample_totals()
+        return self.subset(list(totals.index[totals.to_numpy() >= min_total]))
+
+    def entries(self):
+        """Return (chr names, strand, pos, sample index, value) of every stored value."""
+        rows = self.indices
+        return (np.asarray(self.categories, dtype=object)[self.chr_codes[rows]], STRANDS[self.strand[rows]],
+                self.pos[rows], self.sample_of_entries(), self.data)
+
+    def merge(self, other):
+        """Union of two matrices; samples with the same name are summed, like ``combine``."""
+        samples = self.samples + [s for s in other.samples if s not in self.samples]
+        categories = sorted(set(self.categories) | set(other.categories))
+        parts = []
+        for m in (self, other):
+            remap_chr = np.array([categories.index(c) for c in m.categories], dtype=np.int64)
+            remap_sample = np.array([samples.index(s) for s in m.samples], dtype=np.int64)
+            rows = m.indices
+            parts.append((remap_chr[m.chr_codes[rows]] if len(rows) else rows, m.strand[rows], m.pos[rows],
+                          remap_sample[m.sample_of_entries()] if len(rows) else rows, m.data))
+        codes, strand, pos, sample, data = (np.concatenate(p) for p in zip(*parts))
+        return TSSMatrix._build(categories, codes, strand, pos, sample, data, samples)
+
+    # -- export ------------------------------------------------------------
+
+    def dense(self, start=0, stop=None, samples=None):
+        """Return rows [start, stop) of ``samples`` as a dense (rows x samples) array."""
+        stop = self.n_rows if stop is None else stop
+        columns = self._sample_index(samples)
+        out = np.zeros((stop - start, len(columns)), dtype=self.data.dtype)
+        for k, j in enumerate(columns):
+            rows = self.indices[self.indptr[j]:self.indptr[j + 1]]
+            first, last = np.searchsorted(rows, [start, stop])
+            out[rows[first:last] - start, k] = self.data[self.indptr[j] + first:self.indptr[j] + last]
+        return out
+
+    def to_frame(self, start=0, stop=None, samples=None, categorical=False):
+        """Return rows [start, stop) as a zero-filled wide TSS table."""
+        stop = self.n_rows if stop is None else stop
+        chrom = pd.Categorical.from_codes(self.chr_codes[start:stop], categories=self.categories)
+        strand = pd.Categorical.from_codes(self.strand[start:stop], categories=['+', '-'])
+        columns = {
+            'chr': chrom if categorical else np.asarray(chrom, dtype=object),
+            'pos': self.pos[start:stop],
+            'strand': strand if categorical else np.asarray(strand, dtype=object),
+        }
+        names = self.samples if samples is None else list(samples)
+        values = self.dense(start, stop, samples)
+        columns.update((name, values[:, k]) for k, name in enumerate(names))
+        return pd.DataFrame(columns)
+
+    def iter_frames(self, chunksize=500_000, samples=None):
+        """Yield the matrix as wide TSS table chunks of at most ``chunksize`` rows."""
+        for start in range(0, self.n_rows, chunksize):
+            yield self.to_frame(start, min(start + chunksize, self.n_rows), samples)
+
+    def write(self, path, chunksize=500_000):
+        """Write the matrix as a zero-filled TSSr table without ever densifying all of it."""
+        with open_output(path) as handle:
+            handle.write('\t'.join(KEYS + self.samples) + '\n')
+            for frame in self.iter_frames(chunksize):
+                frame.to_csv(handle, sep='\t', index=False, header=False)
+
+    def to_scipy(self):
+        """Return the counts as a ``scipy.sparse.csc_matrix`` (requires scipy)."""
+        try:
+            from scipy import sparse
+        except ImportError:
+            raise ImportError("TSSMatrix.to_scipy() requires scipy; install it with `pip install scipy`") from None
+        return sparse.csc_matrix((self.data, self.indices, self.indptr), shape=self.shape)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import heapq
+import tempfile
+import functools
+import click
+from tsstk.utils import instrumented, open_input, open_output, stage
+
+# 默认内存预算 (MB)，超过后把已排序的基因块写入临时文件
+DEFAULT_MEMORY_MB = 512
+# 预算下限，避免产生过多需要同时打开的临时文件
+MIN_MEMORY_MB = 8
+
+
+# 自然排序的染色体键：chr2 排在 chr10 之前
+def natural_key(chrom):
+    return tuple((0, int(part), '') if part.isdigit() else (1, 0, part)
+                 for part in re.split(r'(\d+)', chrom) if part)
+
+
+# 染色体的排序键：自然排序键相同时再比较原名；染色体数目很少，结果缓存
+@functools.lru_cache(maxsize=None)
+def chrom_key(chrom):
+    return natural_key(chrom), chrom
+
+
+# 块的排序键：(染色体, 起始位置, 输入中的顺序)，相同位置保持输入顺序
+def merge_key(block):
+    return chrom_key(block[0]), block[1], block[2]
+
+
+# run 内排序：先把本批出现的染色体换成整数名次，避免逐次比较嵌套元组
+def sort_blocks(blocks):
+    ranks = {chrom: rank for rank, chrom in enumerate(sorted({block[0] for block in blocks}, key=chrom_key))}
+    blocks.sort(key=lambda block: (ranks[block[0]], block[1], block[2]))
+
+
+# 逐块读取 GFF3 文件：每个基因行开始一个新块，版本和序列区域指令交给 directives，其余注释丢弃
+def read_gff3_blocks(file, directives):
+    gene_block = []
+    chrom = start = None
+    with open_input(file) as f:
+        for line in f:
+            if line.startswith('#'):
+                if line.startswith('##FASTA'):
+                    break
+                if line.startswith(('##gff-version', '##sequence-region')):
+                    directives.append(line)
+                continue
+            if not line.strip():
+                continue
+            if not line.endswith('\n'):
+                line += '\n'
+            fields = line.split('\t', 5)
+            if len(fields) < 5:
+                continue
+            if fields[2] == 'gene' or chrom is None:
+                if gene_block:
+                    yield chrom, start, gene_block
+                gene_block = []
+                chrom, start = fields[0], int(fields[3])
+            gene_block.append(line)
+    if gene_block:
+        yield chrom, start, gene_block
+
+
+# 把一个已排序的 run 写入临时文件，每个块前有一行 "#\t染色体\t起始\t序号"
+def write_run(blocks, run_dir, index):
+    path = os.path.join(run_dir, f'run{index}.gff3')
+    with open(path, 'w') as f:
+        for chrom, start, order, lines in blocks:
+            f.write(f'#\t{chrom}\t{start}\t{order[0]}\t{order[1]}\n')
+            f.writelines(lines)
+    return path
+
+
+def read_run(path):
+    block = None
+    with open(path, 'r') as f:
+        for line in f:
+            if line.startswith('#\t'):
+                if block:
+                    yield block
+                _, chrom, start, file_index, block_index = line.rstrip('\n').split('\t')
+                block = (chrom, int(start), (int(file_index), int(block_index)), [])
+            else:
+                block[3].append(line)
+    if block:
+        yield block
+
+
+# 合并 directives：只保留一个 ##gff-version，合并同一序列的 ##sequence-region
+def merge_directives(directives):
+    version = '##gff-version 3\n'
+    regions = {}
+    for line in directives:
+        if line.startswith('##gff-version'):
+            version = line
+        elif line.startswith('##sequence-region'):
+            fields = line.split()
+            if len(fields) < 4:
+                continue
+            seqid, start, end = fields[1], int(fields[2]), int(fields[3])
+            if seqid in regions:
+                start, end = min(start, regions[seqid][0]), max(end, regions[seqid][1])
+            regions[seqid] = (start, end)
+    header = [version]
+    for seqid in sorted(regions, key=chrom_key):
+        header.append(f'##sequence-region {seqid} {regions[seqid][0]} {regions[seqid][1]}\n')
+    return header
+
+
+# 合并任意多个 GFF3 文件并排序：按内存预算分批排序写入临时文件，再用堆做流式归并
+def merge_gff3(gff3_files, output_file, memory_mb=DEFAULT_MEMORY_MB, tmpdir=None):
+    budget = max(memory_mb, MIN_MEMORY_MB) * 1024 * 1024
+    directives = []
+    with tempfile.TemporaryDirectory(dir=tmpdir) as run_dir:
+        runs = []
+        buffer, buffer_size = [], 0
+        # 读取并分批排序；rows 统计基因块数
+        with stage('sort') as s:
+            for file_index, file in enumerate(gff3_files):
+                for block_index, (chrom, start, lines) in enumerate(read_gff3_blocks(file, directives)):
+                    buffer.append((chrom, start, (file_index, block_index), lines))
+                    # 每行大约占用其长度再加上 Python 对象开销
+                    buffer_size += sum(len(line) + 80 for line in lines)
+                    if buffer_size >= budget:
+                        sort_blocks(buffer)
+                        runs.append(read_run(write_run(buffer, run_dir, len(runs))))
+                        buffer, buffer_size = [], 0
+                    s.rows += 1
+            sort_blocks(buffer)
+            runs.append(iter(buffer))
+
+        with stage('merge') as s, open_output(output_file) as f:
+            f.writelines(merge_directives(directives))
+            # 排序基因，先按染色体自然顺序排序，再按起始位置排序，相同位置保持输入顺序
+            for _, _, _, lines in heapq.merge(*runs, key=merge_key):
+                f.writelines(lines)
+                s.rows += 1
+
+
+@click.command()
+@click.argument('gff3_files', nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@click.option('-i1', '--input1', 'gff3_file1', default=None, help='Path to the first GFF3 file')
+@click.option('-i2', '--input2', 'gff3_file2', default=None, help='Path to the second GFF3 file')
+@click.option('-o', '--output', 'output_file', required=True, help='Path to the output merged GFF3 file')
+@click.option('--memory', 'memory_mb', default=DEFAULT_MEMORY_MB, show_default=True, help='Memory budget in MB before sorted runs are spilled to disk')
+@click.option('--tmpdir', type=click.Path(file_okay=False), default=None, help='Directory for temporary sorted runs')
+@instrumented
+def main(gff3_files, gff3_file1, gff3_file2, output_file, memory_mb, tmpdir):
+    files = [f for f in (gff3_file1, gff3_file2) if f] + list(gff3_files)
+    if not files:
+        raise click.UsageError('Provide at least one GFF3 file')
+    merge_gff3(files, output_file, memory_mb, tmpdir)
+    print(f"Merged GFF3 files written to {output_file}")
+
+if __name__ == "__main__":
+    main()
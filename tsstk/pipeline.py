@@ -0,0 +1,368 @@
+# pipeline.py
+
+import os
+import re
+import json
+import glob
+import pickle
+import time
+import hashlib
+import concurrent.futures
+
+import click
+import pandas as pd
+
+from tsstk import core
+from tsstk.store import read_tss_table
+from tsstk.matrix import TSSMatrix
+from tsstk.assign_region_extractor import FLANK, gene_regions, index_gff3
+from tsstk.cluster_assigner import assign_genes
+from tsstk.tssTable2bedGraph import process_table
+from tsstk.cluster2domainantBed import dominant_windows
+from tsstk.utils import current_stats, file_digest, instrumented
+
+# Bumped whenever stage results change meaning, so old checkpoints are not reused.
+PIPELINE_VERSION = 2
+
+CHECKPOINT_DIR = '.tsstk-checkpoints'
+
+
+class Stage:
+    """One node of the pipeline DAG, computed as ``func(*dependency results, **params, **options)``.
+
+    ``params`` and the content of ``files`` are part of the stage's checkpoint
+    key; ``options`` only tune how the result is computed (e.g. the number of
+    processes) and are left out of it. A stage that ``writes`` output files
+    returns their paths, and its checkpoint is only reused while all of them
+    still exist.
+    """
+
+    def __init__(self, name, func, deps=(), params=None, files=(), writes=False, options=None):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.params = params or {}
+        self.options = options or {}
+        self.files = list(files)
+        self.writes = writes
+
+
+class Checkpoints:
+    """Stage results pickled in a directory under their content-hash keys."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.digests_file = os.path.join(path, 'digests.json')
+        try:
+            with open(self.digests_file) as f:
+                self.digests = json.load(f)
+        except (OSError, ValueError):
+            self.digests = {}
+
+    def digest(self, path):
+        """SHA-1 of a file's content, rehashed only when its size or mtime changes."""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        entry = self.digests.get(path)
+        if entry and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+            return entry['sha1']
+        sha1 = file_digest(path)
+        self.digests[path] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha1': sha1}
+        self._atomic_write(self.digests_file, json.dumps(self.digests, indent=1).encode())
+        return sha1
+
+    def _file(self, name, key):
+        safe_name = re.sub(r'[^\w.-]', '_', name)
+        return os.path.join(self.path, f"{safe_name}.{key}.pkl")
+
+    def valid(self, stage, key):
+        if not os.path.exists(self._file(stage.name, key)):
+            return False
+        return not stage.writes or all(os.path.exists(p) for p in self.load(stage.name, key))
+
+    def load(self, name, key):
+        with open(self._file(name, key), 'rb') as f:
+            return pickle.load(f)
+
+    def save(self, name, key, value):
+        target = self._file(name, key)
+        # Older checkpoints of the stage can never be hit again once its key changed
+        for stale in glob.glob(self._file(name, '*')):
+            if stale != target:
+                os.remove(stale)
+        self._atomic_write(target, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+    @staticmethod
+    def _atomic_write(path, data):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+
+def topological_order(stages):
+    """Order stages so that every stage comes after its dependencies."""
+    by_name = {stage.name: stage for stage in stages}
+    if len(by_name) != len(stages):
+        raise ValueError("stage names must be unique")
+    order, state = [], {}
+
+    def visit(name, path):
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError(f"dependency cycle: {' -> '.join(path + [name])}")
+        if name not in by_name:
+            raise ValueError(f"unknown stage {name!r} required by {path[-1]!r}")
+        state[name] = 'visiting'
+        for dep in by_name[name].deps:
+            visit(dep, path + [name])
+        state[name] = 'done'
+        order.append(by_name[name])
+
+    for stage in stages:
+        visit(stage.name, [])
+    return order
+
+
+def stage_key(stage, dep_keys, file_digests):
+    """Hash of everything a stage result depends on: code, parameters, inputs and upstream keys.
+
+    The stage's ``options`` are not hashed, so they can change without
+    invalidating its checkpoint.
+    """
+    description = {
+        'version': PIPELINE_VERSION,
+        'func': f"{stage.func.__module__}.{stage.func.__qualname__}",
+        'params': stage.params,
+        'deps': dep_keys,
+        'files': file_digests,
+    }
+    return hashlib.sha1(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def _run_stage(func, args, params):
+    # Timed where it runs, so that the scheduler's queueing is not counted
+    start = time.perf_counter()
+    value = func(*args, **params)
+    return value, time.perf_counter() - start
+
+
+def run_pipeline(stages, workers=None, checkpoint_dir=None, log=None):
+    """Run a DAG of stages and return {stage name: 'run' or 'cached'}.
+
+    Stages whose dependencies are done run concurrently in a pool of
+    ``workers`` processes (in-process when ``workers`` is 1); results are passed
+    between stages as in-memory objects. With ``checkpoint_dir`` every result is
+    saved under a key hashing its parameters, input file contents and the keys
+    of its dependencies, so a rerun only recomputes stages whose key changed.
+    A cached result is loaded only when a stage that has to run needs it, and
+    results are released as soon as their last consumer has started.
+    """
+    order = topological_order(stages)
+    checkpoints = Checkpoints(checkpoint_dir) if checkpoint_dir else None
+    log = log or (lambda message: None)
+
+    keys = {}
+    for stage in order:
+        digests = [checkpoints.digest(f) if checkpoints else os.path.abspath(f) for f in stage.files]
+        keys[stage.name] = stage_key(stage, [keys[dep] for dep in stage.deps], digests)
+
+    status = {}
+    to_run = []
+    for stage in order:
+        if checkpoints and checkpoints.valid(stage, keys[stage.name]):
+            status[stage.name] = 'cached'
+            log(f"[cached] {stage.name}")
+        else:
+            to_run.append(stage)
+
+    run_names = {stage.name for stage in to_run}
+    consumers = {}
+    for stage in to_run:
+        for dep in stage.deps:
+            consumers[dep] = consumers.get(dep, 0) + 1
+    results = {}
+
+    def arguments(stage):
+        args = []
+        for dep in stage.deps:
+            if dep not in results:
+                results[dep] = checkpoints.load(dep, keys[dep])
+            args.append(results[dep])
+            consumers[dep] -= 1
+            if not consumers[dep]:
+                del results[dep]
+        return args
+
+    def finish(stage, outcome):
+        value, seconds = outcome
+        stats = current_stats()
+        if stats:
+            stats.add(f"pipeline:{stage.name}", seconds, len(value) if isinstance(value, pd.DataFrame) else 0)
+        if checkpoints:
+            checkpoints.save(stage.name, keys[stage.name], value)
+        if consumers.get(stage.name):
+            results[stage.name] = value
+        status[stage.name] = 'run'
+        log(f"[done] {stage.name}")
+
+    if workers == 1:
+        for stage in to_run:
+            log(f"[run] {stage.name}")
+            finish(stage, _run_stage(stage.func, arguments(stage), {**stage.params, **stage.options}))
+        return status
+
+    waiting = list(to_run)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        running = {}
+        while waiting or running:
+            for stage in [s for s in waiting if all(d not in run_names or d in status for d in s.deps)]:
+                waiting.remove(stage)
+                log(f"[run] {stage.name}")
+                running[executor.submit(_run_stage, stage.func, arguments(stage),
+                                        {**stage.params, **stage.options})] = stage
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                finish(running.pop(future), future.result())
+    return status
+
+
+def combine_samples(*tables):
+    # The combined samples stay sparse; zeros of a wide table would dominate memory
+    return TSSMatrix.from_frames(tables)
+
+
+def gene_table(gff3_file, flank=FLANK):
+    chrom, start, end, strand, gene_id = gene_regions(index_gff3(gff3_file), flank)
+    return pd.DataFrame({'chromosome': chrom, 'gene_start': start, 'gene_end': end, 'strand': strand,
+                         'gene_id': gene_id})
+
+
+def write_table(table, path):
+    if isinstance(table, TSSMatrix):
+        table.write(path)
+    else:
+        table.to_csv(path, sep='\t', index=False)
+    return [path]
+
+
+def write_tracks(matrix, prefix, merge=False, each_sample=False, min_signal=2):
+    pairs = process_table(matrix, prefix, merge=merge, each_sample=each_sample, signal_columns=matrix.samples,
+                          min_signal=min_signal)
+    return [path for pair in pairs for path in pair]
+
+
+def write_dominant_bed(clusters, path, upstream=150, downstream=10):
+    dominant_windows(clusters, upstream, downstream).to_csv(path, sep='\t', index=False, header=False)
+    return [path]
+
+
+def table_stage_name(table):
+    return f"table:{os.path.basename(os.path.normpath(table))}"
+
+
+def table_files(table):
+    """Files a table stage reads: the TSV itself, or the index and arrays of a TSS store."""
+    if os.path.isdir(table):
+        return sorted(glob.glob(os.path.join(table, 'index.json')) + glob.glob(os.path.join(table, '*.npy')))
+    return [table]
+
+
+def build_stages(bams=(), tables=(), gff3=None, outdir='.', prefix='tsstk', workers=None, min_mapq=0,
+                 chunk_size=core.DEFAULT_CHUNK_SIZE, max_distance=core.DEFAULT_MAX_DISTANCE,
+                 min_tpm=core.DEFAULT_MIN_TPM, min_count=0, cluster_tpm=core.DEFAULT_CLUSTER_TPM,
+                 merge_runs=False, each_sample=False, min_signal=2, upstream=150, downstream=10):
+    """Build the BAM -> TSS table -> clusters -> gene assignment -> tracks DAG.
+
+    Every BAM is counted in its own stage and TSS tables (or stores) are read
+    as they are; all samples are combined into one table that feeds the
+    clustering and the bedGraph tracks. With a GFF3 the clusters are assigned
+    to genes and promoter windows around their dominant TSS are written as BED.
+    """
+    out = lambda suffix: os.path.join(outdir, f"{prefix}{suffix}")
+    # Leave the cores to the BAM shards when there are fewer BAMs than workers
+    bam_processes = max(1, (workers or os.cpu_count() or 1) // max(1, len(bams)))
+
+    stages, samples = [], []
+    for bam in bams:
+        sample = core.default_sample_name(bam)
+        samples.append(f"tss:{sample}")
+        stages.append(Stage(f"tss:{sample}", core.tss_frame_from_bam, files=[bam],
+                            params={'bam_path': os.path.abspath(bam), 'min_mapq': min_mapq,
+                                    'chunk_size': chunk_size, 'sample_name': sample},
+                            options={'processes': bam_processes}))
+    for table in tables:
+        name = table_stage_name(table)
+        samples.append(name)
+        stages.append(Stage(name, read_tss_table, files=table_files(table), params={'path': os.path.abspath(table)}))
+
+    stages.append(Stage('combine', combine_samples, deps=samples))
+    stages.append(Stage('clusters', core.cluster_tss_table, deps=['combine'],
+                        params={'max_distance': max_distance, 'min_tpm': min_tpm, 'min_count': min_count,
+                                'cluster_tpm': cluster_tpm}, options={'processes': 1}))
+    clusters = 'clusters'
+    if gff3:
+        stages.append(Stage('genes', gene_table, files=[gff3], params={'gff3_file': os.path.abspath(gff3)}))
+        stages.append(Stage('assign', assign_genes, deps=['clusters', 'genes']))
+        stages.append(Stage('dominant-bed', write_dominant_bed, deps=['assign'], writes=True,
+                            params={'path': out('.dominant_tss.bed'), 'upstream': upstream,
+                                    'downstream': downstream}))
+        clusters = 'assign'
+
+    stages.append(Stage('write-table', write_table, deps=['combine'], writes=True,
+                        params={'path': out('.TSS.raw.txt')}))
+    stages.append(Stage('write-clusters', write_table, deps=[clusters], writes=True,
+                        params={'path': out('.clusters.txt')}))
+    stages.append(Stage('tracks', write_tracks, deps=['combine'], writes=True,
+                        params={'prefix': out(''), 'merge': merge_runs, 'each_sample': each_sample,
+                                'min_signal': min_signal}))
+    return stages
+
+
+@click.command()
+@click.option('-b', '--bam', 'bams', multiple=True, type=click.Path(exists=True, dir_okay=False), help='Indexed BAM of one sample (repeat for several).')
+@click.option('-t', '--table', 'tables', multiple=True, type=click.Path(exists=True), help='TSS table or TSS store to include (repeat for several).')
+@click.option('-g', '--gff3', type=click.Path(exists=True, dir_okay=False), default=None, help='GFF3 annotation; enables gene assignment and the dominant TSS BED.')
+@click.option('-o', '--outdir', type=click.Path(file_okay=False), default='.', show_default=True, help='Output directory.')
+@click.option('--prefix', default='tsstk', show_default=True, help='Prefix of the output file names.')
+@click.option('-p', '--workers', type=int, default=None, help='Number of worker processes [default: all cores].')
+@click.option('--checkpoint-dir', type=click.Path(file_okay=False), default=None, help=f'Checkpoint directory [default: <outdir>/{CHECKPOINT_DIR}].')
+@click.option('--no-checkpoints', is_flag=True, help='Recompute every stage and save no checkpoints.')
+@click.option('--mapq', 'min_mapq', type=int, default=0, help='Minimum mapping quality of counted reads.')
+@click.option('--chunk-size', type=int, default=core.DEFAULT_CHUNK_SIZE, help='Size of the regions a BAM is split into.')
+@click.option('--max-dist', 'max_distance', type=int, default=core.DEFAULT_MAX_DISTANCE, show_default=True, help='Largest gap between neighbouring TSS of a cluster.')
+@click.option('--min-tpm', type=float, default=core.DEFAULT_MIN_TPM, show_default=True, help='Minimum TPM of a clustered TSS.')
+@click.option('--min-count', type=int, default=0, show_default=True, help='Minimum read count of a clustered TSS.')
+@click.option('--cluster-tpm', type=float, default=core.DEFAULT_CLUSTER_TPM, show_default=True, help='Minimum total TPM of a reported cluster.')
+@click.option('--merge-runs', is_flag=True, help='Collapse adjacent bedGraph positions with identical values.')
+@click.option('--each-sample', is_flag=True, help='Write a bedGraph pair for every sample.')
+@click.option('--min-signal', type=float, default=2, show_default=True, help='Minimum summed signal of a bedGraph position.')
+@click.option('-u', '--upstream', type=int, default=150, show_default=True, help='Bases upstream of the dominant TSS in the BED.')
+@click.option('-d', '--downstream', type=int, default=10, show_default=True, help='Bases downstream of the dominant TSS in the BED.')
+@instrumented
+def pipeline(bams, tables, gff3, outdir, prefix, workers, checkpoint_dir, no_checkpoints, **options):
+    """Run BAM -> TSS table -> clusters -> gene assignment -> tracks in one go.
+
+    Stages exchange in-memory tables instead of TSV files and independent
+    stages run in parallel. Stage results are checkpointed under content
+    hashes, so a rerun only recomputes what a changed input or parameter affects.
+    """
+    if not bams and not tables:
+        raise click.UsageError("Please provide at least one --bam or --table.")
+    names = [core.default_sample_name(b) for b in bams]
+    if len(set(names)) != len(names):
+        raise click.UsageError("BAM files must have distinct sample names.")
+    table_names = [table_stage_name(t) for t in tables]
+    if len(set(table_names)) != len(table_names):
+        raise click.UsageError("TSS tables must have distinct file names.")
+    os.makedirs(outdir, exist_ok=True)
+    if not no_checkpoints:
+        checkpoint_dir = checkpoint_dir or os.path.join(outdir, CHECKPOINT_DIR)
+    else:
+        checkpoint_dir = None
+    stages = build_stages(bams, tables, gff3, outdir, prefix, workers, **options)
+    status = run_pipeline(stages, workers, checkpoint_dir, log=lambda message: click.echo(message, err=True))
+    ran = sum(1 for s in status.values() if s == 'run')
+    click.echo(f"Pipeline complete: {ran} stage(s) run, {len(status) - ran} reused from checkpoints.", err=True)
@@ -0,0 +1,188 @@
+# quantify.py
+
+import sys
+import concurrent.futures
+
+import click
+import numpy as np
+import pandas as pd
+
+from tsstk.store import read_tss_table
+from tsstk.combine_multi_TSS_table import sample_columns
+from tsstk.utils import input_bytes, instrumented, open_output, read_table, stage
+
+# How a TSS inside several overlapping regions is counted:
+#   all      for every region containing it
+#   unique   only when a single region contains it
+#   split    for every region, divided by the number of regions
+#   nearest  for the region whose 5' end is closest (first in the file on ties)
+OVERLAP_RULES = ('all', 'unique', 'split', 'nearest')
+
+# Every (chromosome, strand) pair gets its own 2**32-wide stretch of one axis
+STRIDE = 1 << 32
+
+
+class RegionIndex:
+    """Gene regions of all chromosome strands on one sorted axis.
+
+    The region boundaries cut the axis into elementary segments, each covered
+    by a fixed set of regions. A TSS is placed in its segment with one binary
+    search, and the (segment, region) pairs, sorted by segment, give the
+    regions containing it. Regions are 1-based and inclusive, as written by
+    ``tsstk regions``.
+    """
+
+    def __init__(self, regions):
+        gene_codes, self.genes = pd.factorize(regions['gene_id'].astype(str))
+        self.gene_of_region = gene_codes
+        self.chromosomes = pd.Index(pd.unique(regions['chromosome'].astype(str)))
+        key = self._keys(regions['chromosome'], regions['strand'])
+        start = key + regions['gene_start'].to_numpy(np.int64)
+        stop = key + regions['gene_end'].to_numpy(np.int64) + 1
+        minus = (regions['strand'] == '-').to_numpy()
+        self.five_prime = np.where(minus, stop - 1, start)
+
+        # Segment i is [bounds[i], bounds[i + 1]); region r covers segments [first[r], last[r])
+        self.bounds = np.unique(np.r_[start, stop])
+        first, last = np.searchsorted(self.bounds, start), np.searchsorted(self.bounds, stop)
+        lengths = last - first
+        offsets = np.cumsum(lengths) - lengths
+        pair_region = np.repeat(np.arange(len(regions)), lengths)
+        pair_segment = np.repeat(first, lengths) + np.arange(lengths.sum()) - np.repeat(offsets, lengths)
+        order = np.argsort(pair_segment, kind='stable')
+        self.pair_region, self.pair_segment = pair_region[order], pair_segment[order]
+        self.cover = np.bincount(pair_segment, minlength=len(self.bounds))
+        self.segment_ptr = np.r_[0, np.cumsum(self.cover)]
+
+    @property
+    def n_regions(self):
+        return len(self.gene_of_region)
+
+    def _keys(self, chrom, strand):
+        codes = self.chromosomes.get_indexer(pd.Index(np.asarray(chrom).astype(str)))
+        minus = (np.asarray(strand) == '-')
+        keys = (codes.astype(np.int64) * 2 + minus) * STRIDE
+        return np.where(codes >= 0, keys, -1)
+
+    def locate(self, chrom, strand, pos):
+        """Return the axis coordinate and segment of every TSS, and which lie in some region."""
+        key = self._keys(chrom, strand)
+        x = key + np.asarray(pos, dtype=np.int64)
+        segment = np.searchsorted(self.bounds, x, side='right') - 1
+        inside = (key >= 0) & (segment >= 0)
+        inside[inside] = self.cover[segment[inside]] > 0
+        return x[inside], segment[inside], inside
+
+    def region_counts(self, chrom, strand, pos, counts, rule='all'):
+        """Sum the columns of ``counts`` (one row per TSS) into an (n_regions, n_columns) array."""
+        counts = np.asarray(counts)
+        x, segment, inside = self.locate(chrom, strand, pos)
+        counts = counts[inside]
+        out = np.zeros((self.n_regions, counts.shape[1]))
+        if rule == 'nearest':
+            # Expand each TSS into its (TSS, covering region) pairs and keep the closest region
+            reps = self.cover[segment]
+            owner = np.repeat(np.arange(len(segment)), reps)
+            offsets = np.cumsum(reps) - reps
+            pair = np.repeat(self.segment_ptr[segment], reps) + np.arange(reps.sum()) - np.repeat(offsets, reps)
+            region = self.pair_region[pair]
+            order = np.lexsort((region, np.abs(x[owner] - self.five_prime[region]), owner))
+            _, first = np.unique(owner[order], return_index=True)
+            nearest = region[order[first]]
+            for k in range(counts.shape[1]):
+                out[:, k] = np.bincount(nearest, weights=counts[:, k], minlength=self.n_regions)
+            return out
+
+        weight = np.ones(len(self.pair_segment))
+        if rule == 'unique':
+            weight = (self.cover[self.pair_segment] == 1).astype(np.float64)
+        elif rule == 'split':
+            weight = 1 / self.cover[self.pair_segment]
+        n_segments = len(self.bounds)
+        for k in range(counts.shape[1]):
+            per_segment = np.bincount(segment, weights=counts[:, k], minlength=n_segments)
+            out[:, k] = np.bincount(self.pair_region, weights=per_segment[self.pair_segment] * weight,
+                                    minlength=self.n_regions)
+        return out
+
+    def gene_counts(self, chrom, strand, pos, counts, rule='all'):
+        """Sum the columns of ``counts`` into an (n_genes, n_columns) array; regions of one gene add up."""
+        regions = self.region_counts(chrom, strand, pos, counts, rule)
+        out = np.zeros((len(self.genes), regions.shape[1]))
+        for k in range(regions.shape[1]):
+            out[:, k] = np.bincount(self.gene_of_region, weights=regions[:, k], minlength=len(self.genes))
+        return out
+
+
+_index = None
+
+
+def _init_worker(index):
+    global _index
+    _index = index
+
+
+def _quantify_table(path, rename, rule):
+    df = read_tss_table(path)
+    columns = list(rename)
+    values = _index.gene_counts(df['chr'], df['strand'], df['pos'], df[columns].to_numpy(np.float64), rule)
+    return [rename[c] for c in columns], values
+
+
+def quantify(regions, tss_files, rule='all', processes=None):
+    """Return the gene x sample count matrix of several TSS tables over gene regions.
+
+    The region index is built once and handed to every worker process, which
+    quantifies one TSS table (all of its sample columns) per task. Sample
+    columns whose names repeat across tables get the table's 1-based index as
+    suffix.
+    """
+    with stage('index') as s:
+        index = RegionIndex(regions)
+        s.rows = index.n_regions
+    _, renames = sample_columns(tss_files, matrix=True)
+
+    with stage('quantify') as s:
+        s.bytes_read = input_bytes(tss_files)
+        if processes == 1 or len(tss_files) < 2:
+            _init_worker(index)
+            results = [_quantify_table(path, rename, rule) for path, rename in zip(tss_files, renames)]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                                        initargs=(index,)) as executor:
+                results = list(executor.map(_quantify_table, tss_files, renames, [rule] * len(tss_files)))
+
+    columns = {'gene_id': np.asarray(index.genes)}
+    for names, values in results:
+        if rule != 'split':
+            values = values.round().astype(np.int64)
+        columns.update((name, values[:, k]) for k, name in enumerate(names))
+    return pd.DataFrame(columns)
+
+
+@click.command()
+@click.option('-r', '--regions', 'regions_file', required=True, type=click.Path(exists=True),
+              help='Gene region table (chromosome, start, end, strand, gene_id) from `tsstk regions`.')
+@click.argument('tss_files', nargs=-1, required=True, type=click.Path(exists=True))
+@click.option('-o', '--output', 'output_file', default='-', help='Output gene x sample count matrix (default: stdout).')
+@click.option('--overlap', type=click.Choice(OVERLAP_RULES), default='all', show_default=True,
+              help='How to count a TSS inside several overlapping regions.')
+@click.option('-p', '--processes', type=int, default=None, help='Number of worker processes (one TSS table per task).')
+@instrumented
+def main(regions_file, tss_files, output_file, overlap, processes):
+    """Count TSS signal per gene and sample over the gene regions of `tsstk regions`."""
+    with stage('read') as s:
+        regions = read_table(regions_file, 'gene_region')
+        s.rows = len(regions)
+    matrix = quantify(regions, list(tss_files), overlap, processes)
+    with stage('write') as s:
+        if output_file != '-':
+            with open_output(output_file) as handle:
+                matrix.to_csv(handle, sep='\t', index=False)
+        else:
+            matrix.to_csv(sys.stdout, sep='\t', index=False)
+        s.rows = len(matrix)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+# store.py
+
+"""
+Memory-mapped binary store for TSS tables.
+
+A store is a directory holding the rows of a TSSr-style table
+(chr, pos, strand, one count column per sample) as flat NumPy arrays:
+
+    index.json   samples, source file fingerprint and one block per
+                 (strand, chr) with its [start, stop) row range
+    pos.npy      int32 positions, sorted within each block
+    counts.npy   (n_samples, n_rows) counts, one contiguous row per sample
+
+Arrays are memory-mapped on open, so a region query only touches the pages it
+needs and costs two binary searches within the block.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from tsstk.utils import read_table, stage
+
+STORE_VERSION = 1
+STORE_SUFFIX = '.tsss'
+KEYS = ['chr', 'pos', 'strand']
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'tsstk')
+
+
+def is_store(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, 'index.json'))
+
+
+def source_fingerprint(path):
+    st = os.stat(path)
+    return {'path': os.path.abspath(path), 'mtime_ns': st.st_mtime_ns, 'size': st.st_size}
+
+
+class TSSStore:
+    """Read-only view of a TSS store directory."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'index.json')) as f:
+            self.index = json.load(f)
+        if self.index.get('version') != STORE_VERSION:
+            raise ValueError(f"Unsupported TSS store version in {path}")
+        self.samples = self.index['samples']
+        self.blocks = {(b['chr'], b['strand']): (b['start'], b['stop']) for b in self.index['blocks']}
+        self.pos = np.load(os.path.join(path, 'pos.npy'), mmap_mode='r')
+        self.counts = np.load(os.path.join(path, 'counts.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.pos)
+
+    @property
+    def chromosomes(self):
+        return list(dict.fromkeys(b['chr'] for b in self.index['blocks']))
+
+    def _sample_rows(self, samples):
+        if samples is None:
+            return list(range(len(self.samples)))
+        return [self.samples.index(s) for s in samples]
+
+    def block(self, chrom, strand):
+        """Return the (positions, counts) arrays of one chromosome strand."""
+        start, stop = self.blocks.get((chrom, strand), (0, 0))
+        return self.pos[start:stop], self.counts[:, start:stop]
+
+    def row_range(self, chrom, strand, start, end):
+        """Return the [first, last) row range of positions start..end (1-based, inclusive)."""
+        first, stop = self.blocks.get((chrom, strand), (0, 0))
+        pos = self.pos[first:stop]
+        return first + np.searchsorted(pos, start, side='left'), first + np.searchsorted(pos, end, side='right')
+
+    def query(self, chrom, start, end, strand=None, samples=None):
+        """Return the rows of chrom:start-end (1-based, inclusive) as a TSS table."""
+        strands = [strand] if strand else ['+', '-']
+        rows = self._sample_rows(samples)
+        frames = []
+        for s in strands:
+            first, last = self.row_range(chrom, s, start, end)
+            frame = pd.DataFrame({'chr': chrom, 'pos': np.asarray(self.pos[first:last]), 'strand': s})
+            for i in rows:
+                frame[self.samples[i]] = np.asarray(self.counts[i, first:last])
+            frames.append(frame)
+        return pd.concat(frames, ignore_index=True)
+
+    def count(self, chrom, start, end, strand=None, samples=None):
+        """Return per-sample total counts in chrom:start-end (1-based, inclusive)."""
+        strands = [strand] if strand else ['+', '-']
+        rows = self._sample_rows(samples)
+        total = np.zeros(len(rows), dtype=np.int64)
+        for s in strands:
+            first, last = self.row_range(chrom, s, start, end)
+            total += self.counts[rows, first:last].sum(axis=1)
+        return dict(zip([self.samples[i] for i in rows], total.tolist()))
+
+    def iter_frames(self, chunksize=1_000_000, samples=None):
+        """Yield the table in TSSr row order as DataFrames of at most ``chunksize`` rows."""
+        rows = self._sample_rows(samples)
+        for b in self.index['blocks']:
+            for start in range(b['start'], b['stop'], chunksize):
+                stop = min(start + chunksize, b['stop'])
+                frame = pd.DataFrame({'chr': b['chr'], 'pos': np.asarray(self.pos[start:stop]), 'strand': b['strand']})
+                for i in rows:
+                    frame[self.samples[i]] = np.asarray(self.counts[i, start:stop])
+                yield frame
+
+    def to_frame(self, samples=None):
+        """Return the whole table as a DataFrame with categorical chr and strand columns."""
+        rows = self._sample_rows(samples)
+        blocks = self.index['blocks']
+        lengths = [b['stop'] - b['start'] for b in blocks]
+        chroms = self.chromosomes
+        chr_codes = np.repeat([chroms.index(b['chr']) for b in blocks], lengths).astype(np.int32)
+        strand_codes = np.repeat([0 if b['strand'] == '+' else 1 for b in blocks], lengths).astype(np.int8)
+        df = pd.DataFrame({
+            'chr': pd.Categorical.from_codes(chr_codes, categories=chroms),
+            'pos': np.asarray(self.pos),
+            'strand': pd.Categorical.from_codes(strand_codes, categories=['+', '-']),
+        })
+        for i in rows:
+            df[self.samples[i]] = np.asarray(self.counts[i])
+        return df
+
+
+def write_store(df, store_path, source=None):
+    """Write a TSS table DataFrame to a store directory, replacing it atomically."""
+    samples = [c for c in df.columns if c not in KEYS]
+    df = df[(df['chr'].astype(str) != '0') | (df['pos'] != 0)]  # remove incorrect line if any
+    df = df.sort_values(['strand', 'chr', 'pos'], kind='stable')
+
+    keys = (df['strand'].astype(str) + '\t' + df['chr'].astype(str)).to_numpy()
+    change = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1], True]) if len(df) else []
+    blocks = [{'chr': str(df['chr'].iat[a]), 'strand': str(df['strand'].iat[a]), 'start': int(a), 'stop': int(b)}
+              for a, b in zip(change[:-1], change[1:])]
+
+    counts = df[samples].fillna(0).to_numpy(np.int64).T
+    dtype = np.int32 if counts.size == 0 or counts.max() <= np.iinfo(np.int32).max else np.int64
+
+    parent = os.path.dirname(os.path.abspath(store_path))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix='.tsss-')
+    try:
+        os.chmod(tmp, 0o755)
+        np.save(os.path.join(tmp, 'pos.npy'), df['pos'].to_numpy(np.int32))
+        np.save(os.path.join(tmp, 'counts.npy'), np.ascontiguousarray(counts, dtype=dtype))
+        with open(os.path.join(tmp, 'index.json'), 'w') as f:
+            json.dump({'version': STORE_VERSION, 'samples': samples, 'source': source, 'blocks': blocks}, f)
+        if os.path.exists(store_path):
+            shutil.rmtree(store_path)
+        os.replace(tmp, store_path)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return store_path
+
+
+def convert_table(table_path, store_path=None):
+    """Parse a TSS table once and write it as a store next to it (or to ``store_path``)."""
+    if store_path is None:
+        store_path = table_path + STORE_SUFFIX
+    with stage('read') as s:
+        df = read_table(table_path, 'tss')
+        s.rows = len(df)
+    with stage('write') as s:
+        s.rows = len(df)
+        return write_store(df, store_path, source=source_fingerprint(table_path))
+
+
+def cache_path(table_path, cache_dir=None):
+    cache_dir = cache_dir or os.environ.get('TSSTK_CACHE_DIR', DEFAULT_CACHE_DIR)
+    digest = hashlib.sha1(os.path.abspath(table_path).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{os.path.basename(table_path)}.{digest}{STORE_SUFFIX}")
+
+
+def cached_store(table_path, cache_dir=None):
+    """Return a store for a TSS table, rebuilding the cached copy when the source changed."""
+    path = cache_path(table_path, cache_dir)
+    if is_store(path):
+        with open(os.path.join(path, 'index.json')) as f:
+            if json.load(f).get('source') == source_fingerprint(table_path):
+                return TSSStore(path)
+    convert_table(table_path, path)
+    return TSSStore(path)
+
+
+def read_tss_table(path, use_cache=False):
+    """Load a TSS table from a store directory or a TSV file.
+
+    With ``use_cache`` a TSV is converted to a cached store on first use, and
+    later calls load the memory-mapped arrays instead of parsing text.
+    """
+    if is_store(path):
+        return TSSStore(path).to_frame()
+    if use_cache:
+        return cached_store(path).to_frame()
+    return read_table(path, 'tss')
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+import click
+import numpy as np
+import pandas as pd
+from tsstk.store import TSSStore, is_store, read_tss_table
+from tsstk.matrix import TSSMatrix
+from tsstk.utils import instrumented, open_output, read_table, stage
+
+# Define the version of the script
+VERSION = "0.2.0"
+
+KEYS = ['chr', 'pos', 'strand']
+# Rows per chunk when streaming; a TSSMatrix is never expanded in larger frames
+STREAMING_CHUNKSIZE = 1_000_000
+
+
+class BedGraphWriter:
+    """Append bedGraph rows chunk by chunk, optionally collapsing runs.
+
+    With ``merge`` adjacent positions on the same chromosome carrying the same
+    value are written as one interval. The last interval of every chunk is held
+    back because the next chunk may extend it.
+    """
+
+    def __init__(self, path, merge=False):
+        self.path = path
+        self.handle = open_output(path)
+        self.merge = merge
+        self.pending = None
+
+    def write(self, chrom, pos, value):
+        chrom, pos, value = np.asarray(chrom, dtype=object), np.asarray(pos, dtype=np.int64), np.asarray(value)
+        start, end = pos - 1, pos  # Convert to 0-based indexing
+        if self.merge and len(pos):
+            new_run = np.r_[True, (chrom[1:] != chrom[:-1]) | (pos[1:] != pos[:-1] + 1) | (value[1:] != value[:-1])]
+            first = np.flatnonzero(new_run)
+            last = np.r_[first[1:] - 1, len(pos) - 1]
+            chrom, start, end, value = chrom[first], start[first], end[last], value[first]
+            if self.pending is not None:
+                p_chrom, p_start, p_end, p_value = self.pending
+                if p_chrom == chrom[0] and p_end == start[0] and p_value == value[0]:
+                    start[0] = p_start
+                else:
+                    self._write_rows([p_chrom], [p_start], [p_end], [p_value])
+            self.pending = (chrom[-1], start[-1], end[-1], value[-1])
+            chrom, start, end, value = chrom[:-1], start[:-1], end[:-1], value[:-1]
+        self._write_rows(chrom, start, end, value)
+
+    def _write_rows(self, chrom, start, end, value):
+        pd.DataFrame({'chr': chrom, 'pos_start': start, 'pos_end': end, 'tpm': value}).to_csv(
+            self.handle, sep='\t', header=False, index=False)
+
+    def close(self):
+        if self.pending is not None:
+            self._write_rows(*[[v] for v in self.pending])
+            self.pending = None
+        self.handle.close()
+
+
+def iter_chunks(input_file, chunksize, cache=False):
+    """Yield the TSS table in chunks, or whole when ``chunksize`` is None.
+
+    ``input_file`` may also be a DataFrame or a sparse TSSMatrix already in
+    memory; the matrix is always expanded in chunks, STREAMING_CHUNKSIZE rows
+    at most unless ``chunksize`` is given.
+    """
+    if isinstance(input_file, pd.DataFrame):
+        yield input_file
+    elif isinstance(input_file, TSSMatrix):
+        yield from input_file.iter_frames(chunksize or STREAMING_CHUNKSIZE)
+    elif chunksize is None:
+        yield read_tss_table(input_file, use_cache=cache)
+    elif is_store(input_file):
+        yield from TSSStore(input_file).iter_frames(chunksize)
+    else:
+        yield from read_table(input_file, 'tss', chunksize=chunksize)
+
+
+def signal_sets(columns, prefix, signal_columns=None, each_sample=False):
+    """Return (output prefix, summed sample columns) for every bedGraph pair to write."""
+    samples = [c for c in columns if c not in KEYS]
+    if each_sample:
+        return [(f"{prefix}_{sample}", [sample]) for sample in samples]
+    if signal_columns:
+        return [(prefix, signal_columns)]
+    # Sum the signal values from columns 3 and 4
+    return [(prefix, list(columns[3:5]))]
+
+
+def process_table(input_file, prefix, chunksize=None, merge=False, each_sample=False, signal_columns=None,
+                  min_signal=2, cache=False):
+    """Write TPM-normalized plus/minus bedGraphs for one or more signals of a TSS table.
+
+    The TPM denominators of all signals are computed in a first pass and the
+    bedGraphs are written in a second one, so with ``chunksize`` only one chunk
+    of the table is held in memory. Every signal is converted from the same read.
+    """
+    signals = None
+    totals = None
+    table = None
+    # A whole table read once is kept for the second pass; matrix chunks are expanded again
+    keep_table = chunksize is None and not isinstance(input_file, TSSMatrix)
+    with stage('totals') as s:
+        for chunk in iter_chunks(input_file, chunksize, cache):
+            if signals is None:
+                signals = signal_sets(list(chunk.columns), prefix, signal_columns, each_sample)
+                totals = np.zeros(len(signals))
+            for i, (_, cols) in enumerate(signals):
+                totals[i] += chunk[cols].sum(axis=1).sum()
+            if keep_table:
+                table = chunk
+            s.rows += len(chunk)
+
+    writers = [(BedGraphWriter(f'{name}_normalized_TPM.plus.bedgraph', merge),
+                BedGraphWriter(f'{name}_normalized_TPM.minus.bedgraph', merge)) for name, _ in signals]
+    try:
+        with stage('bedgraph') as s:
+            chunks = [table] if table is not None else iter_chunks(input_file, chunksize, cache)
+            for chunk in chunks:
+                plus = (chunk['strand'] == '+').to_numpy()
+                minus = (chunk['strand'] == '-').to_numpy()
+                for (_, cols), total, (plus_writer, minus_writer) in zip(signals, totals, writers):
+                    signal = chunk[cols].sum(axis=1).to_numpy()
+                    # Calculate the overall TPM transformation (without filtering any data)
+                    tpm = ((signal / total) * 1e6).round(6)
+                    # Filter out rows where the sum of the original signal values is less than min_signal
+                    keep = signal >= min_signal
+                    rows = keep & plus
+                    plus_writer.write(chunk['chr'].to_numpy()[rows], chunk['pos'].to_numpy()[rows], tpm[rows])
+                    rows = keep & minus
+                    minus_writer.write(chunk['chr'].to_numpy()[rows], chunk['pos'].to_numpy()[rows], -tpm[rows])
+                s.rows += len(chunk)
+    finally:
+        for plus_writer, minus_writer in writers:
+            plus_writer.close()
+            minus_writer.close()
+    return [(plus_writer.path, minus_writer.path) for plus_writer, minus_writer in writers]
+
+
+@click.command()
+@click.option('-i', '--input_file', type=click.Path(exists=True), required=True, help='Path to the input TSS table file or TSS store')
+@click.option('--prefix', type=str, required=True, help='Prefix for the output file names')
+@click.option('--cache', is_flag=True, help='Load the table through a cached binary TSS store')
+@click.option('--streaming', is_flag=True, help='Read the table in two chunked passes instead of loading it whole')
+@click.option('--chunksize', type=int, default=STREAMING_CHUNKSIZE, show_default=True, help='Rows per chunk with --streaming')
+@click.option('--merge-runs', 'merge', is_flag=True, help='Collapse adjacent positions with identical values into one interval')
+@click.option('--each-sample', is_flag=True, help='Write a bedGraph pair for every sample column, named <prefix>_<sample>')
+@click.option('--columns', 'signal_columns', type=str, default=None, help='Comma-separated sample columns to sum [default: columns 4 and 5]')
+@click.option('--min-signal', type=float, default=2, show_default=True, help='Minimum summed signal of a reported position')
+@click.version_option(version=VERSION, prog_name="TSS raw table to BedGraph Converter")
+@instrumented
+def process_tss(input_file, prefix, cache, streaming, chunksize, merge, each_sample, signal_columns, min_signal):
+    outputs = process_table(input_file, prefix, chunksize if streaming else None, merge, each_sample,
+                            signal_columns.split(',') if signal_columns else None, min_signal, cache)
+    files = [path for pair in outputs for path in pair]
+    print(f"Files successfully generated: {' and '.join(files)}")
+
+if __name__ == '__main__':
+    process_tss()
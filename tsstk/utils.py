@@ -0,0 +1,645 @@
+# utils.py
+
+import os
+import io
+import sys
+import json
+import hashlib
+import time
+import zlib
+import queue
+import struct
+import pstats
+import cProfile
+import resource
+import functools
+import importlib.util
+import threading
+import collections
+import concurrent.futures
+
+import click
+import numpy as np
+import pandas as pd
+
+# Instrumentation of named stages. Tools wrap their phases in
+# ``with stage('read') as s: ...; s.rows = len(df)``; unless a command was
+# started with --profile, --stats-json or --cprofile this costs one function
+# call returning a shared no-op context manager.
+#
+# Bytes read and written come from /proc/self/io (everything passed through
+# read()/write() by this process, pipes to worker processes included) unless a
+# stage sets them itself. Peak RSS is the stage's own high-water mark where
+# Linux lets it be reset, and the process peak so far elsewhere.
+
+
+class _NullStage:
+    rows = 0
+    bytes_read = 0
+    bytes_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_STAGE = _NullStage()
+
+
+def _proc_io():
+    # Bytes passed through read()/write() calls of this process, cached or not
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(':') for line in f)
+        return int(fields['rchar']), int(fields['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def _reset_peak_rss():
+    # Linux lets a process reset its own high-water mark, giving per-stage peaks
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class StageRecord:
+    """Totals of one named stage, summed over every time it was entered."""
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.peak_rss_mb = 0.0
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'calls': self.calls,
+            'seconds': round(self.seconds, 6),
+            'rows': self.rows,
+            'rows_per_second': round(self.rows / self.seconds, 1) if self.seconds and self.rows else None,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'peak_rss_mb': round(self.peak_rss_mb, 1),
+        }
+
+
+class _ActiveStage:
+    """One entry into a stage; counts set on it are added to the stage record on exit."""
+
+    def __init__(self, stats, record):
+        self.stats = stats
+        self.record = record
+        self.rows = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.peak = 0.0
+
+    def __enter__(self):
+        self.stats._enter(self)
+        self.io = _proc_io()
+        self.profile = self.stats._start_profile()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        if self.profile is not None:
+            self.profile.disable()
+        io_after = _proc_io()
+        record = self.record
+        record.calls += 1
+        record.seconds += elapsed
+        record.rows += self.rows
+        # Explicit byte counts win over the process I/O counters
+        if self.io and io_after:
+            record.bytes_read += self.bytes_read or io_after[0] - self.io[0]
+            record.bytes_written += self.bytes_written or io_after[1] - self.io[1]
+        else:
+            record.bytes_read += self.bytes_read
+            record.bytes_written += self.bytes_written
+        self.stats._exit(self, elapsed)
+        return False
+
+
+class Stats:
+    """Per-stage wall time, rows, bytes and peak RSS of one command run."""
+
+    def __init__(self, cprofile=False):
+        self.records = {}
+        self.stack = []
+        self.cprofile = cprofile
+        self.hot_profile = None
+        self.hot_seconds = -1.0
+        self.started = time.perf_counter()
+        self.can_reset = _reset_peak_rss()
+
+    def stage(self, name):
+        record = self.records.get(name)
+        if record is None:
+            record = self.records[name] = StageRecord(name)
+        return _ActiveStage(self, record)
+
+    def add(self, name, seconds, rows=0):
+        """Record a stage timed elsewhere, e.g. in a worker process."""
+        record = self.records.get(name)
+        if record is None:
+            record = self.records[name] = StageRecord(name)
+        record.calls += 1
+        record.seconds += seconds
+        record.rows += rows
+
+    def _enter(self, active):
+        # The peak so far belongs to every enclosing stage before it is reset
+        peak = _peak_rss_mb()
+        for outer in self.stack:
+            outer.peak = max(outer.peak, peak)
+        self.stack.append(active)
+        if self.can_reset:
+            _reset_peak_rss()
+
+    def _exit(self, active, elapsed):
+        self.stack.remove(active)
+        peak = max(active.peak, _peak_rss_mb())
+        active.record.peak_rss_mb = max(active.record.peak_rss_mb, peak)
+        for outer in self.stack:
+            outer.peak = max(outer.peak, peak)
+        if active.profile is not None and elapsed > self.hot_seconds:
+            # Keep the profile of the slowest single stage entry
+            self.hot_seconds, self.hot_profile = elapsed, (active.record.name, active.profile)
+
+    def _start_profile(self):
+        # Only the stages directly inside 'total' are profiled; deeper ones are
+        # covered by their enclosing stage's profile.
+        if not self.cprofile or len(self.stack) != 2:
+            return None
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def report(self, command=None):
+        peaks = [r.peak_rss_mb for r in self.records.values()]
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / (1024 if sys.platform != 'darwin' else 1024 * 1024)
+        return {
+            'command': command,
+            'argv': sys.argv[1:],
+            'pid': os.getpid(),
+            'seconds': round(time.perf_counter() - self.started, 6),
+            'peak_rss_mb': round(max(peaks + [_peak_rss_mb()]), 1),
+            'children_peak_rss_mb': round(children, 1),
+            'stages': [r.as_dict() for r in self.records.values()],
+        }
+
+
+_current = None
+
+
+def stage(name):
+    """Context manager timing the named stage of the running command (no-op unless enabled)."""
+    if _current is None:
+        return NULL_STAGE
+    return _current.stage(name)
+
+
+def current_stats():
+    return _current
+
+
+def input_bytes(paths):
+    """Total size of input files (or store directories), for stages whose reads happen in worker processes."""
+    total = 0
+    for path in paths:
+        if os.path.isdir(path):
+            total += sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+        else:
+            total += os.path.getsize(path)
+    return total
+
+
+def file_digest(path):
+    """SHA-1 hex digest of a file's content, read in 1 MiB blocks."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def format_report(report):
+    lines = [f"{'stage':<24}{'calls':>6}{'seconds':>11}{'rows/s':>13}{'read MB':>10}{'written MB':>12}{'peak MB':>10}"]
+    for s in report['stages']:
+        rate = f"{s['rows_per_second']:,.0f}" if s['rows_per_second'] else '-'
+        lines.append(f"{s['name']:<24}{s['calls']:>6}{s['seconds']:>11.3f}{rate:>13}"
+                     f"{s['bytes_read'] / 1e6:>10.1f}{s['bytes_written'] / 1e6:>12.1f}{s['peak_rss_mb']:>10.1f}")
+    lines.append(f"total {report['seconds']:.3f} s, peak RSS {report['peak_rss_mb']:.1f} MB")
+    return '\n'.join(lines)
+
+
+def instrumented(func):
+    """Give a click command --profile, --stats-json and --cprofile options.
+
+    Put it directly above the command function, below the click decorators.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, profile=False, stats_json=None, cprofile=None, **kwargs):
+        global _current
+        if not (profile or stats_json or cprofile):
+            return func(*args, **kwargs)
+        previous, _current = _current, Stats(cprofile=bool(cprofile))
+        try:
+            with _current.stage('total'):
+                result = func(*args, **kwargs)
+        finally:
+            stats, _current = _current, previous
+            ctx = click.get_current_context(silent=True)
+            report = stats.report(ctx.command_path if ctx else func.__name__)
+            if profile:
+                click.echo(format_report(report), err=True)
+            if stats_json:
+                with open(stats_json, 'w') as f:
+                    json.dump(report, f, indent=1)
+            if cprofile and stats.hot_profile:
+                name, prof = stats.hot_profile
+                prof.dump_stats(cprofile)
+                if profile:
+                    summary = io.StringIO()
+                    pstats.Stats(prof, stream=summary).sort_stats('cumulative').print_stats(15)
+                    click.echo(f"cProfile of the slowest stage ({name}) written to {cprofile}", err=True)
+                    click.echo(summary.getvalue(), err=True)
+        return result
+
+    wrapper = click.option('--cprofile', type=click.Path(dir_okay=False), default=None,
+                           help='Write a cProfile dump of the slowest stage to this file.')(wrapper)
+    wrapper = click.option('--stats-json', type=click.Path(dir_okay=False), default=None,
+                           help='Write per-stage timing, throughput and memory statistics as JSON.')(wrapper)
+    wrapper = click.option('--profile', is_flag=True,
+                           help='Print per-stage timing, throughput and memory statistics to stderr.')(wrapper)
+    return wrapper
+
+
+# Compressed I/O shared by all tools. Inputs may be plain, gzip or BGZF (bgzip)
+# files, recognized by their magic bytes rather than their names. gzip is
+# inflated in a background thread with large reads, and BGZF blocks, being
+# independent gzip members, are inflated in parallel on a thread pool (zlib
+# releases the GIL). Outputs named *.gz or *.bgz are written as BGZF, which
+# plain gzip/zcat read and tabix can index, with blocks deflated in parallel.
+
+GZIP_MAGIC = b'\x1f\x8b'
+COMPRESSED_SUFFIXES = ('.gz', '.bgz')
+READ_SIZE = 1 << 22
+BGZF_BLOCK_SIZE = 0xff00  # uncompressed bytes per BGZF block, as written by htslib
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+DEFAULT_LEVEL = 6
+
+
+def io_threads():
+    return max(1, int(os.environ.get('TSSTK_IO_THREADS', min(4, os.cpu_count() or 1))))
+
+
+def compression_of(path):
+    """Return 'bgzf', 'gzip' or None for a file, from its first bytes."""
+    with open(path, 'rb') as f:
+        head = f.read(18)
+    if head[:2] != GZIP_MAGIC:
+        return None
+    # BGZF: a gzip member with the FEXTRA flag and a 'BC' subfield holding the block size
+    if len(head) == 18 and head[3] & 4 and head[12:14] == b'BC':
+        return 'bgzf'
+    return 'gzip'
+
+
+# The inflate functions stop as soon as ``emit`` returns False, i.e. the reader was closed
+def _inflate_gzip(raw, emit):
+    decompressor = zlib.decompressobj(31)
+    while True:
+        data = raw.read(READ_SIZE)
+        if not data:
+            break
+        while data:
+            if not emit(decompressor.decompress(data)):
+                return
+            if not decompressor.eof:
+                break
+            # Concatenated members, e.g. from `cat a.gz b.gz`
+            data = decompressor.unused_data
+            decompressor = zlib.decompressobj(31)
+    emit(decompressor.flush())
+
+
+def _inflate_blocks(blocks):
+    return b''.join(zlib.decompress(block, 31) for block in blocks)
+
+
+def _inflate_bgzf(raw, emit, threads):
+    pending = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        rest = b''
+        while True:
+            data = raw.read(READ_SIZE)
+            data = rest + data if data else rest
+            if not data:
+                break
+            blocks, offset = [], 0
+            while offset + 18 <= len(data):
+                size = struct.unpack_from('<H', data, offset + 16)[0] + 1
+                if offset + size > len(data):
+                    break
+                blocks.append(data[offset:offset + size])
+                offset += size
+            if not blocks:
+                raise OSError('truncated BGZF block')
+            rest = data[offset:]
+            pending.append(executor.submit(_inflate_blocks, blocks))
+            if len(pending) > threads and not emit(pending.popleft().result()):
+                break
+        while pending:
+            if not emit(pending.popleft().result()):
+                for future in pending:
+                    future.cancel()
+                break
+
+
+class _ThreadedReader(io.RawIOBase):
+    """Raw stream of the data a background thread inflates from a compressed file."""
+
+    def __init__(self, path, compression, threads):
+        self.raw = open(path, 'rb')
+        self.chunks = queue.Queue(maxsize=max(4, 2 * threads))
+        self.stopped = threading.Event()
+        self.chunk = memoryview(b'')
+        self.done = False
+        self.thread = threading.Thread(target=self._produce, args=(compression, threads), daemon=True)
+        self.thread.start()
+
+    def _emit(self, data):
+        # Queue data for the reading thread; False once the reader is closed
+        if not data:
+            return not self.stopped.is_set()
+        while not self.stopped.is_set():
+            try:
+                self.chunks.put(data, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self, compression, threads):
+        try:
+            if compression == 'bgzf':
+                _inflate_bgzf(self.raw, self._emit, threads)
+            else:
+                _inflate_gzip(self.raw, self._emit)
+            self._emit(EOFError())
+        except BaseException as error:  # re-raised in the reading thread
+            self._emit(error)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not len(self.chunk):
+            if self.done:
+                return 0
+            item = self.chunks.get()
+            if isinstance(item, EOFError):
+                self.done = True
+                return 0
+            if isinstance(item, BaseException):
+                self.done = True
+                raise item
+            self.chunk = memoryview(item)
+        n = min(len(buffer), len(self.chunk))
+        buffer[:n] = self.chunk[:n]
+        self.chunk = self.chunk[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.stopped.set()
+            self.thread.join()
+            self.raw.close()
+        super().close()
+
+
+def _bgzf_block(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+    header = struct.pack('<4BI2BH2BHH', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(deflated) + 25)
+    return header + deflated + struct.pack('<II', zlib.crc32(data), len(data))
+
+
+def _deflate_blocks(data, level):
+    return b''.join(_bgzf_block(data[i:i + BGZF_BLOCK_SIZE], level) for i in range(0, len(data), BGZF_BLOCK_SIZE))
+
+
+class _BGZFWriter(io.RawIOBase):
+    """Raw stream writing BGZF, with batches of blocks deflated on a thread pool."""
+
+    BATCH = 16 * BGZF_BLOCK_SIZE
+
+    def __init__(self, path, threads, level):
+        self.raw = open(path, 'wb')
+        self.level = level
+        self.threads = threads
+        self.buffer = bytearray()
+        self.pending = collections.deque()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.BATCH:
+            cut = len(self.buffer) - len(self.buffer) % BGZF_BLOCK_SIZE
+            self._submit(bytes(self.buffer[:cut]))
+            del self.buffer[:cut]
+        return len(data)
+
+    def _submit(self, data):
+        self.pending.append(self.executor.submit(_deflate_blocks, data, self.level))
+        while len(self.pending) > 2 * self.threads:
+            self.raw.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.buffer:
+                self._submit(bytes(self.buffer))
+                self.buffer.clear()
+            while self.pending:
+                self.raw.write(self.pending.popleft().result())
+            self.raw.write(BGZF_EOF)
+        finally:
+            self.executor.shutdown()
+            self.raw.close()
+            super().close()
+
+
+def open_input(path, mode='rt', threads=None):
+    """Open a plain, gzip or BGZF file for reading, inflating in background threads."""
+    compression = compression_of(path)
+    if compression is None:
+        return open(path, mode, buffering=READ_SIZE) if 'b' in mode else open(path, mode)
+    stream = io.BufferedReader(_ThreadedReader(path, compression, threads or io_threads()), READ_SIZE)
+    return stream if 'b' in mode else io.TextIOWrapper(stream, encoding='utf-8', newline='' if 'U' in mode else None)
+
+
+def is_compressed_name(path):
+    return str(path).endswith(COMPRESSED_SUFFIXES)
+
+
+def open_output(path, mode='wt', threads=None, level=DEFAULT_LEVEL, compress=None):
+    """Open a file for writing; BGZF when ``compress`` or, by default, when named *.gz or *.bgz."""
+    if compress is None:
+        compress = is_compressed_name(path)
+    if not compress:
+        return open(path, mode)
+    stream = io.BufferedWriter(_BGZFWriter(path, threads or io_threads(), level), READ_SIZE)
+    return stream if 'b' in mode else io.TextIOWrapper(stream, encoding='utf-8', newline='')
+
+
+def _close_after(handle, chunks):
+    with handle:
+        yield from chunks
+
+
+def read_csv(path, **kwargs):
+    """``pandas.read_csv`` of a plain, gzip or BGZF file through ``open_input``.
+
+    Plain files are handed to pandas directly. With ``chunksize`` a generator
+    of chunks is returned, which closes the file when exhausted.
+    """
+    if not isinstance(path, (str, os.PathLike)) or os.path.isdir(path) or compression_of(path) is None:
+        return pd.read_csv(path, **kwargs)
+    handle = open_input(path)
+    if kwargs.get('chunksize') or kwargs.get('iterator'):
+        return _close_after(handle, pd.read_csv(handle, **kwargs))
+    with handle:
+        return pd.read_csv(handle, **kwargs)
+
+
+# Schemas of the tables the tools exchange. Chromosome, strand and other
+# low-cardinality labels load as categoricals and coordinates as int32. In a
+# schema with ``counts`` every other column holds per-sample counts: missing
+# values become 0 and they are stored as int32 when they fit (int64 otherwise,
+# float when not integral). Tables without a header get ``names``.
+SCHEMAS = {
+    'tss': {'dtype': {'chr': 'category', 'pos': 'int32', 'strand': 'category'}, 'counts': True},
+    'cluster': {'dtype': {'cluster': 'int32', 'chr': 'category', 'start': 'int32', 'end': 'int32',
+                          'strand': 'category', 'dominant_tss': 'int32', 'tags': 'float64',
+                          'tags.dominant_tss': 'float64'}},
+    'gene_region': {'names': ['chromosome', 'gene_start', 'gene_end', 'strand', 'gene_id'],
+                    'dtype': {'chromosome': 'category', 'gene_start': 'int32', 'gene_end': 'int32',
+                              'strand': 'category', 'gene_id': str}},
+    'bedgraph': {'names': ['chr', 'start', 'end', 'value'],
+                 'dtype': {'chr': 'category', 'start': 'int32', 'end': 'int32', 'value': 'float64'}},
+}
+
+
+def has_pyarrow():
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def compact_counts(df, skip=()):
+    """Fill missing counts with 0 and store every count column as int32 when it fits."""
+    limit = np.iinfo(np.int32)
+    for col in df.columns:
+        if col in skip or not pd.api.types.is_numeric_dtype(df[col].dtype) or df[col].dtype == np.int32:
+            continue
+        values = df[col].fillna(0).to_numpy()
+        if values.dtype.kind == 'f' and not np.array_equal(values, np.round(values)):
+            df[col] = values
+        elif not len(values) or (values.min() >= limit.min and values.max() <= limit.max):
+            df[col] = values.astype(np.int32)
+        else:
+            df[col] = values.astype(np.int64)
+    return df
+
+
+def _conform(df, schema, dtype=None):
+    if dtype:
+        df = df.astype({col: t for col, t in dtype.items() if col in df.columns})
+    if schema.get('counts'):
+        compact_counts(df, skip=schema['dtype'])
+    return df
+
+
+def _read_pyarrow(path, schema, names, usecols, keep_default_na=True):
+    """Parse a whole table with pyarrow's multithreaded CSV reader.
+
+    The schema's columns get their types up front, so labels stay strings
+    (``1`` is a chromosome name and ``000123`` a gene ID, not numbers) and are
+    made categorical afterwards; count columns are inferred, and missing
+    counts come back as NaN for compact_counts() to fill.
+    """
+    import pyarrow as pa
+    from pyarrow import csv
+
+    types = {'category': pa.string(), str: pa.string(), 'int32': pa.int32(), 'float64': pa.float64()}
+    convert = csv.ConvertOptions(column_types={col: types[t] for col, t in schema['dtype'].items()},
+                                 include_columns=usecols, strings_can_be_null=keep_default_na)
+    if not keep_default_na:
+        convert.null_values = []
+    read = csv.ReadOptions(column_names=names)
+    parse = csv.ParseOptions(delimiter='\t')
+    if compression_of(path):
+        with open_input(path, 'rb') as handle:
+            table = csv.read_csv(handle, read_options=read, parse_options=parse, convert_options=convert)
+    else:
+        table = csv.read_csv(path, read_options=read, parse_options=parse, convert_options=convert)
+    # Columns without any value are NaN floats, as pandas reads them
+    for i, field in enumerate(table.schema):
+        if pa.types.is_null(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(pa.float64()))
+    df = table.to_pandas()
+    labels = {col: 'category' for col, t in schema['dtype'].items() if t == 'category'}
+    return _conform(df, schema, labels)
+
+
+def read_table(path, schema, columns=None, chunksize=None, **kwargs):
+    """Read a tab-separated table of a known schema (see SCHEMAS) with compact dtypes.
+
+    ``columns`` restricts the columns parsed. A whole file is parsed with the
+    multithreaded pyarrow engine when pyarrow is installed; with ``chunksize``
+    a generator of DataFrames is returned instead. Files may be gzip or BGZF
+    compressed. Other keyword arguments go to ``pandas.read_csv``.
+    """
+    schema = SCHEMAS[schema]
+    options = {'sep': '\t', 'names': schema.get('names'), 'header': None if schema.get('names') else 'infer'}
+    options.update(kwargs)
+    if columns is not None:
+        options['usecols'] = list(columns)
+    wanted = set(columns) if columns is not None else None
+    options['dtype'] = {col: dtype for col, dtype in schema['dtype'].items() if wanted is None or col in wanted}
+    if chunksize:
+        return (_conform(chunk, schema) for chunk in read_csv(path, chunksize=chunksize, **options))
+    # Other read_csv options have no pyarrow counterpart here; they use the C engine
+    if (has_pyarrow() and not set(kwargs) - {'keep_default_na'} and isinstance(path, (str, os.PathLike))
+            and not os.path.isdir(path)):
+        return _read_pyarrow(path, schema, options['names'], options.get('usecols'),
+                             kwargs.get('keep_default_na', True))
+    return _conform(read_csv(path, **options), schema)